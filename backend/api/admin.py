@@ -54,7 +54,7 @@ class ConstructorProfileAdmin(admin.ModelAdmin):
             'fields': ('company_name', 'phone', 'address')
         }),
         (_('Location'), {
-            'fields': ('city', 'region', 'country')
+            'fields': ('city', 'region', 'country', 'latitude', 'longitude')
         }),
         (_('Timestamps'), {
             'fields': ('created_at', 'updated_at'),
@@ -85,7 +85,7 @@ class ProviderProfileAdmin(admin.ModelAdmin):
             'fields': ('company_name', 'description', 'logo', 'phone', 'website')
         }),
         (_('Location'), {
-            'fields': ('address', 'city', 'region', 'country')
+            'fields': ('address', 'city', 'region', 'country', 'latitude', 'longitude')
         }),
         (_('Subscription'), {
             'fields': ('subscription_status', 'subscription_start_date', 'subscription_end_date')
@@ -162,7 +162,7 @@ class ChatRoomAdmin(admin.ModelAdmin):
     list_display = ['id', 'get_participants', 'created_at', 'updated_at', 'get_message_count']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['participants__email', 'participants__username']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['direct_user_low', 'direct_user_high', 'created_at', 'updated_at']
     filter_horizontal = ['participants']
     
     def get_participants(self, obj):
@@ -177,18 +177,17 @@ class ChatRoomAdmin(admin.ModelAdmin):
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     """Admin interface for Messages"""
-    list_display = ['id', 'get_author', 'get_room', 'get_content_preview', 'timestamp', 'read']
-    list_filter = ['read', 'timestamp']
+    list_display = ['id', 'get_author', 'get_room', 'get_content_preview', 'timestamp']
+    list_filter = ['timestamp']
     search_fields = ['content', 'author__email', 'author__username']
     readonly_fields = ['timestamp']
-    list_editable = ['read']
     
     fieldsets = (
         (_('Message Details'), {
             'fields': ('room', 'author', 'content')
         }),
         (_('Status'), {
-            'fields': ('read', 'timestamp')
+            'fields': ('timestamp',)
         }),
     )
     
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+    
+    def ready(self):
+        # Register signal handlers and system checks
+        from . import signals  # noqa: F401
+        from . import presence  # noqa: F401
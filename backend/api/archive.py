@@ -0,0 +1,367 @@
+"""
+Hot and cold tiers of chat messages.
+
+Recent messages live in Message (the hot tier). The archive_messages command
+moves older ones, room by room, into MessageArchiveSegment rows (the cold
+tier): blocks of up to SEGMENT_SIZE consecutive messages stored as
+zlib-compressed msgpack, in the database or under MEDIA_ROOT. Every
+inbox, unread count and history query then runs on a table that only
+grows with recent traffic.
+
+A room's cold messages are always older (lower ids) than its hot ones:
+archiving takes the oldest hot messages and restoring gives back the newest
+segments first. This, and comparing ids with read watermarks, relies on ids
+following the order messages were sent in (message_writer.py): no message
+written later can get an id below an archived one. History reads the hot tier first and continues into the
+segments only when it runs out (history.load_window/load_since,
+message_search), and walks forward from the segments into the hot tier
+(history.load_after), so callers see one sequence of messages by id. Decoded
+segments are kept in a small per-process cache; segments never change
+once written.
+
+A segment row keeps only a message's id, author, content and timestamp
+(ARCHIVED_FIELDS, with the room on the segment); restore_room() writes back
+exactly those. A field added to Message fails the api.E001 system check
+until the segment format carries it too.
+
+A message is archived when it is older than AFTER_DAYS, is not among the
+room's KEEP_RECENT latest and every other participant has read it, so the
+inbox, read receipts and unread counts never need the cold tier. A room's
+archivable messages are only moved once there are at least MIN_SEGMENT
+of them. Archived messages are read-only.
+
+CHAT_ARCHIVE options: AFTER_DAYS, KEEP_RECENT, SEGMENT_SIZE, MIN_SEGMENT,
+STORAGE ('database' or 'file'), CACHE_SEGMENTS, COMPRESSION_LEVEL.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import msgpack
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import checks
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from . import memberships, read_receipts
+from .models import Message, MessageArchiveSegment
+
+User = get_user_model()
+
+DEFAULTS = {
+    'AFTER_DAYS': 90,
+    'KEEP_RECENT': 200,
+    'SEGMENT_SIZE': 1000,
+    'MIN_SEGMENT': 100,
+    'STORAGE': 'database',
+    'CACHE_SEGMENTS': 64,
+    'COMPRESSION_LEVEL': 6,
+}
+
+STORAGES = ('database', 'file')
+# Message fields a segment keeps, the room on the segment itself
+ARCHIVED_FIELDS = {'id', 'room', 'author', 'content', 'timestamp'}
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'CHAT_ARCHIVE', {}))
+
+
+@checks.register(checks.Tags.models)
+def check_archived_fields(app_configs=None, **kwargs):
+    """Archiving would silently drop a Message field segments don't store"""
+    fields = {field.name for field in Message._meta.concrete_fields}
+    if fields == ARCHIVED_FIELDS:
+        return []
+    return [checks.Error(
+        f'Message fields {sorted(fields ^ ARCHIVED_FIELDS)} do not match the fields archive segments store.',
+        hint='Update encode(), decode(), to_message(), restore_room() and ARCHIVED_FIELDS in api/archive.py.',
+        obj=Message,
+        id='api.E001',
+    )]
+
+
+# ==================== ENCODING ====================
+
+def encode(messages, level):
+    """Compressed payload of messages, oldest first"""
+    rows = [
+        [message.pk, message.author_id, message.content, (message.timestamp - EPOCH) // timedelta(microseconds=1)]
+        for message in messages
+    ]
+    return zlib.compress(msgpack.packb(rows, use_bin_type=True), level)
+
+
+def decode(payload):
+    """[(id, author id, content, timestamp)] of a payload, oldest first"""
+    return [
+        (message_id, author_id, content, EPOCH + timedelta(microseconds=micros))
+        for message_id, author_id, content, micros in msgpack.unpackb(zlib.decompress(payload), raw=False)
+    ]
+
+
+class SegmentCache:
+    """Decoded rows of recently read segments, by segment id"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, segment_id):
+        with self.lock:
+            rows = self.entries.get(segment_id)
+            if rows is not None:
+                self.entries.move_to_end(segment_id)
+            return rows
+
+    def set(self, segment_id, rows):
+        size = get_config()['CACHE_SEGMENTS']
+        with self.lock:
+            self.entries[segment_id] = rows
+            self.entries.move_to_end(segment_id)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def forget(self, segment_id):
+        with self.lock:
+            self.entries.pop(segment_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+cache = SegmentCache()
+
+
+def read_payload(segment):
+    if segment.file:
+        with segment.file.open('rb') as payload:
+            return payload.read()
+    return bytes(segment.data)
+
+
+def segment_rows(segment):
+    rows = cache.get(segment.pk)
+    if rows is None:
+        rows = decode(read_payload(segment))
+        cache.set(segment.pk, rows)
+    return rows
+
+
+def to_message(room_id, row):
+    message_id, author_id, content, timestamp = row
+    message = Message(id=message_id, room_id=room_id, author_id=author_id, content=content, timestamp=timestamp)
+    message._state.adding = False
+    message._state.db = 'default'
+    return message
+
+
+# ==================== READS ====================
+
+def load_range(room_id, after_id=None, before_id=None, limit=None, oldest_first=False):
+    """
+    Archived messages of the room with after_id < id < before_id, newest
+    first (oldest first with oldest_first), at most limit of them
+    """
+    segments = MessageArchiveSegment.objects.filter(room_id=room_id).defer('data')
+    if before_id is not None:
+        segments = segments.filter(first_message_id__lt=before_id)
+    if after_id is not None:
+        segments = segments.filter(last_message_id__gt=after_id)
+
+    if oldest_first:
+        segments = segments.order_by('first_message_id')
+        # Rows past the far end stop the walk, rows before the near end are skipped
+        near, far = after_id, before_id
+    else:
+        segments = segments.order_by('-last_message_id')
+        near, far = before_id, after_id
+
+    messages = []
+    for segment in segments.iterator(chunk_size=10):
+        rows = segment_rows(segment)
+        for row in (rows if oldest_first else reversed(rows)):
+            message_id = row[0]
+            if near is not None and (message_id <= near if oldest_first else message_id >= near):
+                continue
+            if far is not None and (message_id >= far if oldest_first else message_id <= far):
+                return messages
+            messages.append(to_message(room_id, row))
+            if limit is not None and len(messages) >= limit:
+                return messages
+    return messages
+
+
+def has_segments(room_id):
+    return MessageArchiveSegment.objects.filter(room_id=room_id).exists()
+
+
+def load_messages(room_ids):
+    """{message id: Message} of archived messages, given {message id: room id}"""
+    by_room = {}
+    for message_id, room_id in room_ids.items():
+        by_room.setdefault(room_id, set()).add(message_id)
+
+    found = {}
+    for room_id, message_ids in by_room.items():
+        segments = MessageArchiveSegment.objects.filter(
+            room_id=room_id,
+            first_message_id__lte=max(message_ids),
+            last_message_id__gte=min(message_ids)
+        ).defer('data')
+        for segment in segments:
+            for row in segment_rows(segment):
+                if row[0] in message_ids:
+                    found[row[0]] = to_message(room_id, row)
+    return found
+
+
+def attach_authors(messages):
+    """
+    Set message.author on archived messages with one query. Messages of
+    deleted users are left out, as the cascade does in the hot tier.
+    """
+    authors = User.objects.in_bulk({message.author_id for message in messages})
+    found = []
+    for message in messages:
+        author = authors.get(message.author_id)
+        if author is not None:
+            message.author = author
+            found.append(message)
+    return found
+
+
+# ==================== MOVING BETWEEN TIERS ====================
+
+def archivable(room_id, config, now=None):
+    """
+    The room's oldest hot messages that may be archived, oldest first, at
+    most SEGMENT_SIZE of them
+    """
+    keep = max(config['KEEP_RECENT'], 1)
+    hot = Message.objects.filter(room_id=room_id)
+    boundary = list(hot.order_by('-pk').values_list('pk', flat=True)[keep - 1:keep])
+    if not boundary:
+        return []
+
+    cutoff = (now or timezone.now()) - timedelta(days=config['AFTER_DAYS'])
+    read_up_to = read_receipts.watermarks([room_id]).get(room_id, {})
+    participants = memberships.participant_ids(room_id)
+
+    messages = []
+    candidates = hot.filter(pk__lt=boundary[0]).order_by('pk').only('pk', 'author_id', 'timestamp')
+    for message in candidates[:config['SEGMENT_SIZE']]:
+        if message.timestamp >= cutoff:
+            break
+        if any(read_up_to.get(user_id, 0) < message.pk for user_id in participants if user_id != message.author_id):
+            break
+        messages.append(message)
+    return messages
+
+
+def archive_room(room_id, config=None, now=None, max_segments=None):
+    """
+    Move the room's archivable messages into segments, one transaction per
+    segment. Returns (segments written, messages moved).
+    """
+    config = config or get_config()
+    if config['STORAGE'] not in STORAGES:
+        raise ValueError(f"CHAT_ARCHIVE['STORAGE'] must be one of {STORAGES}")
+
+    segments = 0
+    moved = 0
+    while max_segments is None or segments < max_segments:
+        candidates = archivable(room_id, config, now)
+        if len(candidates) < max(config['MIN_SEGMENT'], 1):
+            break
+        count = write_segment(room_id, [message.pk for message in candidates], config)
+        if not count:
+            break
+        segments += 1
+        moved += count
+    return segments, moved
+
+
+def write_segment(room_id, message_ids, config):
+    """Write one segment with these messages and delete them from Message"""
+    stored = None
+    try:
+        with transaction.atomic():
+            messages = list(
+                Message.objects.select_for_update().filter(room_id=room_id, pk__in=message_ids).order_by('pk')
+            )
+            if len(messages) != len(message_ids):
+                # Deleted meanwhile; the next pass picks up what is left
+                return 0
+
+            segment = MessageArchiveSegment(
+                room_id=room_id,
+                first_message_id=messages[0].pk,
+                last_message_id=messages[-1].pk,
+                message_count=len(messages),
+                first_timestamp=messages[0].timestamp,
+                last_timestamp=messages[-1].timestamp
+            )
+            payload = encode(messages, config['COMPRESSION_LEVEL'])
+            if config['STORAGE'] == 'file':
+                segment.file.save(
+                    f'{room_id}/{segment.first_message_id}-{segment.last_message_id}.bin',
+                    ContentFile(payload),
+                    save=False
+                )
+                stored = segment.file.name
+            else:
+                segment.data = payload
+            segment.save()
+            Message.objects.filter(pk__in=message_ids).delete()
+    except Exception:
+        if stored:
+            segment.file.storage.delete(stored)
+        raise
+    return len(messages)
+
+
+def restore_room(room_id, max_segments=None):
+    """
+    Move the room's segments back into Message, newest first, one
+    transaction per segment. Returns (segments restored, messages moved).
+    """
+    segments = 0
+    moved = 0
+    queryset = MessageArchiveSegment.objects.filter(room_id=room_id).order_by('-last_message_id')
+    while max_segments is None or segments < max_segments:
+        segment = queryset.first()
+        if segment is None:
+            break
+        segment_id = segment.pk
+        with transaction.atomic():
+            messages = [
+                Message(id=message_id, room_id=room_id, author_id=author_id, content=content, timestamp=timestamp)
+                for message_id, author_id, content, timestamp in decode(read_payload(segment))
+            ]
+            Message.objects.bulk_create(messages, batch_size=500)
+            segment.delete()
+        cache.forget(segment_id)
+        segments += 1
+        moved += len(messages)
+    return segments, moved
+
+
+def stats():
+    """Messages in each tier and number of segments"""
+    totals = MessageArchiveSegment.objects.aggregate(
+        segments=Count('id'),
+        messages=Sum('message_count')
+    )
+    return {
+        'hot_messages': Message.objects.count(),
+        'archived_messages': totals['messages'] or 0,
+        'segments': totals['segments'],
+    }
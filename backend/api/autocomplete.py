@@ -0,0 +1,372 @@
+"""
+In-memory prefix index for search box typeahead.
+
+Suggestions are company names, machine names, brands, models and cities of
+searchable (active, verified) providers. Every word start of a suggestion is
+kept in a sorted array of accent-folded keys, so "320" finds "CAT 320" and
+"grua" finds "Grúa Horquilla"; a prefix lookup is a bisect plus a scan of
+the matching range, without touching the database.
+
+Suggestions are weighted by popularity, i.e. how many listings use them:
+machines for names, brands and models, providers for cities, and
+1 + machines for a company.
+
+The index is built from ProviderProfile and Machine on first use in each
+process and kept up to date by the signal handlers in signals.py. Changes
+made by other processes are picked up by a background rebuild every
+AUTOCOMPLETE_REBUILD_INTERVAL seconds; changes signalled while a rebuild
+reads the tables are replayed on the new index before it replaces the old.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+from .models import ProviderProfile, Machine
+from .text_search import WORD_RE, fold
+
+KINDS = ['company', 'machine', 'brand', 'model', 'city']
+
+# Prefixes matching more keys than this keep a ranked top list per kind,
+# updated in place as weights grow, instead of scanning their range
+LARGE_RANGE = 200
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+
+def get_rebuild_interval():
+    return getattr(settings, 'AUTOCOMPLETE_REBUILD_INTERVAL', 600)
+
+
+def is_searchable(subscription_status, is_verified):
+    return subscription_status == 'active' and is_verified
+
+
+def search_keys(text):
+    """Folded keys for every word start of text ("CAT 320" -> "cat 320", "320")"""
+    words = WORD_RE.findall(fold(text or ''))
+    return {' '.join(words[position:]) for position in range(len(words))}
+
+
+def provider_terms(provider_id, company_name, city):
+    """{term key: (kind, text, weight)} contributed by a searchable provider"""
+    terms = {('company', provider_id): ('company', company_name, 1)}
+    if city:
+        terms[('city', fold(city))] = ('city', city, 1)
+    return terms
+
+
+def machine_terms(provider_id, name, brand, model):
+    """{term key: (kind, text, weight)} contributed by a machine"""
+    # Counts towards its company's popularity; the name comes from the provider
+    terms = {('company', provider_id): ('company', None, 1)}
+    for kind, text in (('machine', name), ('brand', brand), ('model', model)):
+        if text:
+            terms[(kind, fold(text))] = (kind, text, 1)
+    return terms
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index of weighted suggestions.
+
+    Each source (a provider or machine) contributes weighted terms;
+    identical terms from several sources share an entry whose weight is the
+    sum of their contributions, so updates are applied as deltas.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Updates received while build() runs, as (method name, argument)
+        self.journal = None
+        self.clear()
+
+    def clear(self):
+        # term key -> [kind, text, weight]
+        self.terms = {}
+        # sorted (folded key, term key) pairs
+        self.keys = []
+        # (source kind, pk) -> contributed terms
+        self.sources = {}
+        self.searchable = set()
+        # prefix -> {kind or None: top term keys}, for large ranges
+        self.top = {}
+        self.loading = False
+        self.built_at = None
+
+    # ---------- building ----------
+
+    def build(self):
+        """Load every searchable provider and its machines"""
+        with self.lock:
+            self.journal = []
+        try:
+            fresh = self._load()
+            with self.lock:
+                # Updates are idempotent, so replaying one the load already saw is harmless
+                for method, argument in self.journal:
+                    getattr(fresh, method)(argument)
+                self.terms = fresh.terms
+                self.keys = fresh.keys
+                self.sources = fresh.sources
+                self.searchable = fresh.searchable
+                self.top = fresh.top
+                self.built_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.journal = None
+
+    def _load(self):
+        """A new index with every searchable provider and its machines"""
+        providers = ProviderProfile.objects.filter(
+            subscription_status='active',
+            is_verified=True
+        ).values_list('pk', 'company_name', 'city')
+        machines = Machine.objects.filter(
+            provider__subscription_status='active',
+            provider__is_verified=True
+        ).values_list('pk', 'provider_id', 'name', 'brand', 'model')
+
+        fresh = PrefixIndex()
+        # Append keys unsorted while loading and sort them once at the end
+        fresh.loading = True
+        for pk, company_name, city in providers.iterator():
+            fresh.searchable.add(pk)
+            fresh._replace(('provider', pk), provider_terms(pk, company_name, city))
+        for pk, provider_id, name, brand, model in machines.iterator():
+            fresh._replace(('machine', pk), machine_terms(provider_id, name, brand, model))
+        fresh.keys.sort()
+        fresh.loading = False
+
+        # Rank every large range up front so no request pays for the scan
+        length = 1
+        while True:
+            sizes = Counter(key[:length] for key, _term_key in fresh.keys if len(key) >= length)
+            large = [prefix for prefix, size in sizes.items() if size > LARGE_RANGE]
+            if not large:
+                break
+            for prefix in large:
+                fresh.suggest(prefix)
+            length += 1
+        return fresh
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    # ---------- updates ----------
+
+    def _rank(self, term_key):
+        # Most popular first, then alphabetical
+        _kind, text, weight = self.terms[term_key]
+        return (-weight, text.lower())
+
+    def _top_lists(self, term_key, text):
+        """Top lists of the prefixes of text's keys, with their prefix"""
+        for key in search_keys(text):
+            for length in range(1, len(key) + 1):
+                entry = self.top.get(key[:length])
+                if entry is not None:
+                    yield key[:length], entry
+
+    def _promote(self, term_key, text):
+        """Merge a term whose weight grew into the top lists containing it"""
+        for _prefix, entry in self._top_lists(term_key, text):
+            for group in (None, term_key[0]):
+                ranked = entry.setdefault(group, [])
+                if term_key not in ranked:
+                    ranked.append(term_key)
+                ranked.sort(key=self._rank)
+                del ranked[MAX_LIMIT:]
+
+    def _demote(self, term_key, text):
+        """Drop the top lists a term that shrank or went away was part of"""
+        stale = [
+            prefix for prefix, entry in self._top_lists(term_key, text)
+            if any(term_key in ranked for ranked in entry.values())
+        ]
+        for prefix in stale:
+            self.top.pop(prefix, None)
+
+    def _add_keys(self, term_key, text):
+        for key in search_keys(text):
+            if self.loading:
+                self.keys.append((key, term_key))
+            else:
+                bisect.insort(self.keys, (key, term_key))
+
+    def _remove_keys(self, term_key, text):
+        for key in search_keys(text):
+            position = bisect.bisect_left(self.keys, (key, term_key))
+            if position < len(self.keys) and self.keys[position] == (key, term_key):
+                del self.keys[position]
+
+    def _change(self, term_key, kind, text, delta):
+        term = self.terms.get(term_key)
+        if term is None:
+            term = self.terms[term_key] = [kind, None, 0]
+
+        # The first spelling of a shared term wins; company names follow
+        # the provider profile
+        if text and (term[1] is None or (kind == 'company' and text != term[1])):
+            if term[1] is not None:
+                self._demote(term_key, term[1])
+                self._remove_keys(term_key, term[1])
+            term[1] = text
+            self._add_keys(term_key, text)
+
+        term[2] += delta
+        if term[1] is None:
+            return
+        if term[2] <= 0:
+            self._demote(term_key, term[1])
+            self._remove_keys(term_key, term[1])
+            del self.terms[term_key]
+        elif delta > 0:
+            self._promote(term_key, term[1])
+        else:
+            self._demote(term_key, term[1])
+
+    def _record(self, method, argument):
+        if self.journal is not None:
+            self.journal.append((method, argument))
+
+    def _replace(self, source, terms):
+        """Swap the terms contributed by a source"""
+        for term_key, (kind, _text, weight) in self.sources.pop(source, {}).items():
+            self._change(term_key, kind, None, -weight)
+        for term_key, (kind, text, weight) in terms.items():
+            self._change(term_key, kind, text, weight)
+        if terms:
+            self.sources[source] = terms
+
+    def index_provider(self, provider):
+        searchable = is_searchable(provider.subscription_status, provider.is_verified)
+        with self.lock:
+            self._record('index_provider', provider)
+            was_searchable = provider.pk in self.searchable
+            if searchable:
+                self.searchable.add(provider.pk)
+                terms = provider_terms(provider.pk, provider.company_name, provider.city)
+            else:
+                self.searchable.discard(provider.pk)
+                terms = {}
+            self._replace(('provider', provider.pk), terms)
+
+        # The provider's machines appear and disappear with it
+        if searchable != was_searchable:
+            machines = list(Machine.objects.filter(provider_id=provider.pk).values_list(
+                'pk', 'name', 'brand', 'model'
+            ))
+            with self.lock:
+                for pk, name, brand, model in machines:
+                    terms = machine_terms(provider.pk, name, brand, model) if searchable else {}
+                    self._replace(('machine', pk), terms)
+
+    def remove_provider(self, pk):
+        with self.lock:
+            self._record('remove_provider', pk)
+            self.searchable.discard(pk)
+            self._replace(('provider', pk), {})
+
+    def index_machine(self, machine):
+        with self.lock:
+            self._record('index_machine', machine)
+            terms = {}
+            if machine.provider_id in self.searchable:
+                terms = machine_terms(machine.provider_id, machine.name, machine.brand, machine.model)
+            self._replace(('machine', machine.pk), terms)
+
+    def remove_machine(self, pk):
+        with self.lock:
+            self._record('remove_machine', pk)
+            self._replace(('machine', pk), {})
+
+    # ---------- lookups ----------
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT, kinds=None):
+        """
+        Most popular suggestions with a word starting with prefix.
+
+        Returns [{'kind', 'text', 'weight'(, 'id')}, ...] by descending
+        weight; company suggestions include the provider id.
+        """
+        key = ' '.join(WORD_RE.findall(fold(prefix or '')))
+        if not key:
+            return []
+        kinds = tuple(sorted(kinds)) if kinds else None
+
+        with self.lock:
+            entry = self.top.get(key)
+            if entry is None:
+                low = bisect.bisect_left(self.keys, (key,))
+                # Keys only contain [a-z0-9 ], so '~' sorts after all of them
+                high = bisect.bisect_left(self.keys, (key + '~',), low)
+                matches = {term_key for _key, term_key in self.keys[low:high]}
+                if high - low > LARGE_RANGE:
+                    entry = self.top[key] = self._build_top(matches)
+
+            if entry is not None:
+                groups = [None] if kinds is None else kinds
+                matches = {term_key for group in groups for term_key in entry.get(group, [])}
+            elif kinds is not None:
+                matches = {term_key for term_key in matches if term_key[0] in kinds}
+
+            best = heapq.nsmallest(limit, matches, key=self._rank)
+            results = []
+            for term_key in best:
+                kind, text, weight = self.terms[term_key]
+                suggestion = {'kind': kind, 'text': text, 'weight': weight}
+                if kind == 'company':
+                    suggestion['id'] = term_key[1]
+                results.append(suggestion)
+            return results
+
+    def _build_top(self, matches):
+        entry = {}
+        for group in [None] + KINDS:
+            candidates = matches if group is None else [
+                term_key for term_key in matches if term_key[0] == group
+            ]
+            entry[group] = heapq.nsmallest(MAX_LIMIT, candidates, key=self._rank)
+        return entry
+
+
+_index = PrefixIndex()
+_build_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def _rebuild():
+    try:
+        _index.build()
+    finally:
+        _rebuilding.clear()
+        # The thread opened its own database connection
+        connection.close()
+
+
+def get_index():
+    """
+    The process-wide index, built on first use and rebuilt in the
+    background once it is older than AUTOCOMPLETE_REBUILD_INTERVAL.
+    """
+    if not _index.is_built:
+        with _build_lock:
+            if not _index.is_built:
+                _index.build()
+    elif time.monotonic() - _index.built_at > get_rebuild_interval() and not _rebuilding.is_set():
+        _rebuilding.set()
+        threading.Thread(target=_rebuild, name='autocomplete-rebuild', daemon=True).start()
+    return _index
+
+
+def get_index_if_built():
+    """The index for signal handlers, or None if this process has none yet"""
+    return _index if _index.is_built else None
@@ -1,161 +1,615 @@
 """
 WebSocket consumers for real-time chat functionality.
+
+- ChatConsumer (ws/chat/<room_id>/): one socket per chat room.
+- UserChatConsumer (ws/chat/): one socket per user for all of their rooms.
+  Frames carry the room_id, and rooms can be subscribed to and unsubscribed
+  from while connected.
+
+Both can resume from the last message a client has seen and receive only
+the missing ones (see history.py), and carry presence and typing indicators
+(see presence.py). What a client may send, and how much may queue up for a
+slow one, is limited as described in limits.py. Broadcast frames arrive
+already encoded (see frames.py); ?format=msgpack switches a socket to
+binary frames.
 """
 
-import json
+import asyncio
+from collections import deque
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message
+from . import db_pool, frames, history, limits, memberships, message_writer, presence, read_receipts
 
 User = get_user_model()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+def room_group_name(room_id):
+    return f'chat_{room_id}'
+
+
+def parse_id(value):
+    """Positive integer id (room or message) from a frame or query value, or None"""
+    try:
+        message_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return message_id if message_id > 0 else None
+
+
+class BaseChatConsumer(AsyncWebsocketConsumer):
     """
-    WebSocket consumer for handling real-time chat messages.
+    Sending, acknowledging and read receipts shared by the chat consumers.
     
-    When a user connects to a chat room, they join a channel group.
-    Messages sent by any user in the room are broadcast to all participants.
+    Subclasses decide which rooms the socket joins (join_rooms) and which
+    room an incoming frame is for (get_frame_room).
     """
     
     async def connect(self):
         """Handle WebSocket connection"""
-        self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'chat_{self.room_id}'
+        self.writer = message_writer.get_writer()
+        self.rooms = set()
         
-        # Get the user from the scope (authenticated via JWT)
+        # Debounced read receipts: {room id: highest message id reported
+        # and not yet written}, and the highest id seen per room
+        self.pending_reads = {}
+        self.read_flush_handle = None
+        self.latest_message_ids = {}
+        
+        # Background tasks, referenced until done: receipt writes (waited
+        # for on disconnect) and persisted acknowledgements (cancelled)
+        self.read_tasks = set()
+        self.ack_tasks = set()
+        
+        # {room id: ids just sent as history}, to drop their live copies,
+        # and the second reads of resumes from the database
+        self.synced_ids = {}
+        self.resync_tasks = {}
+        
+        # Rooms the user is typing in from this socket
+        self.typing_rooms = set()
+        self.present = False
+        
+        # Rate limits and the frames waiting to be sent (limits.py)
+        self.limits = limits.get_config()
+        self.frame_bucket = limits.TokenBucket(self.limits['FRAME_RATE'], self.limits['FRAME_BURST'])
+        self.message_bucket = None
+        self.strikes = 0
+        self.outbox = deque()
+        self.outbox_task = None
+        self.closing = False
+        
+        # Frames in msgpack instead of JSON, if asked for and enabled
+        self.query = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        self.binary = (self.query.get('format') or [None])[0] == 'msgpack' and frames.binary_enabled()
+        
+        # Get the user from the scope (authenticated via JWT, see middleware.py)
         self.user = self.scope.get('user')
         
         if not self.user or not self.user.is_authenticated:
             await self.close()
             return
         
-        # Verify user is a participant in this room
-        is_participant = await self.check_room_participant(self.room_id, self.user.id)
-        if not is_participant:
+        if not await self.join_rooms():
             await self.close()
             return
         
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Echo the subprotocol the token was sent with, if any
+        await self.accept(subprotocol=self.scope.get('auth_subprotocol'))
+        self.message_bucket = limits.acquire_user_bucket(self.user.id, self.limits)
         
-        await self.accept()
+        presence.registry.connect(self.user.id, self.rooms)
+        presence.registry.ensure_ticker()
+        self.present = True
+        
+        await self.resume()
+    
+    async def join_rooms(self):
+        """Join the rooms the socket starts with; False rejects the connection"""
+        raise NotImplementedError
+    
+    async def resume(self):
+        """Send what the client missed, once connected"""
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Write receipts still waiting for their debounce, and wait for
+        # those being written; acknowledgements can't be delivered any more
+        if getattr(self, 'pending_reads', None):
+            await self.flush_read_receipts()
+        if getattr(self, 'read_tasks', None):
+            await asyncio.gather(*self.read_tasks, return_exceptions=True)
+        for task in list(getattr(self, 'ack_tasks', ())):
+            task.cancel()
+        
+        if getattr(self, 'present', False):
+            for room_id in self.typing_rooms:
+                presence.registry.set_typing(room_id, self.user.id, False)
+            presence.registry.disconnect(self.user.id)
+        
+        if getattr(self, 'message_bucket', None) is not None:
+            limits.release_user_bucket(self.user.id)
+            self.message_bucket = None
+        if getattr(self, 'outbox_task', None) is not None:
+            self.outbox_task.cancel()
+        
+        # Leave room groups
+        for room_id in list(getattr(self, 'rooms', ())):
+            await self.leave_room(room_id)
+    
+    async def join_room(self, room_id):
+        await self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+        self.rooms.add(room_id)
+        history.watch(room_id)
+        if self.present:
+            presence.registry.add_room(self.user.id, room_id)
     
-    async def receive(self, text_data):
+    async def leave_room(self, room_id):
+        await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+        self.rooms.discard(room_id)
+        self.latest_message_ids.pop(room_id, None)
+        self.synced_ids.pop(room_id, None)
+        self.cancel_resync(room_id)
+        history.unwatch(room_id)
+        if room_id in self.typing_rooms:
+            self.typing_rooms.discard(room_id)
+            presence.registry.set_typing(room_id, self.user.id, False)
+    
+    async def sync_room(self, room_id, last_seen_id):
+        """
+        Send the messages missed since last_seen_id (history.py) in history
+        frames of CHAT_HISTORY_CHUNK_SIZE, from the room's buffer when it
+        covers them. The last frame has complete=true; truncated=true means
+        there were more than CHAT_HISTORY_SYNC_LIMIT and the older ones were
+        left out.
+        """
+        limit = history.get_sync_limit()
+        events = history.buffered_since(room_id, last_seen_id)
+        if events is None:
+            events, truncated = await db_pool.run(history.load_since, room_id, last_seen_id, limit)
+            if self.writer.write_behind:
+                # Messages broadcast before this socket joined may not be
+                # written yet; they are sent once they must have been
+                self.cancel_resync(room_id)
+                self.resync_tasks[room_id] = asyncio.ensure_future(
+                    self.resync_room(room_id, last_seen_id, {event['message_id'] for event in events})
+                )
+        else:
+            truncated = len(events) > limit
+            events = events[-limit:]
+        
+        if events:
+            # Messages broadcast since joining the group are also queued as
+            # live events; those already sent here are skipped
+            self.synced_ids[room_id] = {event['message_id'] for event in events}
+            self.latest_message_ids[room_id] = max(
+                self.latest_message_ids.get(room_id, 0),
+                events[-1]['message_id']
+            )
+        await self.send_history(room_id, events, truncated)
+    
+    async def resync_room(self, room_id, last_seen_id, sent_ids):
+        """Read a resume again after the overlap and send what the first read missed"""
+        await asyncio.sleep(history.get_resume_overlap())
+        events, _ = await db_pool.run(history.load_since, room_id, last_seen_id, history.get_sync_limit())
+        self.resync_tasks.pop(room_id, None)
+        events = [event for event in events if event['message_id'] not in sent_ids]
+        if events:
+            await self.send_history(room_id, events, truncated=False)
+    
+    def cancel_resync(self, room_id):
+        task = self.resync_tasks.pop(room_id, None)
+        if task is not None:
+            task.cancel()
+    
+    async def send_history(self, room_id, events, truncated):
+        chunk_size = history.get_chunk_size()
+        for start in range(0, max(len(events), 1), chunk_size):
+            await self.send_encoded(frames.history_frame(
+                room_id,
+                events[start:start + chunk_size],
+                complete=start + chunk_size >= len(events),
+                truncated=truncated,
+                binary=self.binary
+            ))
+    
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Receive message from WebSocket.
-        Expected format: {"message": "text", "type": "chat_message"}
+        Expected format: {"message": "text", "type": "chat_message", "client_id": "optional"}
         """
-        data = json.loads(text_data)
-        message_content = data.get('message', '')
+        if self.closing:
+            return
+        frame = text_data if text_data is not None else bytes_data
+        if frame is None or len(frame) > self.limits['MAX_FRAME_SIZE']:
+            limits.count('oversized_frames')
+            await self.close_for(limits.CLOSE_TOO_BIG, 'abuse_disconnects')
+            return
+        
+        if not self.frame_bucket.take():
+            limits.count('throttled_frames')
+            self.strikes += 1
+            if self.strikes >= self.limits['MAX_STRIKES']:
+                await self.close_for(limits.CLOSE_POLICY, 'abuse_disconnects')
+            return
+        self.strikes = 0
+        
+        data = frames.decode(text_data, bytes_data)
+        if data is None:
+            limits.count('invalid_frames')
+            await self.send_frame({'type': 'error', 'detail': 'Trama no válida.'})
+            return
+        await self.receive_frame(data)
+    
+    async def receive_frame(self, data):
         message_type = data.get('type', 'chat_message')
         
+        # Any frame shows the user is still there; idle clients send
+        # {"type": "heartbeat"}, with "status": "away" or "online" to switch
+        status = data.get('status') if message_type == 'heartbeat' else None
+        presence.registry.heartbeat(self.user.id, status if status in presence.STATUSES else None)
+        if message_type == 'heartbeat':
+            return
+        
+        room_id = await self.get_frame_room(data)
+        if room_id is None:
+            return
+        
+        message_content = data.get('message', '')
+        
         if message_type == 'chat_message' and message_content:
-            # Save message to database
-            message = await self.save_message(
-                room_id=self.room_id,
-                author_id=self.user.id,
-                content=message_content
+            if not await self.check_message(room_id, message_content, data.get('client_id')):
+                return
+            await self.send_chat_message(room_id, message_content, data.get('client_id'))
+            # Sending ends typing
+            if room_id in self.typing_rooms:
+                self.typing_rooms.discard(room_id)
+                presence.registry.set_typing(room_id, self.user.id, False)
+        
+        elif message_type == 'typing':
+            active = data.get('typing', True) is not False
+            if active:
+                self.typing_rooms.add(room_id)
+            else:
+                self.typing_rooms.discard(room_id)
+            presence.registry.set_typing(room_id, self.user.id, active)
+        
+        elif message_type == 'read_receipt':
+            message_id = parse_id(data.get('message_id'))
+            if message_id is not None:
+                self.queue_read_receipt(room_id, message_id)
+    
+    async def get_frame_room(self, data):
+        """Room id an incoming frame is for, or None to ignore it"""
+        raise NotImplementedError
+    
+    async def check_message(self, room_id, content, client_id):
+        """Whether a chat message is within the limits; tells the sender if not"""
+        if not isinstance(content, str) or len(content) > self.limits['MAX_MESSAGE_LENGTH']:
+            limits.count('oversized_messages')
+            detail = 'El mensaje es demasiado largo.'
+            retry_after = None
+        elif not self.message_bucket.take():
+            limits.count('throttled_messages')
+            detail = 'Demasiados mensajes. Espera un momento.'
+            retry_after = self.message_bucket.retry_after()
+        else:
+            return True
+        
+        await self.send_frame({
+            'type': 'message_error',
+            'room_id': room_id,
+            'client_id': client_id,
+            'message_id': None,
+            'detail': detail,
+            'retry_after': retry_after,
+        })
+        return False
+    
+    async def send_chat_message(self, room_id, content, client_id):
+        # The id and timestamp are assigned up front; in write-behind
+        # mode the row is written after the broadcast (message_writer.py)
+        message, committed = await self.writer.save(
+            room_id=room_id,
+            author_id=self.user.id,
+            content=content
+        )
+        
+        # Broadcast message to room group, encoded once for every socket
+        await self.channel_layer.group_send(
+            room_group_name(room_id),
+            frames.chat_message_event(
+                room_id,
+                message.id,
+                self.user.id,
+                self.user.email,
+                history.author_name(self.user.first_name, self.user.last_name, self.user.username),
+                content,
+                message.timestamp
             )
-            
-            # Broadcast message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message_content,
-                    'message_id': message.id,
-                    'author_id': self.user.id,
-                    'author_email': self.user.email,
-                    'author_name': f"{self.user.first_name} {self.user.last_name}".strip() or self.user.username,
-                    'timestamp': message.timestamp.isoformat(),
-                }
+        )
+        
+        await self.acknowledge(room_id, client_id, message, committed)
+    
+    def queue_read_receipt(self, room_id, message_id):
+        """
+        "Read up to message_id"; bursts collapse into one write and one
+        broadcast per room every CHAT_READ_RECEIPT_DELAY (read_receipts.py)
+        """
+        self.pending_reads[room_id] = max(self.pending_reads.get(room_id, 0), message_id)
+        if self.read_flush_handle is None:
+            self.read_flush_handle = asyncio.get_running_loop().call_later(
+                read_receipts.get_receipt_delay(),
+                lambda: self.spawn(self.flush_read_receipts(), self.read_tasks)
             )
+    
+    async def flush_read_receipts(self):
+        """Advance the user's watermarks and tell the rooms where they moved"""
+        if self.read_flush_handle is not None:
+            self.read_flush_handle.cancel()
+            self.read_flush_handle = None
+        pending, self.pending_reads = self.pending_reads, {}
         
-        elif message_type == 'read_receipt':
-            # Mark message as read
-            message_id = data.get('message_id')
-            if message_id:
-                await self.mark_message_read(message_id, self.user.id)
-                
-                # Broadcast read receipt
+        for room_id, message_id in pending.items():
+            # Ids this socket has already seen exist in the room; others are
+            # checked against the database first
+            last_read_id = await db_pool.run(
+                read_receipts.advance,
+                room_id,
+                self.user.id,
+                message_id,
+                verify=message_id > self.latest_message_ids.get(room_id, 0)
+            )
+            if last_read_id is not None:
                 await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'read_receipt',
-                        'message_id': message_id,
-                        'reader_id': self.user.id,
-                    }
+                    room_group_name(room_id),
+                    read_receipts.receipt_event(room_id, self.user.id, last_read_id)
                 )
     
+    async def acknowledge(self, room_id, client_id, message, committed):
+        """
+        Tell the sender about its message according to CHAT_PERSISTENCE['ACK']:
+        right away ('accepted'), once committed ('persisted') or not at all.
+        """
+        ack = self.writer.config['ACK']
+        if ack == 'persisted':
+            self.spawn(self.acknowledge_persisted(room_id, client_id, message, committed), self.ack_tasks)
+            return
+        
+        # Nobody waits for the write; still collect a failure so it is not
+        # reported as never retrieved
+        committed.add_done_callback(lambda future: future.cancelled() or future.exception())
+        if ack == 'accepted':
+            await self.send_frame({
+                'type': 'message_ack',
+                'room_id': room_id,
+                'client_id': client_id,
+                'message_id': message.id,
+                'persisted': False,
+            })
+    
+    async def acknowledge_persisted(self, room_id, client_id, message, committed):
+        try:
+            # Shielded: cancelling the acknowledgement must not cancel the write
+            await asyncio.shield(committed)
+        except Exception:
+            await self.send_frame({
+                'type': 'message_error',
+                'room_id': room_id,
+                'client_id': client_id,
+                'message_id': message.id,
+                'detail': 'No se pudo guardar el mensaje.',
+            })
+            return
+        await self.send_frame({
+            'type': 'message_ack',
+            'room_id': room_id,
+            'client_id': client_id,
+            'message_id': message.id,
+            'persisted': True,
+        })
+    
+    @staticmethod
+    def spawn(coroutine, tasks):
+        """Run coroutine in a task kept in tasks (a set) until it is done"""
+        task = asyncio.ensure_future(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+    
     async def chat_message(self, event):
         """
         Receive message from room group and send to WebSocket.
         """
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'message_id': event['message_id'],
-            'author_id': event['author_id'],
-            'author_email': event['author_email'],
-            'author_name': event['author_name'],
-            'timestamp': event['timestamp'],
-        }))
+        room_id = event['room_id']
+        history.record(event)
+        
+        synced = self.synced_ids.get(room_id)
+        if synced is not None:
+            if event['message_id'] in synced:
+                return
+            # Past the messages queued while syncing
+            del self.synced_ids[room_id]
+        
+        self.latest_message_ids[room_id] = max(self.latest_message_ids.get(room_id, 0), event['message_id'])
+        await self.send_event(event)
     
     async def read_receipt(self, event):
         """
         Receive read receipt from room group and send to WebSocket.
         """
-        await self.send(text_data=json.dumps({
-            'type': 'read_receipt',
-            'message_id': event['message_id'],
-            'reader_id': event['reader_id'],
-        }))
+        await self.send_event(event, droppable=True)
+    
+    async def presence_update(self, event):
+        """
+        Presence changes of users in the room since the last tick.
+        """
+        await self.send_event(event, droppable=True)
     
-    @database_sync_to_async
-    def check_room_participant(self, room_id, user_id):
-        """Check if user is a participant in the chat room"""
+    async def typing_update(self, event):
+        """
+        Users who started or stopped typing in the room since the last tick.
+        """
+        await self.send_event(event, droppable=True)
+    
+    async def send_frame(self, frame, droppable=False):
+        """Encode a frame for this socket and queue it"""
+        await self.send_encoded(frames.pack(frame) if self.binary else frames.dumps(frame), droppable)
+    
+    async def send_event(self, event, droppable=False):
+        """Queue the frame a group event carries, already encoded"""
+        await self.send_encoded(event['binary'] if self.binary else event['text'], droppable)
+    
+    async def send_encoded(self, data, droppable=False):
+        """
+        Queue an encoded frame (text or msgpack bytes) for the client. When
+        SEND_QUEUE frames are already waiting, droppable ones are discarded
+        under SLOW_CONSUMER='drop' and anything else disconnects the client
+        (limits.py).
+        """
+        if self.closing:
+            return
+        if len(self.outbox) >= self.limits['SEND_QUEUE']:
+            # Frames produced back to back don't let the sender run; give
+            # it a turn so only a client that really is slow falls behind
+            await asyncio.sleep(0)
+        if self.closing:
+            return
+        if len(self.outbox) >= self.limits['SEND_QUEUE']:
+            if droppable and self.limits['SLOW_CONSUMER'] == 'drop':
+                limits.count('dropped_frames')
+                return
+            await self.close_for(limits.CLOSE_TRY_AGAIN, 'slow_disconnects')
+            return
+        
+        self.outbox.append(data)
+        if self.outbox_task is None:
+            self.outbox_task = asyncio.ensure_future(self.send_outbox())
+    
+    async def send_outbox(self):
         try:
-            room = ChatRoom.objects.get(id=room_id)
-            return room.participants.filter(id=user_id).exists()
-        except ChatRoom.DoesNotExist:
+            while self.outbox:
+                data = self.outbox.popleft()
+                if isinstance(data, bytes):
+                    await self.send(bytes_data=data)
+                else:
+                    await self.send(text_data=data)
+        finally:
+            self.outbox_task = None
+    
+    async def close_for(self, code, counter):
+        """Close the socket over a limit, dropping whatever was queued"""
+        if self.closing:
+            return
+        self.closing = True
+        limits.count(counter)
+        self.outbox.clear()
+        await self.close(code=code)
+    
+    async def check_room_participant(self, room_id, user_id):
+        """Check if user is a participant in the chat room (cached, see memberships.py)"""
+        room_id = int(room_id)
+        if memberships.cached_participant(user_id, room_id):
+            return True
+        return await db_pool.run(memberships.is_participant, user_id, room_id)
+
+
+class ChatConsumer(BaseChatConsumer):
+    """
+    WebSocket consumer for handling real-time chat messages.
+    
+    When a user connects to a chat room, they join a channel group.
+    Messages sent by any user in the room are broadcast to all participants.
+    """
+    
+    async def join_rooms(self):
+        self.room_id = int(self.scope['url_route']['kwargs']['room_id'])
+        
+        # Verify user is a participant in this room
+        if not await self.check_room_participant(self.room_id, self.user.id):
             return False
+        
+        await self.join_room(self.room_id)
+        return True
     
-    @database_sync_to_async
-    def save_message(self, room_id, author_id, content):
-        """Save message to database"""
-        room = ChatRoom.objects.get(id=room_id)
-        author = User.objects.get(id=author_id)
-        message = Message.objects.create(
-            room=room,
-            author=author,
-            content=content
-        )
-        # Update room's updated_at timestamp
-        room.save()
-        return message
+    async def resume(self):
+        # ws/chat/<room_id>/?last_seen_message_id=<id>
+        last_seen_id = parse_id((self.query.get('last_seen_message_id') or [None])[0])
+        if last_seen_id is not None:
+            await self.sync_room(self.room_id, last_seen_id)
     
-    @database_sync_to_async
-    def mark_message_read(self, message_id, user_id):
-        """Mark a message as read"""
-        try:
-            message = Message.objects.get(id=message_id)
-            # Only mark as read if the current user is not the author
-            if message.author.id != user_id:
-                message.read = True
-                message.save()
-        except Message.DoesNotExist:
-            pass
+    async def get_frame_room(self, data):
+        return self.room_id
 
+
+class UserChatConsumer(BaseChatConsumer):
+    """
+    One WebSocket per user for all of their chat rooms.
+    
+    Subscribes to every room of the user on connect. Frames carry the
+    room_id they are about, in both directions:
+    
+        {"type": "chat_message", "room_id": 12, "message": "...", "client_id": "..."}
+        {"type": "read_receipt", "room_id": 12, "message_id": 345}
+        {"type": "subscribe", "room_id": 13}    -> {"type": "subscribed", "room_id": 13}
+        {"type": "unsubscribe", "room_id": 12}  -> {"type": "unsubscribed", "room_id": 12}
+        {"type": "sync", "room_id": 12, "last_seen_message_id": 340} -> history frames
+        {"type": "typing", "room_id": 12, "typing": true}
+        {"type": "heartbeat", "status": "away"}
+    
+    Rooms created after connecting (e.g. by find_or_create) are added with
+    subscribe, which also accepts last_seen_message_id.
+    """
+    
+    async def join_rooms(self):
+        room_ids = memberships.cached_rooms(self.user.id)
+        if room_ids is None:
+            room_ids = await db_pool.run(memberships.load_rooms, self.user.id)
+        for room_id in room_ids:
+            await self.join_room(room_id)
+        return True
+    
+    async def receive_frame(self, data):
+        message_type = data.get('type', 'chat_message')
+        if message_type not in ('subscribe', 'unsubscribe', 'sync'):
+            await super().receive_frame(data)
+            return
+        
+        room_id = parse_id(data.get('room_id'))
+        if room_id is None:
+            await self.send_room_error(data.get('room_id'), 'Se requiere room_id.')
+            return
+        
+        if message_type == 'subscribe':
+            if room_id not in self.rooms:
+                if not await self.check_room_participant(room_id, self.user.id):
+                    await self.send_room_error(room_id, 'No perteneces a esta sala.')
+                    return
+                await self.join_room(room_id)
+            await self.send_frame({'type': 'subscribed', 'room_id': room_id})
+        elif message_type == 'sync' and room_id not in self.rooms:
+            await self.send_room_error(room_id, 'No estás suscrito a esta sala.')
+            return
+        elif message_type == 'unsubscribe':
+            if room_id in self.rooms:
+                await self.leave_room(room_id)
+            await self.send_frame({'type': 'unsubscribed', 'room_id': room_id})
+            return
+        
+        last_seen_id = parse_id(data.get('last_seen_message_id'))
+        if last_seen_id is not None:
+            await self.sync_room(room_id, last_seen_id)
+    
+    async def get_frame_room(self, data):
+        room_id = parse_id(data.get('room_id'))
+        if room_id is None or room_id not in self.rooms:
+            await self.send_room_error(data.get('room_id'), 'No estás suscrito a esta sala.')
+            return None
+        return room_id
+    
+    async def send_room_error(self, room_id, detail):
+        await self.send_frame({
+            'type': 'room_error',
+            'room_id': room_id,
+            'detail': detail,
+        })
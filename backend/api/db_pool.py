@@ -0,0 +1,173 @@
+"""
+Database executor for the chat consumers.
+
+database_sync_to_async runs every call on the single thread shared by all
+synchronous code of the process (thread_sensitive), so one slow query
+stalls every socket of the worker. The consumers, the WebSocket auth
+middleware and the message writer run their queries through run() instead,
+on a pool of CHAT_DB_POOL['SIZE'] threads.
+
+Each pool thread keeps its own connections open between jobs, so a job
+does not pay for connecting. A connection is closed after CONN_MAX_AGE
+seconds, or right after a job if an error left it unusable; the next job
+on that thread opens a new one.
+
+Jobs start in submission order. At most MAX_QUEUE jobs per event loop wait
+for a thread; callers past that wait in the event loop for a slot without
+blocking it, which slows down the sockets causing the load instead of
+growing the queue. Queue depth and wait and run times are counted (see
+stats(); GET /api/messages/db-pool-stats/).
+
+SIZE 0 goes back to database_sync_to_async.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connections
+
+DEFAULTS = {
+    'SIZE': 4,
+    'MAX_QUEUE': 1000,
+    'CONN_MAX_AGE': 600,
+}
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'CHAT_DB_POOL', {}))
+
+
+class DatabasePool:
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.executor = ThreadPoolExecutor(max_workers=self.config['SIZE'], thread_name_prefix='chat-db')
+        self.local = threading.local()
+        self.slots = weakref.WeakKeyDictionary()
+
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.peak_queued = 0
+        self.jobs = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on a pool thread and return its result"""
+        loop = asyncio.get_running_loop()
+        slots = self.slots.get(loop)
+        if slots is None:
+            slots = self.slots[loop] = asyncio.Semaphore(self.config['SIZE'] + self.config['MAX_QUEUE'])
+
+        submitted = time.monotonic()
+        async with slots:
+            with self.lock:
+                self.queued += 1
+                self.peak_queued = max(self.peak_queued, self.queued)
+            return await loop.run_in_executor(
+                self.executor,
+                functools.partial(self.call, submitted, func, args, kwargs)
+            )
+
+    def call(self, submitted, func, args, kwargs):
+        started = time.monotonic()
+        wait = started - submitted
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        failed = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release_connections()
+            with self.lock:
+                self.running -= 1
+                self.jobs += 1
+                self.failed += failed
+                self.total_run += time.monotonic() - started
+
+    def release_connections(self):
+        """Keep this thread's connections for the next job unless broken or too old"""
+        opened = getattr(self.local, 'opened', None)
+        if opened is None:
+            opened = self.local.opened = {}
+        now = time.monotonic()
+
+        for connection in connections.all(initialized_only=True):
+            if connection.connection is None:
+                opened.pop(connection.alias, None)
+                continue
+            if connection.errors_occurred:
+                if connection.is_usable():
+                    connection.errors_occurred = False
+                else:
+                    connection.close()
+            elif now - opened.setdefault(connection.alias, now) > self.config['CONN_MAX_AGE']:
+                connection.close()
+            if connection.connection is None:
+                opened.pop(connection.alias, None)
+
+    def stats(self):
+        with self.lock:
+            jobs = self.jobs
+            return {
+                'size': self.config['SIZE'],
+                'queued': self.queued,
+                'running': self.running,
+                'peak_queued': self.peak_queued,
+                'jobs': jobs,
+                'failed': self.failed,
+                'avg_wait_ms': round(self.total_wait / jobs * 1000, 3) if jobs else None,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'avg_run_ms': round(self.total_run / jobs * 1000, 3) if jobs else None,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process's pool, or None when CHAT_DB_POOL['SIZE'] is 0"""
+    global _pool
+    if _pool is None:
+        config = get_config()
+        if not config['SIZE']:
+            return None
+        with _pool_lock:
+            if _pool is None:
+                _pool = DatabasePool(config)
+    return _pool
+
+
+async def run(func, *args, **kwargs):
+    """Run a synchronous database function from async code"""
+    pool = get_pool()
+    if pool is None:
+        return await database_sync_to_async(func)(*args, **kwargs)
+    return await pool.run(func, *args, **kwargs)
+
+
+def stats():
+    pool = get_pool()
+    if pool is None:
+        return {'size': 0}
+    return pool.stats()
@@ -0,0 +1,182 @@
+"""
+Faceted counts for the provider search UI.
+
+ProviderFacetCount keeps the number of searchable providers per
+(region, city, 48h availability, category) cell and is updated
+incrementally from provider_index_changed (see signals.py). Facets for a
+filter set are aggregated from those cells in a single in-memory pass.
+Filters the counters can't express (min_rating, distance) fall back to one
+grouped query over ProviderSearchIndex that yields cells of the same shape.
+
+Facets are disjunctive: each facet ignores its own filter, so the UI can
+show how many providers every alternative value would return.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .models import Machine, ProviderFacetCount, ProviderSearchIndex
+from .search_index import CATEGORY_BITS
+
+# Cell dimensions; '' as category means "any category"
+ANY_CATEGORY = ''
+
+CATEGORY_LABELS = dict(Machine.CATEGORY_CHOICES)
+
+
+# ==================== COUNTER MAINTENANCE ====================
+
+def cells_for(region, city, available, category_mask):
+    """Counter cells a searchable provider contributes to"""
+    cells = {(region, city, available, ANY_CATEGORY)}
+    for category, bit in CATEGORY_BITS.items():
+        if category_mask & bit:
+            cells.add((region, city, available, category))
+    return cells
+
+
+def contributions(row):
+    """Cells for an index row snapshot (TRACKED_FIELDS), empty if not searchable"""
+    if not row or row['subscription_status'] != 'active' or not row['is_verified']:
+        return set()
+    return cells_for(row['region'], row['city'], row['available_within_48h'], row['category_mask'])
+
+
+def _add(cell, delta):
+    region, city, available, category = cell
+    lookup = {
+        'region': region,
+        'city': city,
+        'available_within_48h': available,
+        'category': category,
+    }
+    counters = ProviderFacetCount.objects.filter(**lookup)
+    if counters.update(providers=F('providers') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            ProviderFacetCount.objects.create(providers=delta, **lookup)
+    except IntegrityError:
+        # Created concurrently
+        counters.update(providers=F('providers') + delta)
+
+
+def apply_change(before, after):
+    """Move a provider's contribution from its old cells to its new ones"""
+    old, new = contributions(before), contributions(after)
+    for cell in old - new:
+        _add(cell, -1)
+    for cell in new - old:
+        _add(cell, 1)
+
+
+def rebuild_counters():
+    """Recompute every counter from the search index in one grouped query"""
+    counts = {}
+    for cell, providers in index_cells(ProviderSearchIndex.objects.filter(
+        subscription_status='active',
+        is_verified=True
+    )):
+        counts[cell] = counts.get(cell, 0) + providers
+
+    with transaction.atomic():
+        ProviderFacetCount.objects.all().delete()
+        ProviderFacetCount.objects.bulk_create(
+            ProviderFacetCount(
+                region=region,
+                city=city,
+                available_within_48h=available,
+                category=category,
+                providers=providers
+            )
+            for (region, city, available, category), providers in counts.items()
+        )
+
+
+# ==================== CELL SOURCES ====================
+
+def counter_cells():
+    """(cell, providers) pairs from the maintained counters"""
+    rows = ProviderFacetCount.objects.filter(providers__gt=0).values_list(
+        'region', 'city', 'available_within_48h', 'category', 'providers'
+    )
+    return [((region, city, available, category), providers)
+            for region, city, available, category, providers in rows]
+
+
+def index_cells(queryset):
+    """(cell, providers) pairs from one grouped pass over a search index queryset"""
+    rows = queryset.order_by().values(
+        'region', 'city', 'available_within_48h', 'category_mask'
+    ).annotate(providers=Count('pk'))
+
+    cells = []
+    for row in rows:
+        for cell in cells_for(row['region'], row['city'], row['available_within_48h'], row['category_mask']):
+            cells.append((cell, row['providers']))
+    return cells
+
+
+# ==================== AGGREGATION ====================
+
+def _contains(value, needle):
+    return needle is None or needle.lower() in value.lower()
+
+
+def _ranked(counts, labels=None):
+    """Facet values ordered by count, dropping empty ones"""
+    items = []
+    for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+        if count <= 0:
+            continue
+        item = {'value': value, 'count': count}
+        if labels is not None:
+            item['label'] = str(labels.get(value, value))
+        items.append(item)
+    return items
+
+
+def aggregate(cells, params):
+    """
+    Compute every facet for validated ProviderSearchSerializer params.
+
+    Each facet applies all filters except its own.
+    """
+    category = params.get('category')
+    region = params.get('region')
+    city = params.get('city')
+    only_available = params.get('available_within_48h', True)
+    # Region, city and availability facets count providers, not categories
+    wanted_category = category if category is not None else ANY_CATEGORY
+
+    totals = {'total': 0, 'category': {}, 'region': {}, 'city': {}, 'available': {True: 0, False: 0}}
+    for (cell_region, cell_city, available, cell_category), providers in cells:
+        in_region = _contains(cell_region, region)
+        in_city = _contains(cell_city, city)
+        in_availability = available or not only_available
+
+        if cell_category != ANY_CATEGORY:
+            if in_region and in_city and in_availability:
+                totals['category'][cell_category] = totals['category'].get(cell_category, 0) + providers
+        if cell_category != wanted_category:
+            continue
+
+        if in_city and in_availability:
+            totals['region'][cell_region] = totals['region'].get(cell_region, 0) + providers
+        if in_region and in_availability:
+            totals['city'][cell_city] = totals['city'].get(cell_city, 0) + providers
+        if in_region and in_city:
+            totals['available'][available] += providers
+            if in_availability:
+                totals['total'] += providers
+
+    return {
+        'total': totals['total'],
+        'category': _ranked(totals['category'], CATEGORY_LABELS),
+        'region': _ranked(totals['region']),
+        'city': _ranked(totals['city']),
+        'available_within_48h': {
+            'true': totals['available'][True],
+            'false': totals['available'][False],
+        },
+    }
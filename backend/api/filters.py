@@ -0,0 +1,35 @@
+"""
+Custom filter backends for the ConnecMaq API.
+"""
+
+from rest_framework import filters
+
+from .text_search import get_search_backend
+
+
+class TextSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter that answers ``?search=`` through the text search backend.
+    
+    Views declare which index to query with ``search_index_kind``. Results
+    are ordered by relevance unless the client asks for an explicit
+    ``?ordering=``; the view's default ordering breaks ties. Without a
+    configured backend (or index kind) this behaves like SearchFilter.
+    
+    Place it after OrderingFilter in ``filter_backends``.
+    """
+    
+    def filter_queryset(self, request, queryset, view):
+        backend = get_search_backend()
+        kind = getattr(view, 'search_index_kind', None)
+        if backend is None or kind is None:
+            return super().filter_queryset(request, queryset, view)
+        
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        
+        queryset = backend.search(queryset, kind, query)
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get('ordering'):
+            queryset = queryset.order_by('-search_rank', *queryset.query.order_by)
+        return queryset
@@ -0,0 +1,124 @@
+"""
+Encoding of chat WebSocket frames.
+
+Frames broadcast to a room (messages, read receipts, presence, typing) are
+encoded once by whoever sends them and travel through the channel layer
+ready to send: the group event carries the JSON text and, unless
+CHAT_BINARY_FRAMES is off, the msgpack bytes of the same frame. Each socket
+in the room only picks one of them, so fan-out costs no encoding per
+recipient. History frames are spliced together from the encoded messages.
+
+Clients opt into binary frames with ?format=msgpack on the WebSocket URL;
+they then receive every frame as msgpack (same keys as the JSON) and may
+send msgpack frames too.
+
+CHAT_FRAME_ENCODER picks the JSON encoder: 'orjson', 'json' or 'auto'
+(orjson when installed).
+"""
+
+import json
+
+import msgpack
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+FORMATS = ('json', 'msgpack')
+
+
+def use_orjson():
+    encoder = getattr(settings, 'CHAT_FRAME_ENCODER', 'auto')
+    if encoder == 'orjson' and orjson is None:
+        raise RuntimeError("CHAT_FRAME_ENCODER is 'orjson' but orjson is not installed")
+    return orjson is not None and encoder in ('auto', 'orjson')
+
+
+def binary_enabled():
+    return getattr(settings, 'CHAT_BINARY_FRAMES', True)
+
+
+def dumps(frame):
+    """Compact JSON text of a frame"""
+    if use_orjson():
+        return orjson.dumps(frame).decode()
+    return json.dumps(frame, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode(text_data=None, bytes_data=None):
+    """An incoming JSON or msgpack frame as a dict, or None if it isn't one"""
+    try:
+        data = loads(text_data) if text_data is not None else unpack(bytes_data)
+    except (ValueError, RecursionError, msgpack.UnpackException):
+        # RecursionError: deeply nested arrays through the json module
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def pack(frame):
+    return msgpack.packb(frame, use_bin_type=True)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def encoded(event_type, frame, **fields):
+    """
+    Group event for event_type carrying frame already encoded, plus any
+    fields the consumers need to look at
+    """
+    event = {'type': event_type, 'text': dumps(frame), **fields}
+    if binary_enabled():
+        event['binary'] = pack(frame)
+    return event
+
+
+def chat_message_event(room_id, message_id, author_id, author_email, author_name, content, timestamp):
+    """
+    Group event (and history buffer entry) for a chat message; sent_at is
+    its timestamp in seconds, for the history buffer
+    """
+    return encoded('chat_message', {
+        'type': 'chat_message',
+        'room_id': room_id,
+        'message_id': message_id,
+        'message': content,
+        'author_id': author_id,
+        'author_email': author_email,
+        'author_name': author_name,
+        'timestamp': timestamp.isoformat(),
+    }, room_id=room_id, message_id=message_id, sent_at=timestamp.timestamp())
+
+
+def history_frame(room_id, events, complete, truncated, binary=False):
+    """A history frame around already encoded chat_message events"""
+    if binary:
+        packer = msgpack.Packer(use_bin_type=True)
+        parts = [
+            packer.pack_map_header(5),
+            packer.pack('type'), packer.pack('history'),
+            packer.pack('room_id'), packer.pack(room_id),
+            packer.pack('messages'), packer.pack_array_header(len(events)),
+        ]
+        parts.extend(event['binary'] for event in events)
+        parts += [
+            packer.pack('complete'), packer.pack(complete),
+            packer.pack('truncated'), packer.pack(truncated),
+        ]
+        return b''.join(parts)
+
+    return '{"type":"history","room_id":%s,"messages":[%s],"complete":%s,"truncated":%s}' % (
+        json.dumps(room_id),
+        ','.join(event['text'] for event in events),
+        json.dumps(complete),
+        json.dumps(truncated),
+    )
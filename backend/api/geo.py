@@ -0,0 +1,121 @@
+"""
+Geospatial helpers for radius and nearest-provider search without PostGIS.
+
+Coordinates are bucketed into a fixed lat/lng grid (CELL_SIZE degrees per
+cell) and the cell number is stored in an indexed integer column. A radius
+query first prunes candidates to the cells overlapping the bounding box of
+the circle (one BETWEEN range per grid row, so the b-tree index is used on
+SQLite and PostgreSQL alike), then computes the exact haversine distance as
+a SQL expression over the remaining rows in a single pass.
+"""
+
+import math
+
+from django.db.models import F, Q, Value, FloatField
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# 0.1 degree cells are ~11 km high, a good fit for "within X km" searches
+CELL_SIZE = 0.1
+CELLS_PER_ROW = int(round(360 / CELL_SIZE))
+ROWS = int(round(180 / CELL_SIZE))
+
+# Search radius used for "nearest first" when the client gives none
+DEFAULT_NEAREST_RADIUS_KM = 100
+
+
+def _column(lng):
+    return min(int(math.floor((lng + 180) / CELL_SIZE)), CELLS_PER_ROW - 1)
+
+
+def _row(lat):
+    return min(int(math.floor((lat + 90) / CELL_SIZE)), ROWS - 1)
+
+
+def cell_for(lat, lng):
+    """Grid cell number for a coordinate, or None if it is incomplete"""
+    if lat is None or lng is None:
+        return None
+    return _row(lat) * CELLS_PER_ROW + _column(lng)
+
+
+def cell_ranges(lat, lng, radius_km):
+    """
+    Cell number ranges [(low, high), ...] covering the bounding box of the
+    circle. Handles the antimeridian and merges full rows near the poles.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat = max(lat - dlat, -90.0)
+    max_lat = min(lat + dlat, 90.0)
+
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 1e-9 or max_lat >= 90.0 or min_lat <= -90.0:
+        column_spans = [(0, CELLS_PER_ROW - 1)]
+    else:
+        dlng = radius_km / (KM_PER_DEGREE * cos_lat)
+        if 2 * dlng >= 360:
+            column_spans = [(0, CELLS_PER_ROW - 1)]
+        else:
+            west, east = lng - dlng, lng + dlng
+            if west < -180:
+                column_spans = [(_column(west + 360), CELLS_PER_ROW - 1), (0, _column(east))]
+            elif east >= 180:
+                column_spans = [(_column(west), CELLS_PER_ROW - 1), (0, _column(east - 360))]
+            else:
+                column_spans = [(_column(west), _column(east))]
+
+    first_row, last_row = _row(min_lat), _row(max_lat)
+    if column_spans == [(0, CELLS_PER_ROW - 1)]:
+        # Whole rows are contiguous in cell numbering
+        return [(first_row * CELLS_PER_ROW, last_row * CELLS_PER_ROW + CELLS_PER_ROW - 1)]
+
+    ranges = []
+    for row in range(first_row, last_row + 1):
+        base = row * CELLS_PER_ROW
+        for low, high in column_spans:
+            ranges.append((base + low, base + high))
+    return ranges
+
+
+def cells_q(lat, lng, radius_km, field='geo_cell'):
+    """Q object restricting field to the cells around a point"""
+    query = Q()
+    for low, high in cell_ranges(lat, lng, radius_km):
+        query |= Q(**{f'{field}__range': (low, high)})
+    return query
+
+
+def haversine_expression(lat, lng, lat_field='latitude', lng_field='longitude'):
+    """Great-circle distance in km from (lat, lng) to the row's coordinates"""
+    lat1 = Radians(Value(lat, output_field=FloatField()))
+    lng1 = Radians(Value(lng, output_field=FloatField()))
+    lat2 = Radians(F(lat_field))
+    lng2 = Radians(F(lng_field))
+
+    a = (
+        Power(Sin((lat2 - lat1) / 2), 2)
+        + Cos(lat1) * Cos(lat2) * Power(Sin((lng2 - lng1) / 2), 2)
+    )
+    # Clamp rounding noise so ASIN stays inside its domain
+    root = Least(Sqrt(a), Value(1.0, output_field=FloatField()))
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(root)
+
+
+def annotate_distance(queryset, lat, lng, radius_km=None, field='geo_cell',
+                      lat_field='latitude', lng_field='longitude'):
+    """
+    Annotate distance_km from (lat, lng), dropping rows without coordinates.
+
+    With radius_km, candidates are pruned through the grid cell index before
+    the exact distance filter is applied. The field names may span relations
+    (e.g. provider__search_index__geo_cell).
+    """
+    queryset = queryset.filter(**{f'{field}__isnull': False})
+    if radius_km is not None:
+        queryset = queryset.filter(cells_q(lat, lng, radius_km, field))
+    queryset = queryset.annotate(distance_km=haversine_expression(lat, lng, lat_field, lng_field))
+    if radius_km is not None:
+        queryset = queryset.filter(distance_km__lte=radius_km)
+    return queryset
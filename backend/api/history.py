@@ -0,0 +1,251 @@
+"""
+Chat history windows.
+
+Room detail and its older pages (ChatRoomViewSet) return a window of the
+latest messages before an id, read newest first along the (room, id) index
+and, past the room's oldest live message, from its archive (archive.py).
+load_after() walks the other way, for the room listing of MessageViewSet.
+
+A WebSocket that reconnects with last_seen_message_id only needs the
+messages it missed. Ids follow the order messages were sent in
+(message_writer.py), but messages sent by different processes a moment
+apart can be committed and broadcast in the other order, so a client may
+have seen an id without every lower one. A resume therefore sends every
+message after last_seen_message_id plus those sent up to
+CHAT_HISTORY_RESUME_OVERLAP seconds before it; clients drop the ones they
+already have by message_id.
+
+Each worker process keeps the recent messages of the rooms it has sockets
+in: a ring buffer of the broadcast events, fed by the consumers as events
+arrive, late ones included. A buffer holds every message sent since it
+started receiving the room's events (or since the newest one it evicted),
+so a resume that only needs those is answered from memory; anything older,
+or a room that just got its first socket in this process, is read from the
+database. Messages still waiting to be written when the database is read
+are sent by a second read after the overlap (consumers.py).
+
+The buffer of a room is dropped when the process has no more sockets in it,
+since it stops receiving the room's events.
+
+Only used from the event loop, so it needs no locking.
+
+Settings:
+
+- CHAT_HISTORY_BUFFER_SIZE: messages kept per room (default 200)
+- CHAT_HISTORY_SYNC_LIMIT: most messages sent on a resume; older ones are
+  left to the REST history (default 500)
+- CHAT_HISTORY_CHUNK_SIZE: messages per history frame (default 50)
+- CHAT_HISTORY_RESUME_OVERLAP: seconds within which a message is written
+  and broadcast after being sent, and how far before the last seen
+  message a resume goes back (default 5)
+- CHAT_ROOM_MESSAGES_WINDOW: messages per REST window (default 50, at
+  most MAX_WINDOW)
+"""
+
+import bisect
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+
+from . import archive, frames
+from .models import Message
+
+MAX_WINDOW = 200
+
+
+def get_window_size():
+    return getattr(settings, 'CHAT_ROOM_MESSAGES_WINDOW', 50)
+
+
+def get_buffer_size():
+    return getattr(settings, 'CHAT_HISTORY_BUFFER_SIZE', 200)
+
+
+def get_sync_limit():
+    return getattr(settings, 'CHAT_HISTORY_SYNC_LIMIT', 500)
+
+
+def get_chunk_size():
+    return getattr(settings, 'CHAT_HISTORY_CHUNK_SIZE', 50)
+
+
+def get_resume_overlap():
+    return getattr(settings, 'CHAT_HISTORY_RESUME_OVERLAP', 5)
+
+
+def author_name(first_name, last_name, username):
+    return f"{first_name} {last_name}".strip() or username
+
+
+class RoomBuffer:
+    """
+    Recent message events of a room, by id.
+
+    covered_from is when the buffer started receiving the room's events,
+    moved up to the send time of each evicted event: every message sent
+    after it is in the buffer or still on its way.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.ids = []
+        self.events = {}
+        self.sockets = 0
+        self.covered_from = time.time()
+
+    def add(self, event):
+        message_id = event['message_id']
+        if message_id in self.events:
+            return
+        # Events can arrive out of id order; each goes in its place
+        bisect.insort(self.ids, message_id)
+        self.events[message_id] = event
+        if len(self.ids) > self.size:
+            evicted = self.events.pop(self.ids.pop(0))
+            self.covered_from = max(self.covered_from, evicted['sent_at'])
+
+    def since(self, last_seen_id, overlap):
+        """
+        Events after last_seen_id and those sent up to overlap seconds
+        before it, or None if the buffer can't tell
+        """
+        last_seen = self.events.get(last_seen_id)
+        if last_seen is None:
+            return None
+        start = last_seen['sent_at'] - overlap
+        if start <= self.covered_from:
+            return None
+        return [
+            self.events[message_id]
+            for message_id in self.ids
+            if message_id > last_seen_id or (message_id != last_seen_id and self.events[message_id]['sent_at'] >= start)
+        ]
+
+
+buffers = {}
+
+
+def watch(room_id):
+    """A socket of this process joined the room"""
+    buffer = buffers.get(room_id)
+    if buffer is None:
+        buffer = buffers[room_id] = RoomBuffer(get_buffer_size())
+    buffer.sockets += 1
+
+
+def unwatch(room_id):
+    """A socket of this process left the room"""
+    buffer = buffers.get(room_id)
+    if buffer is not None:
+        buffer.sockets -= 1
+        if buffer.sockets <= 0:
+            del buffers[room_id]
+
+
+def record(event):
+    """Keep a chat_message event received by a socket of this process"""
+    buffer = buffers.get(event['room_id'])
+    if buffer is not None:
+        buffer.add(event)
+
+
+def buffered_since(room_id, last_seen_id):
+    """Buffered events a resume from last_seen_id needs, or None if the database is needed"""
+    buffer = buffers.get(room_id)
+    if buffer is None:
+        return None
+    return buffer.since(last_seen_id, get_resume_overlap())
+
+
+def load_since(room_id, last_seen_id, limit):
+    """
+    The latest messages a client that has seen last_seen_id may be missing
+    as chat_message events, oldest first, and whether more than limit were
+    missing: those after it and those sent up to the resume overlap before
+    it (before the latest message at or below it, if it was deleted)
+    """
+    messages = Message.objects.filter(room_id=room_id)
+    missing = Q(pk__gt=last_seen_id)
+    anchor = list(messages.filter(pk__lte=last_seen_id).order_by('-pk').values_list('timestamp', flat=True)[:1])
+    if anchor:
+        missing |= Q(timestamp__gte=anchor[0] - timedelta(seconds=get_resume_overlap()))
+    rows = list(
+        messages.filter(missing).exclude(pk=last_seen_id).order_by('-pk').values_list(
+            'pk', 'content', 'timestamp', 'author_id',
+            'author__email', 'author__first_name', 'author__last_name', 'author__username'
+        )[:limit + 1]
+    )
+    if len(rows) <= limit:
+        # Ran out of hot messages: continue into the archive
+        cold = archive.attach_authors(archive.load_range(
+            room_id,
+            after_id=last_seen_id,
+            before_id=rows[-1][0] if rows else None,
+            limit=limit + 1 - len(rows)
+        ))
+        rows += [
+            (
+                message.pk, message.content, message.timestamp, message.author_id,
+                message.author.email, message.author.first_name, message.author.last_name, message.author.username
+            )
+            for message in cold
+        ]
+    truncated = len(rows) > limit
+    events = [
+        frames.chat_message_event(
+            room_id,
+            pk,
+            author_id,
+            email,
+            author_name(first_name, last_name, username),
+            content,
+            timestamp
+        )
+        for pk, content, timestamp, author_id, email, first_name, last_name, username in reversed(rows[:limit])
+    ]
+    return events, truncated
+
+
+def load_window(room_id, before_id=None, limit=None):
+    """
+    Up to limit messages of the room older than before_id (or the latest
+    ones), oldest first, with their authors, and whether older ones exist
+    """
+    limit = min(limit or get_window_size(), MAX_WINDOW)
+    messages = Message.objects.filter(room_id=room_id).select_related('author')
+    if before_id is not None:
+        messages = messages.filter(pk__lt=before_id)
+    messages = list(messages.order_by('-pk')[:limit + 1])
+    if len(messages) <= limit:
+        # Ran out of hot messages: continue into the archive
+        messages += archive.attach_authors(archive.load_range(
+            room_id,
+            before_id=messages[-1].pk if messages else before_id,
+            limit=limit + 1 - len(messages)
+        ))
+    has_more = len(messages) > limit
+    return messages[limit - 1::-1], has_more
+
+
+def load_after(room_id, after_id=None, limit=None):
+    """
+    Up to limit messages of the room newer than after_id (or the oldest
+    ones), oldest first, with their authors, and whether newer ones exist
+    """
+    limit = min(limit or get_window_size(), MAX_WINDOW)
+    # Archived messages are older than every live one: start there
+    messages = archive.attach_authors(archive.load_range(
+        room_id,
+        after_id=after_id,
+        limit=limit + 1,
+        oldest_first=True
+    ))
+    if len(messages) <= limit:
+        hot = Message.objects.filter(room_id=room_id).select_related('author')
+        last_id = messages[-1].pk if messages else after_id
+        if last_id is not None:
+            hot = hot.filter(pk__gt=last_id)
+        messages += list(hot.order_by('pk')[:limit + 1 - len(messages)])
+    return messages[:limit], len(messages) > limit
@@ -0,0 +1,466 @@
+"""
+Channel layer for several ASGI worker processes on one host, without Redis.
+
+Group membership lives in a small hub that one of the worker processes runs
+on a Unix socket; every worker (the hub's own included) connects to it.
+Message queues stay in the process that owns the channel, so:
+
+- send() to a channel of the same process never leaves the process;
+- group_send() is one frame to the hub, which forwards one frame per
+  worker process with the list of that worker's channels in the group.
+  Fan-out to N sockets costs one write per process, not one per socket.
+
+The hub is elected with an exclusive flock on "<path>.lock". If its process
+exits, the lock is released, another worker takes over on its next
+reconnect and every worker re-registers its group memberships, so no
+external service or supervisor is needed. When a worker disconnects its
+channels are removed from every group. Only event loops running in a
+process's main thread (the ASGI server's) may host the hub: async_to_sync
+from code without a running loop, e.g. read_receipts.broadcast() in a
+management command, runs a short-lived loop in another thread, which
+only connects to the hub and drops what it sends if there is none (with
+no worker running, nobody is in any group).
+
+Whoever can create files next to the socket can take the hub over, so the
+socket and its lock must be in a directory only this user can write to:
+$XDG_RUNTIME_DIR/connecmaq by default, or run/ in the project when that
+is not set, created with mode 0700. A directory that others can write to
+is refused (ImproperlyConfigured).
+
+Capacity (per channel, with channel_capacity patterns) is enforced where
+the queue lives: send() raises ChannelFull for local channels, while
+messages to full remote channels are dropped, as group_send does. Messages
+expire after ``expiry`` seconds and group memberships after
+``group_expiry`` seconds, like the in-memory layer.
+
+Only process-specific channels (from new_channel(), as used by consumers)
+can be received from.
+
+Configuration::
+
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'api.layers.UnixSocketChannelLayer',
+            'CONFIG': {'path': '/run/connecmaq/channels.sock'},
+        },
+    }
+"""
+
+import asyncio
+import fcntl
+import logging
+import os
+import secrets
+import socket
+import stat
+import struct
+import threading
+import time
+import weakref
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('!I')
+MAX_FRAME = 16 * 1024 * 1024
+
+# Bytes a worker may have pending on its hub connection before further
+# deliveries to it are dropped
+WORKER_BUFFER_LIMIT = 4 * 1024 * 1024
+
+RECONNECT_DELAY = 0.05
+MAX_RECONNECT_DELAY = 1.0
+# How long send/group_send wait for a hub before giving up
+CONNECT_TIMEOUT = 5.0
+
+
+def default_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'connecmaq', 'channels.sock')
+    return os.path.join(settings.BASE_DIR, 'run', 'channels.sock')
+
+
+def ensure_private_directory(directory):
+    """Create the socket's directory (0700) and refuse one others can write to"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid not in (os.getuid(), 0) or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ImproperlyConfigured(
+            f'The channel layer socket directory {directory} must belong to this user '
+            f'and not be writable by others'
+        )
+
+
+def pack(frame):
+    payload = msgpack.packb(frame, use_bin_type=True)
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(HEADER.size)
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError(f'Frame too large ({length} bytes)')
+    return msgpack.unpackb(await reader.readexactly(length), raw=False)
+
+
+def worker_of(channel):
+    """Worker id embedded in a process-specific channel name, or None"""
+    if '!' not in channel:
+        return None
+    return channel.split('!', 1)[0].rsplit('.', 1)[-1]
+
+
+# ==================== HUB ====================
+
+class Hub:
+    """Group registry and router shared by the worker processes"""
+
+    def __init__(self, group_expiry):
+        self.group_expiry = group_expiry
+        # group -> {channel: joined at}
+        self.groups = {}
+        # worker id -> stream writer
+        self.workers = {}
+        self.last_cleanup = time.time()
+
+    async def handle(self, reader, writer):
+        worker_id = None
+        try:
+            while True:
+                frame = await read_frame(reader)
+                op = frame[0]
+                if op == 'hello':
+                    worker_id = frame[1]
+                    self.workers[worker_id] = writer
+                elif op == 'group_add':
+                    self.groups.setdefault(frame[1], {})[frame[2]] = time.time()
+                    self.expire_groups()
+                elif op == 'group_discard':
+                    self.discard(frame[1], frame[2])
+                elif op == 'group_send':
+                    self.group_send(frame[1], frame[2])
+                elif op == 'send':
+                    self.deliver(worker_of(frame[1]), [frame[1]], frame[2])
+                elif op == 'flush':
+                    self.groups.clear()
+                    for target in list(self.workers):
+                        self.write(target, ['flush'])
+        except (asyncio.IncompleteReadError, OSError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # The hub's event loop is shutting down
+            pass
+        finally:
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                del self.workers[worker_id]
+                self.forget_worker(worker_id)
+            writer.close()
+
+    def discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    def forget_worker(self, worker_id):
+        """Remove the channels of a disconnected worker from every group"""
+        for group in list(self.groups):
+            for channel in list(self.groups[group]):
+                if worker_of(channel) == worker_id:
+                    self.discard(group, channel)
+
+    def expire_groups(self):
+        now = time.time()
+        if now - self.last_cleanup < 60:
+            return
+        self.last_cleanup = now
+        limit = now - self.group_expiry
+        for group in list(self.groups):
+            for channel, joined in list(self.groups[group].items()):
+                if joined < limit:
+                    self.discard(group, channel)
+
+    def group_send(self, group, message):
+        by_worker = {}
+        for channel in self.groups.get(group, ()):
+            by_worker.setdefault(worker_of(channel), []).append(channel)
+        for worker_id, channels in by_worker.items():
+            self.deliver(worker_id, channels, message)
+
+    def deliver(self, worker_id, channels, message):
+        self.write(worker_id, ['deliver', channels, message])
+
+    def write(self, worker_id, frame):
+        writer = self.workers.get(worker_id)
+        if writer is None or writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > WORKER_BUFFER_LIMIT:
+            # The worker is not keeping up; drop like a full channel
+            return
+        writer.write(pack(frame))
+
+
+async def serve_hub(path, group_expiry):
+    """
+    Run the hub if no other process does. Returns the server, or None if
+    another process holds the hub lock.
+    """
+    lock_fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(lock_fd)
+        return None
+
+    try:
+        # The lock holder owns the socket path; a leftover file is stale
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Bound under a umask so the socket is 0600 from the start
+        umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        hub = Hub(group_expiry)
+        server = await asyncio.start_unix_server(hub.handle, sock=sock)
+    except BaseException:
+        os.close(lock_fd)
+        raise
+    server.lock_fd = lock_fd
+    logger.info('Channel layer hub listening on %s', path)
+    return server
+
+
+def stop_hub(server):
+    server.close()
+    os.close(server.lock_fd)
+
+
+# ==================== WORKER SIDE ====================
+
+class Link:
+    """Connection of one event loop to the hub, plus its local queues"""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.worker_id = secrets.token_hex(6)
+        # channel -> asyncio.Queue of (expires at, message)
+        self.queues = {}
+        # group -> local channels, re-registered after a reconnect
+        self.groups = {}
+        self.writer = None
+        self.connected = asyncio.Event()
+        # Set once the first connection attempt is over, either way
+        self.attempted = asyncio.Event()
+        self.hub = None
+        # Short-lived loops of async_to_sync run in other threads
+        self.can_host = threading.current_thread() is threading.main_thread()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        delay = RECONNECT_DELAY
+        try:
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.layer.path)
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # No hub running: take over if this loop may host it
+                    if self.hub is None and self.can_host and await self.start_hub():
+                        continue
+                    self.attempted.set()
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                    continue
+                except OSError as error:
+                    logger.warning('Could not connect to the channel layer hub at %s: %s', self.layer.path, error)
+                    self.attempted.set()
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                    continue
+
+                delay = RECONNECT_DELAY
+                self.writer = writer
+                writer.write(pack(['hello', self.worker_id]))
+                for group, channels in self.groups.items():
+                    for channel in channels:
+                        writer.write(pack(['group_add', group, channel]))
+                self.connected.set()
+                self.attempted.set()
+                try:
+                    while True:
+                        self.receive_frame(await read_frame(reader))
+                except (asyncio.IncompleteReadError, OSError, ValueError) as error:
+                    logger.warning('Lost connection to the channel layer hub (%r), reconnecting', error)
+                finally:
+                    self.connected.clear()
+                    self.writer = None
+                    writer.close()
+        finally:
+            if self.hub is not None:
+                stop_hub(self.hub)
+
+    async def start_hub(self):
+        try:
+            self.hub = await serve_hub(self.layer.path, self.layer.group_expiry)
+        except OSError as error:
+            logger.warning('Could not start the channel layer hub at %s: %s', self.layer.path, error)
+        return self.hub is not None
+
+    def receive_frame(self, frame):
+        if frame[0] == 'deliver':
+            _op, channels, message = frame
+            for channel in channels:
+                try:
+                    self.put(channel, dict(message))
+                except ChannelFull:
+                    pass
+        elif frame[0] == 'flush':
+            self.queues.clear()
+            self.groups.clear()
+
+    def put(self, channel, message):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue()
+        now = time.time()
+        if queue.qsize() >= self.layer.get_capacity(channel):
+            # Make room by dropping expired messages nobody received
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+            if queue.qsize() >= self.layer.get_capacity(channel):
+                raise ChannelFull(channel)
+        queue.put_nowait((now + self.layer.expiry, message))
+
+    async def write(self, frame):
+        if not self.connected.is_set():
+            if not self.can_host:
+                # No hub means no worker, so no channel to deliver to
+                await asyncio.wait_for(self.attempted.wait(), CONNECT_TIMEOUT)
+                if not self.connected.is_set():
+                    logger.debug('No channel layer hub at %s, dropping %s', self.layer.path, frame[0])
+                    return
+            await asyncio.wait_for(self.connected.wait(), CONNECT_TIMEOUT)
+        self.writer.write(pack(frame))
+        if self.writer.transport.get_write_buffer_size() > WORKER_BUFFER_LIMIT:
+            await self.writer.drain()
+
+    async def close(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """Channel layer shared by the worker processes of one host"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=None, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = path or default_path()
+        ensure_private_directory(os.path.dirname(os.path.abspath(self.path)))
+        self.group_expiry = group_expiry
+        self.links = weakref.WeakKeyDictionary()
+
+    def link(self):
+        loop = asyncio.get_running_loop()
+        link = self.links.get(loop)
+        if link is None:
+            link = self.links[loop] = Link(self)
+        return link
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        return f'{prefix}{self.link().worker_id}!{secrets.token_hex(6)}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        link = self.link()
+        if worker_of(channel) == link.worker_id:
+            link.put(channel, dict(message))
+        else:
+            await link.write(['send', channel, message])
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        link = self.link()
+        if worker_of(channel) != link.worker_id:
+            raise ValueError('Only channels created by this process can be received from')
+
+        queue = link.queues.get(channel)
+        if queue is None:
+            queue = link.queues[channel] = asyncio.Queue()
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires >= time.time():
+                    return message
+                # Expired: like the in-memory layer, drop the channel's groups
+                await self.discard_channel(channel)
+        finally:
+            if queue.empty() and link.queues.get(channel) is queue:
+                del link.queues[channel]
+
+    async def discard_channel(self, channel):
+        for group, channels in list(self.link().groups.items()):
+            if channel in channels:
+                await self.group_discard(group, channel)
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        link = self.link()
+        link.groups.setdefault(group, set()).add(channel)
+        await link.write(['group_add', group, channel])
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        link = self.link()
+        channels = link.groups.get(group)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del link.groups[group]
+        await link.write(['group_discard', group, channel])
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        await self.link().write(['group_send', group, message])
+
+    # Flush extension
+
+    async def flush(self):
+        link = self.link()
+        link.queues.clear()
+        link.groups.clear()
+        await link.write(['flush'])
+
+    async def close(self):
+        for link in list(self.links.values()):
+            await link.close()
+        self.links = weakref.WeakKeyDictionary()
@@ -0,0 +1,143 @@
+"""
+Limits on what a chat WebSocket may send and how much may queue up for it.
+
+Incoming, checked before a frame is parsed or touches the database:
+
+- frames above MAX_FRAME_SIZE characters close the socket (1009);
+- every frame takes a token from the connection's bucket (FRAME_RATE per
+  second, bursts of FRAME_BURST); frames without one are dropped, and
+  MAX_STRIKES of them in a row close the socket (1008);
+- chat messages also take a token from the user's bucket, shared by all
+  of the user's sockets in the process (MESSAGE_RATE, MESSAGE_BURST), and
+  may have at most MAX_MESSAGE_LENGTH characters. The sender gets a
+  message_error with retry_after instead. The bucket outlives the user's
+  sockets, so reconnecting does not refill it; it is dropped once nothing
+  has used it for BUCKET_TTL seconds and it has refilled.
+
+Outgoing, frames wait in a per-connection queue of at most SEND_QUEUE while
+the socket is sent to. When a slow client lets it fill up, SLOW_CONSUMER
+decides: 'drop' discards frames that a later one supersedes (presence,
+typing, read receipts) and disconnects only when a chat message does not
+fit; 'disconnect' closes the socket (1013) on any overflow. A disconnected
+client reconnects and resumes from its last message (history.py). The queue
+only fills on servers whose send waits for the client (e.g. uvicorn);
+Daphne buffers without limit below it.
+
+Counters of everything refused are kept per process (see stats()).
+
+CHAT_LIMITS options: MAX_FRAME_SIZE, MAX_MESSAGE_LENGTH, FRAME_RATE,
+FRAME_BURST, MESSAGE_RATE, MESSAGE_BURST, BUCKET_TTL, MAX_STRIKES,
+SEND_QUEUE, SLOW_CONSUMER.
+"""
+
+import time
+from collections import Counter
+
+from django.conf import settings
+
+DEFAULTS = {
+    'MAX_FRAME_SIZE': 16384,
+    'MAX_MESSAGE_LENGTH': 4000,
+    'FRAME_RATE': 20,
+    'FRAME_BURST': 40,
+    'MESSAGE_RATE': 5,
+    'MESSAGE_BURST': 15,
+    'BUCKET_TTL': 300,
+    'MAX_STRIKES': 100,
+    'SEND_QUEUE': 500,
+    'SLOW_CONSUMER': 'drop',
+}
+
+# WebSocket close codes
+CLOSE_TOO_BIG = 1009
+CLOSE_POLICY = 1008
+CLOSE_TRY_AGAIN = 1013
+
+counters = Counter()
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'CHAT_LIMITS', {}))
+
+
+def count(name, amount=1):
+    counters[name] += amount
+
+
+def stats():
+    """Refused, dropped and disconnected counts of this process since it started"""
+    return {
+        'throttled_frames': counters['throttled_frames'],
+        'throttled_messages': counters['throttled_messages'],
+        'oversized_frames': counters['oversized_frames'],
+        'oversized_messages': counters['oversized_messages'],
+        'invalid_frames': counters['invalid_frames'],
+        'dropped_frames': counters['dropped_frames'],
+        'abuse_disconnects': counters['abuse_disconnects'],
+        'slow_disconnects': counters['slow_disconnects'],
+    }
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def retry_after(self):
+        """Seconds until the next token"""
+        return round(max(0, 1 - self.tokens) / self.rate, 2)
+
+
+# {user id: [message bucket, sockets]}
+_user_buckets = {}
+_last_eviction = time.monotonic()
+
+
+def acquire_user_bucket(user_id, config):
+    evict_idle_buckets(config['BUCKET_TTL'])
+    entry = _user_buckets.get(user_id)
+    if entry is None:
+        entry = _user_buckets[user_id] = [TokenBucket(config['MESSAGE_RATE'], config['MESSAGE_BURST']), 0]
+    entry[1] += 1
+    return entry[0]
+
+
+def release_user_bucket(user_id):
+    # Kept with what is left in it until evict_idle_buckets() drops it
+    entry = _user_buckets.get(user_id)
+    if entry is not None:
+        entry[1] -= 1
+
+
+def evict_idle_buckets(ttl):
+    """
+    Drop, at most once every ttl seconds, the buckets of users without
+    sockets that have not been used for ttl seconds and are full again (as
+    good as a new one)
+    """
+    global _last_eviction
+    now = time.monotonic()
+    if now - _last_eviction < ttl:
+        return
+    _last_eviction = now
+    for user_id, (bucket, sockets) in list(_user_buckets.items()):
+        if sockets <= 0 and now - bucket.updated >= ttl and bucket.is_full(now):
+            del _user_buckets[user_id]
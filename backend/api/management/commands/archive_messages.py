@@ -0,0 +1,77 @@
+"""
+Move chat messages between the live table and the archive (api/archive.py).
+
+By default archives, room by room, the messages CHAT_ARCHIVE allows
+(older than AFTER_DAYS, outside the latest KEEP_RECENT, read by everyone
+else), one segment of at most SEGMENT_SIZE messages per transaction, so it
+can run while the chat is up; schedule it e.g. daily. --restore moves
+archived messages back into the live table, newest segment first.
+
+Usage:
+    python manage.py archive_messages [--room ID] [--days 90] [--keep 200] [--segment-size 1000] [--max-segments N]
+    python manage.py archive_messages --restore [--room ID] [--max-segments N]
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import archive
+from api.models import ChatRoom, MessageArchiveSegment
+
+
+class Command(BaseCommand):
+    help = 'Archive old chat messages into compressed segments, or restore them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', type=int, help='Only this chat room')
+        parser.add_argument('--restore', action='store_true', help='Move archived messages back to the live table')
+        parser.add_argument('--days', type=int, help="Override CHAT_ARCHIVE['AFTER_DAYS']")
+        parser.add_argument('--keep', type=int, help="Override CHAT_ARCHIVE['KEEP_RECENT']")
+        parser.add_argument('--segment-size', type=int, help="Override CHAT_ARCHIVE['SEGMENT_SIZE']")
+        parser.add_argument('--max-segments', type=int, help='Stop after this many segments per room')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            self.restore(options)
+        else:
+            self.archive(options)
+        totals = archive.stats()
+        self.stdout.write(
+            f"{totals['hot_messages']} mensajes en la tabla activa, "
+            f"{totals['archived_messages']} archivados en {totals['segments']} segmentos."
+        )
+
+    def archive(self, options):
+        config = archive.get_config()
+        overrides = {'AFTER_DAYS': options['days'], 'KEEP_RECENT': options['keep'], 'SEGMENT_SIZE': options['segment_size']}
+        config.update({key: value for key, value in overrides.items() if value is not None})
+        now = timezone.now()
+
+        # Rooms created since the cutoff cannot have messages to archive
+        rooms = ChatRoom.objects.filter(created_at__lt=now - timedelta(days=config['AFTER_DAYS']))
+        if options['room'] is not None:
+            rooms = rooms.filter(pk=options['room'])
+
+        segments = moved = 0
+        for room_id in list(rooms.order_by('pk').values_list('pk', flat=True)):
+            room_segments, room_moved = archive.archive_room(room_id, config, now, options['max_segments'])
+            if room_moved:
+                self.stdout.write(f'Sala {room_id}: {room_moved} mensajes archivados en {room_segments} segmentos.')
+            segments += room_segments
+            moved += room_moved
+        self.stdout.write(self.style.SUCCESS(f'{moved} mensajes archivados en {segments} segmentos.'))
+
+    def restore(self, options):
+        segments = MessageArchiveSegment.objects.all()
+        if options['room'] is not None:
+            segments = segments.filter(room_id=options['room'])
+
+        total_segments = moved = 0
+        for room_id in list(segments.order_by('room_id').values_list('room_id', flat=True).distinct()):
+            room_segments, room_moved = archive.restore_room(room_id, options['max_segments'])
+            self.stdout.write(f'Sala {room_id}: {room_moved} mensajes restaurados de {room_segments} segmentos.')
+            total_segments += room_segments
+            moved += room_moved
+        self.stdout.write(self.style.SUCCESS(f'{moved} mensajes restaurados de {total_segments} segmentos.'))
@@ -0,0 +1,129 @@
+"""
+Benchmark group_send fan-out of the Unix socket channel layer across
+worker processes.
+
+Starts --processes worker processes, each joining --channels channels to one
+group, then sends --messages group messages from this process and reports
+delivery latency and throughput. The layer runs on its own temporary socket,
+so it does not interfere with a running server.
+
+Usage:
+    python manage.py bench_channel_layer [--processes 4] [--channels 250] [--messages 200]
+"""
+
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.layers import UnixSocketChannelLayer
+
+GROUP = 'bench'
+
+
+def run_worker(path, channels, messages, ready, results):
+    async def main():
+        layer = UnixSocketChannelLayer(path=path, capacity=messages + 1)
+        names = [await layer.new_channel() for _ in range(channels)]
+        for name in names:
+            await layer.group_add(GROUP, name)
+        # The hub handles each connection's frames in order, so once a group
+        # message comes back every group_add above has been applied
+        probe = f'{GROUP}.ready.{names[0].rsplit("!", 1)[-1]}'
+        await layer.group_add(probe, names[0])
+        await layer.group_send(probe, {'type': 'bench.ready'})
+        await layer.receive(names[0])
+        await layer.group_discard(probe, names[0])
+        ready.set()
+
+        latencies = []
+
+        async def consume(name):
+            for _ in range(messages):
+                message = await layer.receive(name)
+                latencies.append(time.time() - message['sent'])
+
+        await asyncio.gather(*[consume(name) for name in names])
+        results.put((latencies, time.time()))
+        await layer.close()
+
+    asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = 'Benchmark group_send fan-out of api.layers.UnixSocketChannelLayer across processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='Worker processes')
+        parser.add_argument('--channels', type=int, default=250, help='Channels per worker process')
+        parser.add_argument('--messages', type=int, default=200, help='Messages sent to the group')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        channels = options['channels']
+        messages = options['messages']
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'channels.sock')
+            started, sent, reports = asyncio.run(self.run(path, processes, channels, messages))
+
+        latencies = sorted(latency for report, _finished in reports for latency in report)
+        finished = max(finished for _report, finished in reports)
+        deliveries = len(latencies)
+        expected = processes * channels * messages
+        elapsed = finished - started
+
+        self.stdout.write(
+            f'{processes} procesos x {channels} canales, {messages} mensajes de grupo '
+            f'({sent:.3f}s enviando)'
+        )
+        self.stdout.write(f'Entregas: {deliveries}/{expected} en {elapsed:.3f}s '
+                          f'({deliveries / elapsed:,.0f} entregas/s)')
+        if latencies:
+            self.stdout.write(
+                'Latencia (ms): p50 {:.2f}  p95 {:.2f}  p99 {:.2f}  máx {:.2f}'.format(
+                    statistics.median(latencies) * 1000,
+                    latencies[int(len(latencies) * 0.95) - 1] * 1000,
+                    latencies[int(len(latencies) * 0.99) - 1] * 1000,
+                    latencies[-1] * 1000,
+                )
+            )
+        if deliveries == expected:
+            self.stdout.write(self.style.SUCCESS('Todos los mensajes entregados.'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{expected - deliveries} entregas perdidas.'))
+
+    async def run(self, path, processes, channels, messages):
+        # This process runs the hub, so workers finishing early don't take
+        # it down while others are still receiving
+        layer = UnixSocketChannelLayer(path=path)
+        await layer.link().connected.wait()
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        ready = [context.Event() for _ in range(processes)]
+        workers = [
+            context.Process(target=run_worker, args=(path, channels, messages, event, results))
+            for event in ready
+        ]
+        for worker in workers:
+            worker.start()
+        while not all(event.is_set() for event in ready):
+            await asyncio.sleep(0.01)
+
+        started = time.time()
+        for _ in range(messages):
+            await layer.group_send(GROUP, {'type': 'bench.message', 'sent': time.time()})
+        sent = time.time() - started
+
+        reports = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [results.get(timeout=120) for _ in workers]
+        )
+        for worker in workers:
+            worker.join()
+        await layer.close()
+        return started, sent, reports
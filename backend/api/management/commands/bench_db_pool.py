@@ -0,0 +1,89 @@
+"""
+Benchmark the chat database pool (api/db_pool.py) against
+database_sync_to_async.
+
+Runs --jobs membership lookups (the query behind every WebSocket connect)
+from --concurrency concurrent callers, once on the single
+database_sync_to_async thread and once per pool size in --sizes, and
+reports throughput, wait in the queue and latency. --latency-ms adds that
+much sleep to each job to stand in for the round trip to a database server;
+with SQLite alone the queries are too short to show the difference.
+
+Only reads, so it can run against the development database.
+
+Usage:
+    python manage.py bench_db_pool [--sizes 1,2,4,8] [--jobs 2000] [--concurrency 200] [--latency-ms 2]
+"""
+
+import asyncio
+import statistics
+import time
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+
+from api.db_pool import DatabasePool
+from api.memberships import Participants
+
+
+def lookup(user_id, latency):
+    exists = Participants.objects.filter(user_id=user_id, chatroom_id=1).exists()
+    if latency:
+        time.sleep(latency)
+    return exists
+
+
+class Command(BaseCommand):
+    help = 'Benchmark api.db_pool against database_sync_to_async'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,2,4,8', help='Comma-separated pool sizes')
+        parser.add_argument('--jobs', type=int, default=2000, help='Lookups per run')
+        parser.add_argument('--concurrency', type=int, default=200, help='Concurrent callers')
+        parser.add_argument('--latency-ms', type=float, default=2.0, help='Simulated database round trip per job')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        jobs = options['jobs']
+        concurrency = options['concurrency']
+        latency = options['latency_ms'] / 1000
+
+        self.stdout.write(
+            f'{jobs} consultas, {concurrency} concurrentes, {options["latency_ms"]:g} ms de latencia simulada'
+        )
+        self.stdout.write(f'{"ejecutor":<22}{"consultas/s":>12}{"espera media":>14}{"p50":>9}{"p99":>9}')
+
+        baseline = asyncio.run(self.run(database_sync_to_async(lookup), jobs, concurrency, latency))
+        self.report('hilo único (actual)', baseline)
+
+        for size in sizes:
+            pool = DatabasePool({'SIZE': size, 'MAX_QUEUE': concurrency, 'CONN_MAX_AGE': 600})
+            call = lambda user_id, latency: pool.run(lookup, user_id, latency)  # noqa: E731
+            try:
+                result = asyncio.run(self.run(call, jobs, concurrency, latency))
+            finally:
+                pool.shutdown()
+            self.report(f'pool de {size}', result, pool.stats()['avg_wait_ms'])
+
+    async def run(self, call, jobs, concurrency, latency):
+        latencies = []
+        per_caller = max(jobs // concurrency, 1)
+
+        async def caller(user_id):
+            for _ in range(per_caller):
+                started = time.perf_counter()
+                await call(user_id, latency)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[caller(user_id) for user_id in range(1, concurrency + 1)])
+        return time.perf_counter() - started, sorted(latencies)
+
+    def report(self, name, result, avg_wait_ms=None):
+        elapsed, latencies = result
+        wait = f'{avg_wait_ms:.2f} ms' if avg_wait_ms is not None else '-'
+        self.stdout.write(
+            f'{name:<22}{len(latencies) / elapsed:>12,.0f}{wait:>14}'
+            f'{statistics.median(latencies) * 1000:>7.1f}ms'
+            f'{latencies[int(len(latencies) * 0.99) - 1] * 1000:>7.1f}ms'
+        )
@@ -0,0 +1,36 @@
+"""
+Rebuild the chat message search index (api/message_search.py).
+
+Needed once for the messages written before the index existed, and to drop
+rows left behind by messages deleted outside the API. Commits every
+--batch-size messages, so it can run on a large table while the chat is up;
+messages written meanwhile are indexed as usual.
+
+Usage:
+    python manage.py rebuild_message_index [--room ID] [--batch-size 2000]
+"""
+
+from django.core.management.base import BaseCommand
+
+from api import message_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the chat message search index from Message'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--room',
+            type=int,
+            help='Only rebuild the messages of this chat room'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of messages indexed per transaction'
+        )
+
+    def handle(self, *args, **options):
+        total = message_search.rebuild(room_id=options['room'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{total} mensajes indexados para búsqueda.'))
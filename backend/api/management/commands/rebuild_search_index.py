@@ -0,0 +1,35 @@
+"""
+Rebuild the denormalized provider search index and the text search index.
+
+Usage:
+    python manage.py rebuild_search_index [--batch-size 500]
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.search_index import rebuild_index
+from api.text_search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the provider search index and text search index from ProviderProfile and Machine'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of providers indexed per batch'
+        )
+    
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{total} proveedores indexados.'))
+        
+        backend = get_search_backend()
+        if backend is not None:
+            with transaction.atomic():
+                documents = backend.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{documents} documentos indexados para búsqueda de texto.'))
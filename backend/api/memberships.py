@@ -0,0 +1,186 @@
+"""
+Cached chat room membership.
+
+Authorizing a WebSocket connect only needs to know whether a user belongs
+to a room. The full set of a user's room ids is loaded in one query and
+cached in two tiers:
+
+- an in-process dict with a short TTL, read without leaving the event loop
+  (zero queries and no thread hop for the common reconnect);
+- an optional shared Django cache (CHAT_MEMBERSHIP_CACHE) so other worker
+  processes can fill their local tier without a query.
+
+Entries are invalidated from m2m_changed on ChatRoom.participants and when
+a room is deleted (see signals.py). Other processes drop removed
+memberships when their local TTL expires. A room missing from a cached set
+is always re-checked against the database, so newly created rooms are
+never rejected.
+
+Direct rooms (two users) are found and created by their pair key, see
+get_or_create_direct_room().
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+
+from .models import ChatRoom
+
+KEY_PREFIX = 'chat-rooms'
+
+Participants = ChatRoom.participants.through
+
+
+def direct_pair(user_id, other_user_id):
+    """Canonical (lower id, higher id) key of a direct room"""
+    return (user_id, other_user_id) if user_id < other_user_id else (other_user_id, user_id)
+
+
+def get_shared_cache():
+    alias = getattr(settings, 'CHAT_MEMBERSHIP_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_local_ttl():
+    return getattr(settings, 'CHAT_MEMBERSHIP_LOCAL_TTL', 30)
+
+
+def get_shared_ttl():
+    return getattr(settings, 'CHAT_MEMBERSHIP_SHARED_TTL', 300)
+
+
+def _shared_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+class LocalMemberships:
+    """In-process {user id: frozenset of room ids} with a TTL"""
+
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, user_id, room_ids):
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                self.entries.pop(next(iter(self.entries)), None)
+            self.entries.pop(user_id, None)
+            self.entries[user_id] = (time.monotonic() + get_local_ttl(), room_ids)
+
+    def forget(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local = LocalMemberships()
+
+
+def load_rooms(user_id):
+    """Room ids of a user from the shared tier or, failing that, the database"""
+    shared = get_shared_cache()
+    if shared is not None:
+        room_ids = shared.get(_shared_key(user_id))
+        if room_ids is not None:
+            room_ids = frozenset(room_ids)
+            local.set(user_id, room_ids)
+            return room_ids
+
+    room_ids = frozenset(
+        Participants.objects.filter(user_id=user_id).values_list('chatroom_id', flat=True)
+    )
+    local.set(user_id, room_ids)
+    if shared is not None:
+        shared.set(_shared_key(user_id), list(room_ids), get_shared_ttl())
+    return room_ids
+
+
+def cached_rooms(user_id):
+    """Room ids of a user from the local tier, or None. Never queries."""
+    return local.get(user_id)
+
+
+def cached_participant(user_id, room_id):
+    """
+    True if the local tier knows the user is in the room. Never queries,
+    so it can be called from async code; False means "unknown".
+    """
+    room_ids = local.get(user_id)
+    return room_ids is not None and room_id in room_ids
+
+
+def is_participant(user_id, room_id):
+    """Whether the user belongs to the room (synchronous, may query)"""
+    room_ids = local.get(user_id)
+    if room_ids is None:
+        room_ids = load_rooms(user_id)
+    if room_id in room_ids:
+        return True
+    # Possibly a room created since the set was cached
+    if Participants.objects.filter(user_id=user_id, chatroom_id=room_id).exists():
+        forget([user_id])
+        return True
+    return False
+
+
+def forget(user_ids):
+    """Invalidate the cached rooms of these users in both tiers"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    local.forget(user_ids)
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.delete_many([_shared_key(user_id) for user_id in user_ids])
+
+
+def participant_ids(room_id):
+    return list(Participants.objects.filter(chatroom_id=room_id).values_list('user_id', flat=True))
+
+
+def contacts(user_id, user_ids):
+    """Those of user_ids who share a room with the user, in one query"""
+    room_ids = local.get(user_id)
+    if room_ids is None:
+        room_ids = load_rooms(user_id)
+    return set(
+        Participants.objects.filter(
+            chatroom_id__in=room_ids,
+            user_id__in=user_ids
+        ).values_list('user_id', flat=True)
+    )
+
+
+def get_or_create_direct_room(user_id, other_user_id):
+    """
+    The direct room of two users, created with both as participants if they
+    have none. One lookup on the pair's unique index; when two requests
+    create the same room at once, the loser's insert fails on that index and
+    it returns the winner's room. Returns (room, created).
+    """
+    low, high = direct_pair(user_id, other_user_id)
+    room = ChatRoom.objects.filter(direct_user_low_id=low, direct_user_high_id=high).first()
+    if room is not None:
+        return room, False
+
+    try:
+        with transaction.atomic():
+            room = ChatRoom.objects.create(direct_user_low_id=low, direct_user_high_id=high)
+            room.participants.add(low, high)
+    except IntegrityError:
+        return ChatRoom.objects.get(direct_user_low_id=low, direct_user_high_id=high), False
+    return room, True
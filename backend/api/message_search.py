@@ -0,0 +1,216 @@
+"""
+Full-text search over the chat messages of a user's rooms.
+
+Message content is normalized like the provider and machine search
+(lowercase, accent folding, light Spanish stemming; see text_search.py) and
+every distinct token of a message is stored in MessageSearchToken with the
+message's room. A search reads the postings of the query tokens in the
+requester's rooms only, along the (room, token, message_id) index, and
+keeps the messages that contain every token, newest first. Its cost grows
+with the requester's own history, not with the size of the table.
+
+The index is maintained as messages are written: bulk writes of the chat
+message writer call index_messages() in their transaction, other saves go
+through the signal handler in signals.py and MessageViewSet unindexes the
+messages it deletes. Tokens of a deleted room go with it (cascade); those of
+messages deleted some other way are skipped by search() until a rebuild.
+Existing messages are indexed with ``python manage.py rebuild_message_index``.
+
+Tokens stay in the index when messages move to the archive, and matches
+are read from there (archive.py).
+
+Results carry a snippet of the message around the first match, HTML-escaped,
+with the matching words wrapped in <mark>.
+"""
+
+from html import escape
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from . import archive
+from .memberships import Participants
+from .models import Message, MessageArchiveSegment, MessageSearchToken
+from .text_search import MAX_TOKEN_LENGTH, STOPWORDS, WORD_RE, fold, query_terms, stem, tokenize
+
+MAX_TERMS = 8
+MAX_RESULTS = 100
+DEFAULT_RESULTS = 20
+SNIPPET_LENGTH = 160
+
+
+# ==================== INDEXING ====================
+
+def message_tokens(content):
+    return set(tokenize(content))
+
+
+def token_rows(messages):
+    return [
+        MessageSearchToken(room_id=message.room_id, token=token, message_id=message.pk)
+        for message in messages
+        for token in message_tokens(message.content)
+    ]
+
+
+def index_messages(messages, batch_size=1000):
+    """Index new messages (not indexed before)"""
+    MessageSearchToken.objects.bulk_create(token_rows(messages), batch_size=batch_size)
+
+
+def reindex_message(message):
+    """Replace the tokens of an edited message"""
+    with transaction.atomic():
+        remove_message(message.pk)
+        index_messages([message])
+
+
+def remove_message(message_id):
+    MessageSearchToken.objects.filter(message_id=message_id).delete()
+
+
+def rebuild(room_id=None, batch_size=2000):
+    """
+    Index every message (of one room, or all), live and archived,
+    batch_size messages or one archive segment per transaction so a large
+    table is not rebuilt in one. Returns the count.
+
+    Messages written after it starts are left alone; they are indexed as
+    they are written. Don't archive messages while it runs.
+    """
+    last = Message.objects.aggregate(last=Max('pk'))['last'] or 0
+    tokens = MessageSearchToken.objects.filter(message_id__lte=last)
+    messages = Message.objects.filter(pk__lte=last).order_by('pk').only('pk', 'room_id', 'content')
+    segments = MessageArchiveSegment.objects.order_by('pk')
+    if room_id is not None:
+        tokens = tokens.filter(room_id=room_id)
+        messages = messages.filter(room_id=room_id)
+        segments = segments.filter(room_id=room_id)
+    tokens.delete()
+
+    total = 0
+    last_id = 0
+    while True:
+        batch = list(messages.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            index_messages(batch)
+        total += len(batch)
+        last_id = batch[-1].pk
+
+    for segment in segments.iterator(chunk_size=10):
+        batch = [archive.to_message(segment.room_id, row) for row in archive.decode(archive.read_payload(segment))]
+        with transaction.atomic():
+            index_messages(batch)
+        total += len(batch)
+    return total
+
+
+# ==================== SEARCH ====================
+
+def search(user_id, query, room_id=None, before_id=None, limit=DEFAULT_RESULTS):
+    """
+    Messages of the user's rooms containing every word of query, newest
+    first, as (messages, terms, next_before); next_before is the before_id
+    of the next page, or None when there is none.
+    """
+    terms = query_terms(query)[:MAX_TERMS]
+    if not terms:
+        return [], terms, None
+
+    postings = MessageSearchToken.objects.filter(
+        room_id__in=Participants.objects.filter(user_id=user_id).values('chatroom_id'),
+        token__in=terms
+    )
+    if room_id is not None:
+        postings = postings.filter(room_id=room_id)
+    if before_id is not None:
+        postings = postings.filter(message_id__lt=before_id)
+
+    if len(terms) == 1:
+        rows = postings.order_by('-message_id').values_list('message_id', 'room_id')
+    else:
+        rows = postings.order_by().values('message_id', 'room_id').annotate(
+            matched=Count('token', distinct=True)
+        ).filter(matched=len(terms)).order_by('-message_id').values_list('message_id', 'room_id')
+
+    # A message written while rebuild() runs may have its tokens twice
+    rooms = dict(rows[:limit + 1])
+    ids = list(rooms)
+    next_before = ids[limit - 1] if len(ids) > limit else None
+    ids = ids[:limit]
+
+    found = Message.objects.select_related('author').in_bulk(ids)
+    archived = {message_id: rooms[message_id] for message_id in ids if message_id not in found}
+    if archived:
+        found.update(
+            (message.pk, message)
+            for message in archive.attach_authors(list(archive.load_messages(archived).values()))
+        )
+    return [found[message_id] for message_id in ids if message_id in found], terms, next_before
+
+
+# ==================== SNIPPETS ====================
+
+def fold_with_offsets(text):
+    """fold(text) and, for each of its characters, the index of the original one"""
+    folded = []
+    offsets = []
+    for index, char in enumerate(text):
+        for folded_char in fold(char):
+            folded.append(folded_char)
+            offsets.append(index)
+    return ''.join(folded), offsets
+
+
+def match_spans(content, terms):
+    """(start, end) in content of every word whose stem is one of terms"""
+    terms = set(terms)
+    folded, offsets = fold_with_offsets(content)
+    spans = []
+    for match in WORD_RE.finditer(folded):
+        word = match.group()
+        if word not in STOPWORDS and stem(word[:MAX_TOKEN_LENGTH]) in terms:
+            spans.append((offsets[match.start()], offsets[match.end() - 1] + 1))
+    return spans
+
+
+def snippet(content, terms, length=SNIPPET_LENGTH):
+    """
+    HTML-escaped excerpt of about length characters around the first match,
+    matches wrapped in <mark>
+    """
+    spans = match_spans(content, terms)
+
+    start = 0
+    end = len(content)
+    if end > length:
+        if spans:
+            start = max(0, spans[0][0] - length // 3)
+        end = min(len(content), start + length)
+        start = max(0, end - length)
+        # Don't cut words at the edges
+        if start > 0:
+            space = content.find(' ', start, spans[0][0] if spans else end)
+            if space != -1:
+                start = space + 1
+        if end < len(content):
+            space = content.rfind(' ', start, end)
+            if space > start and (not spans or space >= spans[0][1]):
+                end = space
+
+    parts = ['…'] if start > 0 else []
+    position = start
+    for span_start, span_end in spans:
+        span_start = max(span_start, start)
+        span_end = min(span_end, end)
+        if span_start >= span_end:
+            continue
+        parts.append(escape(content[position:span_start]))
+        parts.append(f'<mark>{escape(content[span_start:span_end])}</mark>')
+        position = span_end
+    parts.append(escape(content[position:end]))
+    if end < len(content):
+        parts.append('…')
+    return ''.join(parts)
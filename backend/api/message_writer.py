@@ -0,0 +1,280 @@
+"""
+Persistence of chat messages sent over WebSockets.
+
+In the default write-behind mode a message gets its id and timestamp up
+front, is broadcast right away and is written later together with every
+other message of the same flush window: one bulk INSERT plus one UPDATE of
+the rooms' updated_at per window, instead of four round trips per message
+(run on the chat database pool, see db_pool.py).
+
+Each message takes its id from the table's own sequence when it is sent
+(see reserve_ids), so messages created elsewhere (the REST API, other
+workers) never collide with ids handed out but not yet written, and ids
+follow the order messages were sent in. Read watermarks, resumes, history
+windows, search and the archive all rely on that order; ids must not be
+reserved ahead in blocks. Sends that arrive while a reservation is in
+flight share the next one, so a writer makes one round trip per group of
+concurrent sends rather than one per message: under load the batches grow
+instead of the queue.
+
+CHAT_PERSISTENCE options:
+
+- MODE: 'write_behind' or 'sync' (write before broadcasting)
+- FLUSH_INTERVAL: seconds a message may wait in the buffer
+- MAX_BATCH: buffered messages that trigger an immediate flush
+- ACK: what the sender is told: 'none', 'accepted' (right after the
+  broadcast) or 'persisted' (once the message is committed)
+- RETRIES: attempts for a failed flush before its messages are reported
+  as not saved
+
+Messages still buffered when a process dies are lost; FLUSH_INTERVAL
+bounds that window and ACK='persisted' lets clients resend unconfirmed
+messages.
+"""
+
+import asyncio
+import logging
+import weakref
+
+from django.conf import settings
+from django.db import NotSupportedError, connection, transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from . import db_pool, message_search
+from .models import ChatRoom, Message
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MODE': 'write_behind',
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_BATCH': 500,
+    'ACK': 'persisted',
+    'RETRIES': 3,
+}
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'CHAT_PERSISTENCE', {}))
+
+
+# ==================== ID RESERVATION ====================
+
+def reserve_ids(model, count):
+    """
+    Reserve count primary keys from the table's sequence and return them.
+
+    Supported on PostgreSQL (nextval) and SQLite (AUTOINCREMENT counter);
+    raises NotSupportedError on other databases.
+    """
+    table = model._meta.db_table
+    pk_column = model._meta.pk.column
+    quote = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                [table, pk_column, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+        if connection.vendor == 'sqlite':
+            # Taking the write lock first makes the read-back atomic
+            cursor.execute(
+                'UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s', [count, table]
+            )
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    f'INSERT INTO sqlite_sequence (name, seq) '
+                    f'SELECT %s, COALESCE(MAX({quote(pk_column)}), 0) + %s FROM {quote(table)}',
+                    [table, count]
+                )
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            last = cursor.fetchone()[0]
+            return list(range(last - count + 1, last + 1))
+
+    raise NotSupportedError(f'Cannot reserve ids on {connection.vendor}')
+
+
+# ==================== WRITES ====================
+
+def write_message(room_id, author_id, content):
+    """Insert one message and bump its room (sync mode)"""
+    with transaction.atomic():
+        message = Message.objects.create(room_id=room_id, author_id=author_id, content=content)
+        ChatRoom.objects.filter(pk=room_id).update(updated_at=message.timestamp)
+    return message
+
+
+def write_batch(messages):
+    """Insert buffered messages and bump their rooms in one transaction"""
+    latest = {}
+    for message in messages:
+        latest[message.room_id] = max(latest.get(message.room_id, message.timestamp), message.timestamp)
+
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        # bulk_create sends no post_save
+        message_search.index_messages(messages)
+        # One UPDATE for every room of the window
+        ChatRoom.objects.filter(pk__in=list(latest)).update(updated_at=Case(
+            *[When(pk=room_id, then=Value(timestamp)) for room_id, timestamp in latest.items()],
+            output_field=DateTimeField()
+        ))
+
+
+def write_each(messages):
+    """Write messages one by one; returns the exception (or None) of each"""
+    results = []
+    for message in messages:
+        try:
+            write_batch([message])
+            results.append(None)
+        except Exception as exc:  # noqa: BLE001
+            results.append(exc)
+    return results
+
+
+class MessageWriter:
+    """
+    Per event loop write-behind buffer.
+
+    save() returns the message (with id and timestamp) and an awaitable
+    that resolves once it is committed, or raises if it could not be.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.pending = []
+        # Sends waiting for an id, and the task reserving them
+        self.reserving = []
+        self.reserver = None
+        self.flush_lock = asyncio.Lock()
+        self.flush_handle = None
+        # Running flushes, referenced until done
+        self.flush_tasks = set()
+        self.write_behind = self.config['MODE'] == 'write_behind'
+
+    async def save(self, room_id, author_id, content):
+        if not self.write_behind:
+            message = await db_pool.run(write_message, room_id, author_id, content)
+            done = asyncio.get_running_loop().create_future()
+            done.set_result(True)
+            return message, done
+
+        try:
+            message_id, timestamp = await self.reserve()
+        except NotSupportedError:
+            # No sequence to reserve from: write synchronously from now on
+            self.write_behind = False
+            return await self.save(room_id, author_id, content)
+
+        message = Message(
+            id=message_id,
+            room_id=room_id,
+            author_id=author_id,
+            content=content,
+            timestamp=timestamp
+        )
+        committed = asyncio.get_running_loop().create_future()
+        self.pending.append((message, committed))
+        self.schedule_flush()
+        return message, committed
+
+    async def reserve(self):
+        """
+        Id and timestamp for a message being sent, in the order save() was
+        called. Waits for the next reservation, shared with every send
+        arriving before it starts.
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self.reserving.append(waiter)
+        if self.reserver is None:
+            self.reserver = asyncio.get_running_loop().create_task(self.reserve_waiting())
+        return await waiter
+
+    async def reserve_waiting(self):
+        """Reserve ids for the waiting sends, one round trip per group"""
+        try:
+            while self.reserving:
+                waiters, self.reserving = self.reserving, []
+                try:
+                    message_ids = await db_pool.run(reserve_ids, Message, len(waiters))
+                except Exception as exc:  # noqa: BLE001 - reported to the senders
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(exc)
+                    continue
+                # Id and timestamp together, so both follow the send order
+                timestamp = timezone.now()
+                for waiter, message_id in zip(waiters, message_ids):
+                    # A cancelled send leaves a gap in the ids
+                    if not waiter.done():
+                        waiter.set_result((message_id, timestamp))
+        finally:
+            self.reserver = None
+
+    def schedule_flush(self):
+        if len(self.pending) >= self.config['MAX_BATCH']:
+            self.start_flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.config['FLUSH_INTERVAL'], self.start_flush)
+
+    def start_flush(self):
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush(self):
+        """Write every buffered message; flushes run one at a time, in order"""
+        async with self.flush_lock:
+            if self.flush_handle is not None:
+                self.flush_handle.cancel()
+                self.flush_handle = None
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+
+            messages = [message for message, _committed in batch]
+            error = None
+            for attempt in range(self.config['RETRIES']):
+                try:
+                    await db_pool.run(write_batch, messages)
+                    error = None
+                    break
+                except Exception as exc:  # noqa: BLE001 - reported to the senders
+                    error = exc
+                    logger.warning('Chat message flush failed (attempt %s): %s', attempt + 1, exc)
+                    await asyncio.sleep(self.config['FLUSH_INTERVAL'] * (attempt + 1))
+
+            if error is None:
+                results = [None] * len(batch)
+            else:
+                # Don't let one bad message (e.g. its room was deleted)
+                # take the rest of the window down with it
+                results = await db_pool.run(write_each, messages)
+                failed = sum(result is not None for result in results)
+                if failed:
+                    logger.error('Dropped %s chat messages: %s', failed, error)
+
+            for (_message, committed), result in zip(batch, results):
+                if committed.done():
+                    continue
+                if result is None:
+                    committed.set_result(True)
+                else:
+                    committed.set_exception(result)
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_writer():
+    """The writer of the running event loop"""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageWriter()
+    return writer
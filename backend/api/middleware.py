@@ -0,0 +1,185 @@
+"""
+JWT authentication for WebSocket connections.
+
+Clients authenticate sockets with the same SimpleJWT access token they use
+for the REST API, either in the query string:
+
+    ws://host/ws/chat/12/?token=<access token>
+
+or, to keep it out of URLs and logs, as a subprotocol pair:
+
+    new WebSocket(url, ['bearer', '<access token>'])
+
+The token is validated locally (signature, expiry, token type). The user is
+a lightweight SocketUser built from the token's user id plus the profile
+fields consumers need, kept in a short-TTL in-process cache, so a burst of
+reconnects after a deploy does not turn into one session and user lookup
+per socket.
+"""
+
+import threading
+import time
+from urllib.parse import parse_qs
+
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import db_pool
+
+User = get_user_model()
+
+TOKEN_QUERY_PARAM = 'token'
+TOKEN_SUBPROTOCOL = 'bearer'
+
+USER_FIELDS = ['id', 'email', 'username', 'first_name', 'last_name', 'is_staff']
+
+
+class SocketUser:
+    """
+    Authenticated user of a WebSocket connection.
+
+    Carries only the fields consumers read; it is not a model instance and
+    cannot be saved.
+    """
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+
+    def __init__(self, id, email, username, first_name, last_name, is_staff):
+        self.id = self.pk = id
+        self.email = email
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.is_staff = is_staff
+
+    def __str__(self):
+        return self.email
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.pk and getattr(other, 'is_authenticated', False)
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+class UserCache:
+    """
+    In-process {user id: SocketUser or None} cache with a TTL.
+
+    Inactive or deleted users are cached as None so repeated attempts with
+    their (still valid) tokens are rejected without queries.
+    """
+
+    def __init__(self, ttl=None, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'WEBSOCKET_USER_CACHE_TTL', 60)
+
+    def get(self, user_id):
+        """(found, user) for a cached user id"""
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    def set(self, user_id, user):
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                # Drop the oldest entry (dicts keep insertion order)
+                self.entries.pop(next(iter(self.entries)), None)
+            self.entries.pop(user_id, None)
+            self.entries[user_id] = (time.monotonic() + self.get_ttl(), user)
+
+    def forget(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+def load_user(user_id):
+    """SocketUser for an active user id, or None"""
+    row = User.objects.filter(pk=user_id, is_active=True).values(*USER_FIELDS).first()
+    return SocketUser(**row) if row else None
+
+
+def get_token(scope):
+    """
+    Raw token and the subprotocol to accept the connection with, taken from
+    the subprotocols or the query string. Returns (None, None) if absent.
+    """
+    subprotocols = scope.get('subprotocols') or []
+    if TOKEN_SUBPROTOCOL in subprotocols:
+        position = subprotocols.index(TOKEN_SUBPROTOCOL)
+        if position + 1 < len(subprotocols):
+            return subprotocols[position + 1], TOKEN_SUBPROTOCOL
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    values = query.get(TOKEN_QUERY_PARAM)
+    if values:
+        return values[0], None
+    return None, None
+
+
+def get_token_user_id(raw_token):
+    """User id of a valid access token, or None"""
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return None
+    return token.get(api_settings.USER_ID_CLAIM)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Populate scope['user'] from a SimpleJWT access token.
+
+    Sets scope['user'] to AnonymousUser when the token is missing or
+    invalid, and scope['auth_subprotocol'] when the token came as a
+    subprotocol (the consumer must accept with it).
+    """
+
+    def __init__(self, inner, cache=None):
+        super().__init__(inner)
+        self.cache = cache or user_cache
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token, subprotocol = get_token(scope)
+        user = None
+        if raw_token:
+            user = await self.get_user(raw_token)
+        scope['user'] = user or AnonymousUser()
+        scope['auth_subprotocol'] = subprotocol
+        return await super().__call__(scope, receive, send)
+
+    async def get_user(self, raw_token):
+        user_id = get_token_user_id(raw_token)
+        if user_id is None:
+            return None
+        found, user = self.cache.get(user_id)
+        if not found:
+            user = await db_pool.run(load_user, user_id)
+            self.cache.set(user_id, user)
+        return user
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
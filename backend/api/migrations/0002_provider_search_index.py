@@ -0,0 +1,85 @@
+# Generated by Django 5.0 on 2026-10-18 06:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_search_index(apps, schema_editor):
+    """Index existing providers (same logic as search_index.rebuild_index)"""
+    ProviderProfile = apps.get_model('api', 'ProviderProfile')
+    Machine = apps.get_model('api', 'Machine')
+    ProviderSearchIndex = apps.get_model('api', 'ProviderSearchIndex')
+
+    category_bits = {
+        value: 1 << position
+        for position, value in enumerate([
+            'excavator', 'crane', 'truck', 'transport', 'loader', 'bulldozer',
+            'roller', 'mixer', 'pump', 'forklift', 'other',
+        ])
+    }
+
+    rows = []
+    for provider in ProviderProfile.objects.select_related('user').iterator():
+        machines = Machine.objects.filter(provider_id=provider.pk)
+        mask = 0
+        for category in machines.values_list('category', flat=True).distinct():
+            mask |= category_bits.get(category, 0)
+        rows.append(ProviderSearchIndex(
+            provider_id=provider.pk,
+            user_email=provider.user.email,
+            company_name=provider.company_name,
+            description=provider.description,
+            logo=provider.logo,
+            city=provider.city,
+            region=provider.region,
+            country=provider.country,
+            subscription_status=provider.subscription_status,
+            is_verified=provider.is_verified,
+            available_within_48h=provider.available_within_48h,
+            rating=provider.rating,
+            total_reviews=provider.total_reviews,
+            category_mask=mask,
+            machines_count=machines.count(),
+            available_machines_count=machines.filter(is_available=True).count(),
+            created_at=provider.created_at,
+        ))
+    ProviderSearchIndex.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderSearchIndex',
+            fields=[
+                ('provider', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='api.providerprofile', verbose_name='provider')),
+                ('user_email', models.EmailField(blank=True, max_length=254, verbose_name='email address')),
+                ('company_name', models.CharField(max_length=255, verbose_name='company name')),
+                ('description', models.TextField(blank=True, verbose_name='description')),
+                ('logo', models.ImageField(blank=True, null=True, upload_to='logos/', verbose_name='company logo')),
+                ('city', models.CharField(blank=True, max_length=100, verbose_name='city')),
+                ('region', models.CharField(blank=True, max_length=100, verbose_name='region/state')),
+                ('country', models.CharField(blank=True, max_length=100, verbose_name='country')),
+                ('subscription_status', models.CharField(max_length=20, verbose_name='subscription status')),
+                ('is_verified', models.BooleanField(default=False, verbose_name='verified')),
+                ('available_within_48h', models.BooleanField(default=False, verbose_name='available within 48 hours')),
+                ('rating', models.DecimalField(decimal_places=2, default=0.0, max_digits=3, verbose_name='rating')),
+                ('total_reviews', models.PositiveIntegerField(default=0, verbose_name='total reviews')),
+                ('category_mask', models.PositiveIntegerField(default=0, help_text='Bit set of the machine categories offered (see search_index.category_bit)', verbose_name='category mask')),
+                ('machines_count', models.PositiveIntegerField(default=0, verbose_name='machines')),
+                ('available_machines_count', models.PositiveIntegerField(default=0, verbose_name='available machines')),
+                ('created_at', models.DateTimeField(verbose_name='provider created at')),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'provider search index',
+                'verbose_name_plural': 'provider search index',
+                'indexes': [models.Index(fields=['subscription_status', 'is_verified', '-available_within_48h', '-rating', '-available_machines_count'], name='provider_search_rank_idx'), models.Index(fields=['region', 'city'], name='provider_search_location_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,155 @@
+# Generated by Django 5.0 on 2026-10-18 06:47
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Copies of the api.text_search normalization and documents as of this
+# migration, so later changes to them don't change the index it builds
+WORD_RE = re.compile(r'[a-z0-9]+')
+VOWELS = 'aeiou'
+
+MIN_GRAM = 3
+MAX_GRAM = 15
+MAX_TOKEN_LENGTH = 40
+
+STOPWORDS = frozenset([
+    'a', 'al', 'con', 'de', 'del', 'el', 'en', 'la', 'las', 'lo', 'los',
+    'o', 'para', 'por', 'se', 'un', 'una', 'y',
+])
+
+PROVIDER_FIELD_WEIGHTS = {
+    'company_name': 6,
+    'city': 4,
+    'region': 4,
+    'description': 2,
+}
+MACHINE_FIELD_WEIGHTS = {
+    'name': 6,
+    'brand': 4,
+    'model': 4,
+    'category': 4,
+    'description': 2,
+}
+
+CATEGORY_LABELS = {
+    'excavator': 'Excavadora',
+    'crane': 'Grúa',
+    'truck': 'Camión',
+    'transport': 'Transporte de Áridos',
+    'loader': 'Cargador Frontal',
+    'bulldozer': 'Bulldozer',
+    'roller': 'Rodillo Compactador',
+    'mixer': 'Mixer/Hormigonera',
+    'pump': 'Bomba de Hormigón',
+    'forklift': 'Grúa Horquilla',
+    'other': 'Otro',
+}
+
+
+def fold(text):
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(word):
+    if len(word) < 4 or word.isdigit():
+        return word
+    if word.endswith('ces'):
+        word = word[:-3] + 'z'
+    elif word.endswith('es') and word[-3] not in VOWELS:
+        word = word[:-2]
+    elif word.endswith('s') and word[-2] in VOWELS:
+        word = word[:-1]
+    if len(word) > 4 and word[-1] in 'aoe':
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    stems = []
+    for word in WORD_RE.findall(fold(text or '')):
+        if word in STOPWORDS:
+            continue
+        stems.append(stem(word[:MAX_TOKEN_LENGTH]))
+    return stems
+
+
+def document_tokens(fields):
+    tokens = {}
+    for text, field_weight in fields:
+        seen = {}
+        for word in tokenize(text):
+            seen[word] = max(seen.get(word, 0), field_weight)
+            for length in range(MIN_GRAM, min(len(word), MAX_GRAM + 1)):
+                prefix = word[:length]
+                seen[prefix] = max(seen.get(prefix, 0), field_weight // 2)
+        for token, weight in seen.items():
+            tokens[token] = tokens.get(token, 0) + weight
+    return tokens
+
+
+def provider_document(provider):
+    return [
+        (getattr(provider, field), weight)
+        for field, weight in PROVIDER_FIELD_WEIGHTS.items()
+    ]
+
+
+def machine_document(machine):
+    fields = []
+    for field, weight in MACHINE_FIELD_WEIGHTS.items():
+        text = getattr(machine, field)
+        if field == 'category':
+            text = f"{text} {CATEGORY_LABELS.get(text, '')}"
+        fields.append((text, weight))
+    return fields
+
+
+def backfill_search_tokens(apps, schema_editor):
+    """Index existing providers and machines for text search"""
+    SearchToken = apps.get_model('api', 'SearchToken')
+    sources = [
+        ('provider', apps.get_model('api', 'ProviderProfile'), provider_document),
+        ('machine', apps.get_model('api', 'Machine'), machine_document),
+    ]
+    for kind, model, build_document in sources:
+        rows = []
+        for instance in model.objects.iterator():
+            tokens = document_tokens(build_document(instance))
+            rows.extend(
+                SearchToken(kind=kind, object_id=instance.pk, token=token, weight=weight)
+                for token, weight in tokens.items()
+            )
+        SearchToken.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_provider_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('provider', 'Provider'), ('machine', 'Machine')], max_length=20, verbose_name='kind')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='object id')),
+                ('token', models.CharField(max_length=64, verbose_name='token')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='weight')),
+            ],
+            options={
+                'verbose_name': 'search token',
+                'verbose_name_plural': 'search tokens',
+                'indexes': [models.Index(fields=['kind', 'token', 'object_id'], name='search_token_lookup_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchtoken',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id', 'token'), name='search_token_unique'),
+        ),
+        migrations.RunPython(backfill_search_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_search_token'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['-created_at', '-id'], name='machine_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp', 'id'], name='message_room_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='providerprofile',
+            index=models.Index(fields=['subscription_status', 'is_verified', '-available_within_48h', '-rating', '-created_at'], name='provider_list_idx'),
+        ),
+    ]
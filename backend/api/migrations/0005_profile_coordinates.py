@@ -0,0 +1,53 @@
+# Generated by Django 5.0 on 2026-10-18 06:50
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='constructorprofile',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)], verbose_name='latitude'),
+        ),
+        migrations.AddField(
+            model_name='constructorprofile',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)], verbose_name='longitude'),
+        ),
+        migrations.AddField(
+            model_name='providerprofile',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)], verbose_name='latitude'),
+        ),
+        migrations.AddField(
+            model_name='providerprofile',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)], verbose_name='longitude'),
+        ),
+        migrations.AddField(
+            model_name='providersearchindex',
+            name='geo_cell',
+            field=models.BigIntegerField(blank=True, help_text='Spatial grid cell of the coordinates (see api/geo.py)', null=True, verbose_name='grid cell'),
+        ),
+        migrations.AddField(
+            model_name='providersearchindex',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='latitude'),
+        ),
+        migrations.AddField(
+            model_name='providersearchindex',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='longitude'),
+        ),
+        migrations.AddIndex(
+            model_name='providersearchindex',
+            index=models.Index(fields=['geo_cell'], name='provider_search_geo_idx'),
+        ),
+    ]
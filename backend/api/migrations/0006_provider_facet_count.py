@@ -0,0 +1,82 @@
+# Generated by Django 5.0 on 2026-10-18 06:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# Copies of api.search_index.CATEGORY_BITS and api.facets.cells_for as of this
+# migration, so later changes to them don't change what it does
+CATEGORY_BITS = {
+    category: 1 << position
+    for position, category in enumerate([
+        'excavator', 'crane', 'truck', 'transport', 'loader', 'bulldozer',
+        'roller', 'mixer', 'pump', 'forklift', 'other',
+    ])
+}
+ANY_CATEGORY = ''
+
+
+def cells_for(region, city, available, category_mask):
+    cells = {(region, city, available, ANY_CATEGORY)}
+    for category, bit in CATEGORY_BITS.items():
+        if category_mask & bit:
+            cells.add((region, city, available, category))
+    return cells
+
+
+def backfill_facet_counts(apps, schema_editor):
+    """Compute the facet counters from the provider search index"""
+    ProviderSearchIndex = apps.get_model('api', 'ProviderSearchIndex')
+    ProviderFacetCount = apps.get_model('api', 'ProviderFacetCount')
+
+    rows = ProviderSearchIndex.objects.filter(
+        subscription_status='active',
+        is_verified=True
+    ).order_by().values(
+        'region', 'city', 'available_within_48h', 'category_mask'
+    ).annotate(providers=Count('pk'))
+
+    counts = {}
+    for row in rows:
+        for cell in cells_for(row['region'], row['city'], row['available_within_48h'], row['category_mask']):
+            counts[cell] = counts.get(cell, 0) + row['providers']
+
+    ProviderFacetCount.objects.bulk_create([
+        ProviderFacetCount(
+            region=region,
+            city=city,
+            available_within_48h=available,
+            category=category,
+            providers=providers
+        )
+        for (region, city, available, category), providers in counts.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_profile_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(blank=True, max_length=100, verbose_name='region/state')),
+                ('city', models.CharField(blank=True, max_length=100, verbose_name='city')),
+                ('available_within_48h', models.BooleanField(verbose_name='available within 48 hours')),
+                ('category', models.CharField(blank=True, max_length=50, verbose_name='category')),
+                ('providers', models.IntegerField(default=0, verbose_name='providers')),
+            ],
+            options={
+                'verbose_name': 'provider facet count',
+                'verbose_name_plural': 'provider facet counts',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='providerfacetcount',
+            constraint=models.UniqueConstraint(fields=('region', 'city', 'available_within_48h', 'category'), name='provider_facet_count_unique'),
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0 on 2026-10-18 06:56
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_provider_facet_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['category', 'is_available', '-created_at'], name='machine_cat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['category', 'is_available', 'price_per_day'], name='machine_cat_day_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['category', 'is_available', 'price_per_hour'], name='machine_cat_hour_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['category', 'is_available', 'year'], name='machine_cat_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(django.db.models.functions.text.Lower('brand'), django.db.models.functions.text.Lower('model'), name='machine_brand_model_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['provider', 'is_available'], name='machine_provider_avail_idx'),
+        ),
+    ]
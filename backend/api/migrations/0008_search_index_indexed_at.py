@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_machine_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='providersearchindex',
+            index=models.Index(fields=['indexed_at'], name='provider_search_indexed_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-18 07:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_search_index_indexed_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0 on 2026-10-18 07:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_read_states(apps, schema_editor):
+    """
+    Turn the per-message read flags into watermarks: each participant has
+    read up to the latest message from someone else that was flagged read
+    """
+    ChatRoom = apps.get_model('api', 'ChatRoom')
+    Message = apps.get_model('api', 'Message')
+    ReadState = apps.get_model('api', 'ReadState')
+    Participants = ChatRoom.participants.through
+
+    # {room id: {author id: latest read message id}}
+    latest_read = {}
+    rows = Message.objects.filter(read=True).order_by().values('room_id', 'author_id').annotate(last=Max('pk'))
+    for row in rows:
+        latest_read.setdefault(row['room_id'], {})[row['author_id']] = row['last']
+
+    states = []
+    participants = Participants.objects.filter(chatroom_id__in=list(latest_read)).values_list('chatroom_id', 'user_id')
+    for room_id, user_id in participants:
+        last = max(
+            (message_id for author_id, message_id in latest_read[room_id].items() if author_id != user_id),
+            default=0
+        )
+        if last:
+            states.append(ReadState(room_id=room_id, user_id=user_id, last_read_message_id=last))
+    ReadState.objects.bulk_create(states, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.PositiveBigIntegerField(default=0, verbose_name='last read message id')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='api.chatroom', verbose_name='chat room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'read state',
+                'verbose_name_plural': 'read states',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='readstate',
+            constraint=models.UniqueConstraint(fields=('room', 'user'), name='read_state_room_user_unique'),
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='read',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 07:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_read_state'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='message_room_id_idx'),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 5.0 on 2026-10-18 07:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def merge_direct_rooms(apps, schema_editor):
+    """
+    Key every two-participant room by its pair of users. Where a pair has
+    several rooms, the oldest one keeps the pair: the others' messages move
+    into it and the duplicates are deleted. Each participant's watermark
+    stops just before the first message from the other they had not read in
+    any of the rooms, so merging never marks an unread message read (some
+    read ones may show unread again).
+    """
+    ChatRoom = apps.get_model('api', 'ChatRoom')
+    Message = apps.get_model('api', 'Message')
+    ReadState = apps.get_model('api', 'ReadState')
+    Participants = ChatRoom.participants.through
+
+    # {room id: [user ids]}
+    members = {}
+    for room_id, user_id in Participants.objects.order_by('chatroom_id').values_list('chatroom_id', 'user_id'):
+        members.setdefault(room_id, []).append(user_id)
+
+    # {(low, high): [room ids, oldest first]}
+    pairs = {}
+    for room_id, user_ids in members.items():
+        user_ids = set(user_ids)
+        if len(user_ids) == 2:
+            pairs.setdefault(tuple(sorted(user_ids)), []).append(room_id)
+
+    keyed = []
+    for (low, high), room_ids in pairs.items():
+        room_ids.sort()
+        keeper, duplicates = room_ids[0], room_ids[1:]
+        if duplicates:
+            watermarks = {}
+            for user_id in (low, high):
+                read_up_to = dict(
+                    ReadState.objects.filter(room_id__in=room_ids, user_id=user_id).values_list(
+                        'room_id', 'last_read_message_id'
+                    )
+                )
+                first_unread = [
+                    Message.objects.filter(
+                        room_id=room_id,
+                        pk__gt=read_up_to.get(room_id, 0)
+                    ).exclude(author_id=user_id).aggregate(first=Min('pk'))['first']
+                    for room_id in room_ids
+                ]
+                first_unread = [message_id for message_id in first_unread if message_id is not None]
+                if first_unread:
+                    watermarks[user_id] = min(first_unread) - 1
+                elif read_up_to:
+                    watermarks[user_id] = max(read_up_to.values())
+
+            Message.objects.filter(room_id__in=duplicates).update(room_id=keeper)
+            ReadState.objects.filter(room_id__in=duplicates).delete()
+            for user_id, last_read in watermarks.items():
+                ReadState.objects.update_or_create(
+                    room_id=keeper,
+                    user_id=user_id,
+                    defaults={'last_read_message_id': last_read}
+                )
+
+            updated_at = ChatRoom.objects.filter(pk__in=room_ids).aggregate(last=Max('updated_at'))['last']
+            ChatRoom.objects.filter(pk__in=duplicates).delete()
+            ChatRoom.objects.filter(pk=keeper).update(
+                direct_user_low_id=low,
+                direct_user_high_id=high,
+                updated_at=updated_at
+            )
+        else:
+            keyed.append(ChatRoom(pk=keeper, direct_user_low_id=low, direct_user_high_id=high))
+
+    ChatRoom.objects.bulk_update(keyed, ['direct_user_low', 'direct_user_high'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_message_room_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='direct_user_high',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='direct room user (higher id)'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='direct_user_low',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='direct room user (lower id)'),
+        ),
+        migrations.RunPython(merge_direct_rooms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(condition=models.Q(('direct_user_high__isnull', False), ('direct_user_low__isnull', False)), fields=('direct_user_low', 'direct_user_high'), name='chat_room_direct_pair_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(check=models.Q(('direct_user_low__lt', models.F('direct_user_high')), ('direct_user_low__isnull', True), ('direct_user_high__isnull', True), _connector='OR'), name='chat_room_direct_pair_ordered'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-18 07:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_chatroom_direct_pair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, verbose_name='token')),
+                ('message_id', models.PositiveBigIntegerField(verbose_name='message id')),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.chatroom', verbose_name='chat room')),
+            ],
+            options={
+                'verbose_name': 'message search token',
+                'verbose_name_plural': 'message search tokens',
+                'indexes': [models.Index(fields=['room', 'token', 'message_id'], name='message_token_lookup_idx'), models.Index(fields=['message_id'], name='message_token_message_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-18 07:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_message_search_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_message_id', models.PositiveBigIntegerField(verbose_name='first message id')),
+                ('last_message_id', models.PositiveBigIntegerField(verbose_name='last message id')),
+                ('message_count', models.PositiveIntegerField(verbose_name='message count')),
+                ('first_timestamp', models.DateTimeField(verbose_name='first message time')),
+                ('last_timestamp', models.DateTimeField(verbose_name='last message time')),
+                ('data', models.BinaryField(blank=True, null=True, verbose_name='compressed messages')),
+                ('file', models.FileField(blank=True, upload_to='chat-archive/', verbose_name='compressed messages file')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='api.chatroom', verbose_name='chat room')),
+            ],
+            options={
+                'verbose_name': 'message archive segment',
+                'verbose_name_plural': 'message archive segments',
+                'indexes': [models.Index(fields=['room', 'last_message_id'], name='message_archive_room_idx')],
+            },
+        ),
+    ]
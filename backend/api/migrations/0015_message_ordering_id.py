@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 08:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_message_archive_segment'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['id'], 'verbose_name': 'message', 'verbose_name_plural': 'messages'},
+        ),
+    ]
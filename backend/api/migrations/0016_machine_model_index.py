@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 08:12
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_message_ordering_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(django.db.models.functions.text.Lower('model'), name='machine_model_idx'),
+        ),
+    ]
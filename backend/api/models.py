@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -57,10 +60,22 @@ class ConstructorProfile(models.Model):
         _('address'),
         blank=True
     )
-    # Location fields (for future GeoDjango integration)
+    # Location fields
     city = models.CharField(_('city'), max_length=100, blank=True)
     region = models.CharField(_('region/state'), max_length=100, blank=True)
     country = models.CharField(_('country'), max_length=100, default='Chile')
+    latitude = models.FloatField(
+        _('latitude'),
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        _('longitude'),
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -123,6 +138,18 @@ class ProviderProfile(models.Model):
     city = models.CharField(_('city'), max_length=100, blank=True)
     region = models.CharField(_('region/state'), max_length=100, blank=True)
     country = models.CharField(_('country'), max_length=100, default='Chile')
+    latitude = models.FloatField(
+        _('latitude'),
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        _('longitude'),
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
     
     # Subscription information
     subscription_status = models.CharField(
@@ -177,6 +204,14 @@ class ProviderProfile(models.Model):
         verbose_name = _('provider profile')
         verbose_name_plural = _('provider profiles')
         ordering = ['-available_within_48h', '-rating', '-created_at']
+        indexes = [
+            # Public provider list: active + verified, default ordering
+            models.Index(
+                fields=['subscription_status', 'is_verified', '-available_within_48h',
+                        '-rating', '-created_at'],
+                name='provider_list_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.company_name} - {self.user.email}"
@@ -277,6 +312,32 @@ class Machine(models.Model):
         verbose_name = _('machine')
         verbose_name_plural = _('machines')
         ordering = ['-created_at']
+        indexes = [
+            # Catalogue ordering (keyset pagination on created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='machine_created_idx'),
+            # Machine search: equality on category/availability, then the
+            # range or ordering column
+            models.Index(
+                fields=['category', 'is_available', '-created_at'],
+                name='machine_cat_created_idx'
+            ),
+            models.Index(
+                fields=['category', 'is_available', 'price_per_day'],
+                name='machine_cat_day_price_idx'
+            ),
+            models.Index(
+                fields=['category', 'is_available', 'price_per_hour'],
+                name='machine_cat_hour_price_idx'
+            ),
+            models.Index(
+                fields=['category', 'is_available', 'year'],
+                name='machine_cat_year_idx'
+            ),
+            # ?brand= (with or without ?model=) and ?model= alone
+            models.Index(Lower('brand'), Lower('model'), name='machine_brand_model_idx'),
+            models.Index(Lower('model'), name='machine_model_idx'),
+            models.Index(fields=['provider', 'is_available'], name='machine_provider_avail_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.provider.company_name})"
@@ -315,12 +376,34 @@ class MachineImage(models.Model):
 class ChatRoom(models.Model):
     """
     Chat room between a Constructor and a Provider.
+    
+    A direct room (two participants) carries its pair of users as
+    (direct_user_low, direct_user_high), lower id first, unique together, so
+    finding the room of two users is one indexed lookup and concurrent
+    creation cannot make two (see memberships.get_or_create_direct_room).
+    Other rooms leave both empty.
     """
     participants = models.ManyToManyField(
         User,
         related_name='chat_rooms',
         verbose_name=_('participants')
     )
+    direct_user_low = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_('direct room user (lower id)')
+    )
+    direct_user_high = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_('direct room user (higher id)')
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -328,6 +411,19 @@ class ChatRoom(models.Model):
         verbose_name = _('chat room')
         verbose_name_plural = _('chat rooms')
         ordering = ['-updated_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['direct_user_low', 'direct_user_high'],
+                condition=models.Q(direct_user_low__isnull=False, direct_user_high__isnull=False),
+                name='chat_room_direct_pair_unique'
+            ),
+            models.CheckConstraint(
+                check=models.Q(direct_user_low__lt=models.F('direct_user_high'))
+                | models.Q(direct_user_low__isnull=True)
+                | models.Q(direct_user_high__isnull=True),
+                name='chat_room_direct_pair_ordered'
+            ),
+        ]
     
     def __str__(self):
         participant_names = ", ".join([user.email for user in self.participants.all()[:2]])
@@ -336,7 +432,7 @@ class ChatRoom(models.Model):
     @property
     def last_message(self):
         """Get the last message in this room"""
-        return self.messages.order_by('-timestamp').first()
+        return self.messages.order_by('-id').first()
 
 
 class Message(models.Model):
@@ -356,17 +452,263 @@ class Message(models.Model):
         verbose_name=_('author')
     )
     content = models.TextField(_('content'))
-    timestamp = models.DateTimeField(auto_now_add=True)
-    read = models.BooleanField(
-        _('read'),
-        default=False,
-        help_text=_('Whether the message has been read by the recipient')
-    )
+    # Not auto_now_add: write-behind persistence assigns it before the insert
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         verbose_name = _('message')
         verbose_name_plural = _('messages')
-        ordering = ['timestamp']
+        # Ids are taken from the sequence when a message is sent, so they
+        # follow the send order (see message_writer.py)
+        ordering = ['id']
+        indexes = [
+            # Room messages by time (?ordering=timestamp, keyset on timestamp, id)
+            models.Index(fields=['room', 'timestamp', 'id'], name='message_room_timestamp_idx'),
+            # Room history windows and resumes by id (history.py)
+            models.Index(fields=['room', 'id'], name='message_room_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.author.email}: {self.content[:50]}"
+
+
+class ReadState(models.Model):
+    """
+    How far a participant has read a chat room: every message with an id up
+    to last_read_message_id counts as read by them (see read_receipts.py).
+    """
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='read_states',
+        verbose_name=_('chat room')
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='read_states',
+        verbose_name=_('user')
+    )
+    last_read_message_id = models.PositiveBigIntegerField(_('last read message id'), default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _('read state')
+        verbose_name_plural = _('read states')
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='read_state_room_user_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} read room {self.room_id} up to {self.last_read_message_id}"
+
+
+class MessageArchiveSegment(models.Model):
+    """
+    Compressed block of a chat room's older messages (the cold tier).
+    
+    Holds the room's messages with ids from first_message_id to
+    last_message_id, moved out of Message by the archive_messages command,
+    as zlib-compressed msgpack rows stored in data or, with
+    CHAT_ARCHIVE['STORAGE'] = 'file', in a file under MEDIA_ROOT. Message
+    ids and timestamps are kept, so history reads both tiers by id
+    (see api/archive.py).
+    """
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='archive_segments',
+        db_index=False,
+        verbose_name=_('chat room')
+    )
+    first_message_id = models.PositiveBigIntegerField(_('first message id'))
+    last_message_id = models.PositiveBigIntegerField(_('last message id'))
+    message_count = models.PositiveIntegerField(_('message count'))
+    first_timestamp = models.DateTimeField(_('first message time'))
+    last_timestamp = models.DateTimeField(_('last message time'))
+    data = models.BinaryField(_('compressed messages'), null=True, blank=True)
+    file = models.FileField(_('compressed messages file'), upload_to='chat-archive/', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('message archive segment')
+        verbose_name_plural = _('message archive segments')
+        indexes = [
+            # Segments of a room by id range, newest first
+            models.Index(fields=['room', 'last_message_id'], name='message_archive_room_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Room {self.room_id} messages {self.first_message_id}-{self.last_message_id}"
+
+
+class MessageSearchToken(models.Model):
+    """
+    Inverted index entry for chat message search: one row per distinct
+    normalized token (accent-folded, stemmed word) of a message.
+    
+    Rows carry the room so a search only reads the postings of the
+    requester's rooms, along the (room, token, message_id) index.
+    message_id is not a foreign key so the index does not depend on where
+    the message is stored. Maintained by api/message_search.py.
+    """
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_index=False,
+        verbose_name=_('chat room')
+    )
+    token = models.CharField(_('token'), max_length=64)
+    message_id = models.PositiveBigIntegerField(_('message id'))
+    
+    class Meta:
+        verbose_name = _('message search token')
+        verbose_name_plural = _('message search tokens')
+        indexes = [
+            # Postings of a token in a room, newest message first
+            models.Index(fields=['room', 'token', 'message_id'], name='message_token_lookup_idx'),
+            # Reindexing and removing one message
+            models.Index(fields=['message_id'], name='message_token_message_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.message_id} {self.token}"
+
+
+class ProviderSearchIndex(models.Model):
+    """
+    Denormalized search row for a provider.
+    
+    One row per ProviderProfile holding everything the provider search needs
+    (profile state, location, category membership and machine counts), so
+    search reads a single indexed table without joining Machine.
+    Kept up to date by the signal handlers in api/signals.py.
+    """
+    provider = models.OneToOneField(
+        ProviderProfile,
+        on_delete=models.CASCADE,
+        related_name='search_index',
+        primary_key=True,
+        verbose_name=_('provider')
+    )
+    user_email = models.EmailField(_('email address'), blank=True)
+    company_name = models.CharField(_('company name'), max_length=255)
+    description = models.TextField(_('description'), blank=True)
+    logo = models.ImageField(_('company logo'), upload_to='logos/', blank=True, null=True)
+    
+    # Location
+    city = models.CharField(_('city'), max_length=100, blank=True)
+    region = models.CharField(_('region/state'), max_length=100, blank=True)
+    country = models.CharField(_('country'), max_length=100, blank=True)
+    latitude = models.FloatField(_('latitude'), null=True, blank=True)
+    longitude = models.FloatField(_('longitude'), null=True, blank=True)
+    geo_cell = models.BigIntegerField(
+        _('grid cell'),
+        null=True,
+        blank=True,
+        help_text=_('Spatial grid cell of the coordinates (see api/geo.py)')
+    )
+    
+    # Subscription and verification state
+    subscription_status = models.CharField(_('subscription status'), max_length=20)
+    is_verified = models.BooleanField(_('verified'), default=False)
+    available_within_48h = models.BooleanField(_('available within 48 hours'), default=False)
+    rating = models.DecimalField(_('rating'), max_digits=3, decimal_places=2, default=0.00)
+    total_reviews = models.PositiveIntegerField(_('total reviews'), default=0)
+    
+    # Machine aggregates
+    category_mask = models.PositiveIntegerField(
+        _('category mask'),
+        default=0,
+        help_text=_('Bit set of the machine categories offered (see search_index.category_bit)')
+    )
+    machines_count = models.PositiveIntegerField(_('machines'), default=0)
+    available_machines_count = models.PositiveIntegerField(_('available machines'), default=0)
+    
+    # Timestamps
+    created_at = models.DateTimeField(_('provider created at'))
+    indexed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _('provider search index')
+        verbose_name_plural = _('provider search index')
+        indexes = [
+            models.Index(
+                fields=['subscription_status', 'is_verified', '-available_within_48h',
+                        '-rating', '-available_machines_count'],
+                name='provider_search_rank_idx'
+            ),
+            models.Index(fields=['region', 'city'], name='provider_search_location_idx'),
+            models.Index(fields=['geo_cell'], name='provider_search_geo_idx'),
+            # Incremental refresh of the ranking feature store
+            models.Index(fields=['indexed_at'], name='provider_search_indexed_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Search index: {self.company_name}"
+
+
+class SearchToken(models.Model):
+    """
+    Inverted index entry for the text search backend.
+    
+    Each row maps a normalized token (accent-folded, stemmed word or a prefix
+    of it) to a provider or machine, with a weight used to rank results.
+    Maintained incrementally by api/text_search.py on save and delete.
+    """
+    KIND_CHOICES = [
+        ('provider', _('Provider')),
+        ('machine', _('Machine')),
+    ]
+    
+    kind = models.CharField(_('kind'), max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField(_('object id'))
+    token = models.CharField(_('token'), max_length=64)
+    weight = models.PositiveIntegerField(_('weight'), default=1)
+    
+    class Meta:
+        verbose_name = _('search token')
+        verbose_name_plural = _('search tokens')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'object_id', 'token'],
+                name='search_token_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'token', 'object_id'], name='search_token_lookup_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} {self.token}"
+
+
+class ProviderFacetCount(models.Model):
+    """
+    Incrementally maintained facet counter for the provider search.
+    
+    Number of searchable providers (active subscription, verified) per
+    (region, city, 48h availability, machine category). The row with an
+    empty category counts providers regardless of category. The table grows
+    with the number of distinct locations, not with the number of providers,
+    so facets are aggregated from it in memory (see api/facets.py).
+    """
+    region = models.CharField(_('region/state'), max_length=100, blank=True)
+    city = models.CharField(_('city'), max_length=100, blank=True)
+    available_within_48h = models.BooleanField(_('available within 48 hours'))
+    category = models.CharField(_('category'), max_length=50, blank=True)
+    providers = models.IntegerField(_('providers'), default=0)
+    
+    class Meta:
+        verbose_name = _('provider facet count')
+        verbose_name_plural = _('provider facet counts')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['region', 'city', 'available_within_48h', 'category'],
+                name='provider_facet_count_unique'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.region}/{self.city}/{self.category or '*'}: {self.providers}"
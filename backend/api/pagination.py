@@ -0,0 +1,319 @@
+"""
+Pagination classes for the ConnecMaq API.
+"""
+
+import base64
+import binascii
+import datetime
+import decimal
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque-cursor keyset pagination.
+
+    The cursor stores the ordering values of the last row of the page and
+    the next page is fetched with ``WHERE (ordering) > (values)`` instead
+    of ``OFFSET``, so there is no ``COUNT(*)`` and deep pages cost the same
+    as the first one. Pages stay stable when rows are inserted concurrently.
+
+    Any ordering made of plain non-nullable columns or annotations is
+    supported, including composite orderings with mixed directions
+    (e.g. ``-available_within_48h, -rating, -available_machines_count``);
+    the primary key is appended as a tiebreaker.
+
+    Passing ``?page=`` switches to the legacy page-number mode (with
+    ``count``) for compatibility. Orderings that cannot be expressed as a
+    keyset (related fields, nullable columns) fall back to it as well.
+
+    Response: {"next": url, "previous": url, "results": [...]}
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    legacy_query_param = 'page'
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+
+        fields = self.get_keyset_fields(queryset)
+        if fields is None or self.legacy_query_param in request.query_params:
+            self.legacy = PageNumberPagination()
+            self.legacy.page_size = self.get_page_size(request)
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        cursor = self.decode_cursor(request, len(fields))
+        reverse = cursor['reverse'] if cursor else False
+
+        ordering = [
+            ('-' if descending != reverse else '') + name
+            for name, descending in fields
+        ]
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            try:
+                values = self.cursor_values(queryset, fields, cursor['values'])
+                queryset = queryset.filter(self.keyset_filter(fields, values, reverse))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.fields = fields
+        self.page = results
+        return results
+
+    def paginate_ranking(self, ranking, request, view=None):
+        """
+        Paginate an in-memory api.ranking.Ranking (candidates sorted by
+        descending score, then pk) with the same cursors and legacy mode.
+        """
+        self.request = request
+        self.legacy = None
+
+        if self.legacy_query_param in request.query_params:
+            self.legacy = PageNumberPagination()
+            self.legacy.page_size = self.get_page_size(request)
+            return self.legacy.paginate_queryset(ranking, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.fields = [('score', True), ('pk', True)]
+        cursor = self.decode_cursor(request, len(self.fields))
+        if cursor is None:
+            start, end = 0, page_size
+        else:
+            try:
+                score, pk = float(cursor['values'][0]), int(cursor['values'][1])
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if cursor['reverse']:
+                end = ranking.end_before(score, pk)
+                start = max(end - page_size, 0)
+            else:
+                start = ranking.start_after(score, pk)
+                end = start + page_size
+
+        results = ranking[start:end]
+        self.has_next = end < len(ranking)
+        self.has_previous = start > 0
+        self.page = results
+        return results
+
+    def paginate_by_id(self, load_before, load_after, request, descending=False):
+        """
+        Paginate rows that are not one queryset (a room's live and archived
+        messages, see api/history.py) by pk with the same cursors.
+
+        load_before(before_id, limit) and load_after(after_id, limit) return
+        up to limit rows next to the id (or at the matching end when it is
+        None), in ascending pk order, and whether there are more beyond
+        them. There is no legacy mode, since there is no cheap count.
+        """
+        self.request = request
+        self.legacy = None
+        page_size = self.get_page_size(request)
+        self.fields = [('pk', descending)]
+
+        cursor = self.decode_cursor(request, len(self.fields))
+        pk = None
+        reverse = False
+        if cursor is not None:
+            try:
+                pk = int(cursor['values'][0])
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            reverse = cursor['reverse']
+
+        # Walking towards lower ids for descending pages, or back from an ascending one
+        if descending != reverse:
+            results, has_more = load_before(pk, page_size)
+        else:
+            results, has_more = load_after(pk, page_size)
+        if descending:
+            results = results[::-1]
+
+        if reverse:
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    # ---------- ordering ----------
+
+    def get_keyset_fields(self, queryset):
+        """
+        Return [(name, descending), ...] for the queryset ordering plus a
+        primary key tiebreaker, or None if it can't be paginated by keyset.
+        """
+        query = queryset.query
+        ordering = list(query.order_by)
+        if not ordering and query.default_ordering:
+            ordering = list(queryset.model._meta.ordering)
+
+        opts = queryset.model._meta
+        fields = []
+        for item in ordering:
+            if not isinstance(item, str) or item == '?':
+                return None
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            if name == 'pk' or name == opts.pk.name:
+                fields.append(('pk', descending))
+                return fields
+            if name not in query.annotations:
+                if '__' in name:
+                    return None
+                try:
+                    field = opts.get_field(name)
+                except FieldDoesNotExist:
+                    return None
+                if field.null or field.is_relation:
+                    return None
+                if field.unique:
+                    fields.append((name, descending))
+                    return fields
+            fields.append((name, descending))
+
+        # Make the ordering total with a primary key tiebreaker
+        fields.append(('pk', fields[-1][1] if fields else False))
+        return fields
+
+    def cursor_values(self, queryset, fields, values):
+        """
+        Cursor values converted with their field's to_python, so a tampered
+        cursor fails here (ValidationError) rather than in the query
+        """
+        opts = queryset.model._meta
+        annotations = queryset.query.annotations
+        converted = []
+        for (name, _desc), value in zip(fields, values):
+            if name == 'pk':
+                field = opts.pk
+            elif name in annotations:
+                try:
+                    field = annotations[name].output_field
+                except FieldError:
+                    field = None
+            else:
+                field = opts.get_field(name)
+            converted.append(value if field is None else field.to_python(value))
+        return converted
+
+    def keyset_filter(self, fields, values, reverse):
+        """
+        Build the lexicographic "after the cursor" condition:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)
+        with the comparison flipped for descending columns.
+        """
+        clauses = []
+        for position, (name, descending) in enumerate(fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[position]})
+            for previous, (previous_name, _desc) in enumerate(fields[:position]):
+                clause &= Q(**{previous_name: values[previous]})
+            clauses.append(clause)
+        return reduce(or_, clauses)
+
+    # ---------- cursors ----------
+
+    def encode_cursor(self, obj, reverse):
+        values = [self.encode_value(getattr(obj, name)) for name, _desc in self.fields]
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request, length):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            values = payload['v']
+            reverse = bool(payload.get('r', 0))
+        except (TypeError, ValueError, KeyError, binascii.Error, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != length:
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        return value
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.legacy_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1], False))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.legacy_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[0], True))
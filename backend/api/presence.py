@@ -0,0 +1,476 @@
+"""
+Presence (online, away, last seen) and typing indicators, kept in memory.
+
+Nothing is written to the database. Each worker process tracks the users
+with sockets in it:
+
+- presence: online or away while a socket of the user is alive. Sockets
+  refresh it with every frame (clients send a heartbeat when idle); a user
+  not heard from in PRESENCE_TTL seconds, or whose last socket closed, is
+  offline with the time they were last seen.
+- typing: who is typing in which room, for CHAT_TYPING_TTL seconds after
+  their last typing frame or until they stop.
+
+Changes are not sent as they happen. A ticker per process runs every
+PRESENCE_TICK seconds and sends, per room, at most one 'presence.update'
+and one 'typing.update' event with everything that changed since the last
+tick, so a burst of keystrokes or reconnects becomes a few events per
+second per room. A user who keeps typing is announced again only every
+half CHAT_TYPING_TTL.
+
+Expiry uses a timing wheel of one-second buckets: each entry sits in one
+bucket at a time and is looked at once per TTL, and a tick sweeps at most
+PRESENCE_SWEEP_BATCH of them, so the cost per tick stays bounded with tens
+of thousands of users. Disconnected users are kept for their last seen
+time up to PRESENCE_MAX_ENTRIES entries, oldest dropped first.
+
+The registry is only changed from the event loop. The REST endpoint reads
+it from other threads, which only needs single dict lookups. With several
+worker processes, set PRESENCE_CACHE to a cache alias shared by all of them
+(e.g. Redis) so it also sees users connected to other processes. The api.W002
+system check (and a warning logged when the first socket connects) flags a
+channel layer that spans processes without such a cache.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+from . import frames
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('online', 'away')
+
+KEY_PREFIX = 'presence'
+
+# Most users per bulk REST request
+MAX_BULK = 500
+
+# Seconds the last seen time of an offline user is kept in the shared cache
+LAST_SEEN_TIMEOUT = 7 * 24 * 3600
+
+
+def get_ttl():
+    return getattr(settings, 'PRESENCE_TTL', 60)
+
+
+def get_tick():
+    return getattr(settings, 'PRESENCE_TICK', 0.25)
+
+
+def get_typing_ttl():
+    return getattr(settings, 'CHAT_TYPING_TTL', 6)
+
+
+def get_sweep_batch():
+    return getattr(settings, 'PRESENCE_SWEEP_BATCH', 2000)
+
+
+def get_max_entries():
+    return getattr(settings, 'PRESENCE_MAX_ENTRIES', 100000)
+
+
+def get_shared_cache():
+    alias = getattr(settings, 'PRESENCE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+# Channel layers and caches that only reach their own process
+LOCAL_LAYERS = ('channels.layers.InMemoryChannelLayer',)
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def unshared_presence():
+    """
+    Why presence stays in each process although the channel layer reaches
+    other processes, or None if it does not
+    """
+    layer = getattr(settings, 'CHANNEL_LAYERS', {}).get('default', {}).get('BACKEND')
+    if not layer or layer in LOCAL_LAYERS:
+        return None
+    alias = getattr(settings, 'PRESENCE_CACHE', None)
+    if not alias:
+        return f'PRESENCE_CACHE is not set but the channel layer ({layer}) spans processes'
+    if settings.CACHES.get(alias, {}).get('BACKEND') in LOCAL_CACHES:
+        return f'PRESENCE_CACHE ({alias!r}) is local to each process but the channel layer ({layer}) spans processes'
+    return None
+
+
+@checks.register()
+def check_shared_cache(app_configs=None, **kwargs):
+    """Presence of users on other workers would read as offline"""
+    problem = unshared_presence()
+    if problem is None:
+        return []
+    return [checks.Warning(
+        f'{problem}: presence only knows the users connected to the process that answers.',
+        hint='Set PRESENCE_CACHE to a cache alias shared by every worker (e.g. Redis), '
+             'or silence api.W002 when running a single process.',
+        id='api.W002',
+    )]
+
+
+def _shared_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def _isoformat(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc).isoformat()
+
+
+def offline_state(user_id, last_seen=None):
+    return {'user_id': user_id, 'status': 'offline', 'last_seen': last_seen}
+
+
+class Presence:
+    """
+    Presence of one user in this process.
+    
+    status is None when offline. due is the wheel bucket the entry is in,
+    or None when it is in none.
+    """
+    
+    __slots__ = ('sockets', 'status', 'last_seen', 'expires', 'due', 'rooms')
+    
+    def __init__(self):
+        self.sockets = 0
+        self.status = None
+        self.last_seen = None
+        self.expires = 0
+        self.due = None
+        self.rooms = set()
+    
+    def state(self, user_id):
+        return {
+            'user_id': user_id,
+            'status': self.status or 'offline',
+            'last_seen': _isoformat(self.last_seen),
+        }
+
+
+class Typing:
+    """A user typing in a room; announced is when the room was last told"""
+    
+    __slots__ = ('expires', 'due', 'announced')
+    
+    def __init__(self):
+        self.expires = 0
+        self.due = None
+        self.announced = 0
+
+
+class PresenceRegistry:
+
+    def __init__(self):
+        # {user id: Presence}, connected users and disconnected ones kept
+        # for their last seen time; offline lists the latter, oldest first
+        self.users = {}
+        self.offline = {}
+        self.sockets = 0
+        
+        # {(room id, user id): Typing}
+        self.typing = {}
+        
+        # {second: set of user ids and (room id, user id) keys}
+        self.wheel = {}
+        self.cursor = int(time.monotonic())
+        
+        # Changes since the last tick
+        self.changed = set()
+        self.republish = set()
+        self.typing_started = {}
+        self.typing_stopped = {}
+        
+        self.ticker = None
+        # Whether the PRESENCE_CACHE setup was checked (see unshared_presence)
+        self.checked = False
+    
+    # ==================== Presence ====================
+    
+    def connect(self, user_id, room_ids):
+        """A socket of the user was accepted"""
+        entry = self.users.get(user_id)
+        if entry is None:
+            self.evict()
+            entry = self.users[user_id] = Presence()
+        entry.sockets += 1
+        entry.rooms.update(room_ids)
+        self.sockets += 1
+        self.touch(user_id, entry)
+    
+    def disconnect(self, user_id):
+        """A socket of the user closed"""
+        entry = self.users.get(user_id)
+        if entry is None or entry.sockets <= 0:
+            return
+        entry.sockets -= 1
+        self.sockets -= 1
+        if entry.sockets == 0 and entry.status is not None:
+            entry.last_seen = time.time()
+            self.go_offline(user_id, entry)
+    
+    def add_room(self, user_id, room_id):
+        """The user's presence changes are also sent to this room"""
+        entry = self.users.get(user_id)
+        if entry is not None and entry.sockets > 0:
+            entry.rooms.add(room_id)
+    
+    def heartbeat(self, user_id, status=None):
+        """The user was heard from; status switches between online and away"""
+        entry = self.users.get(user_id)
+        if entry is not None and entry.sockets > 0:
+            self.touch(user_id, entry, status)
+    
+    def touch(self, user_id, entry, status=None):
+        entry.expires = time.monotonic() + get_ttl()
+        entry.last_seen = time.time()
+        if entry.due is None:
+            self.schedule(user_id, entry)
+        
+        if entry.status is None:
+            self.offline.pop(user_id, None)
+            entry.status = status or 'online'
+            self.changed.add(user_id)
+        elif status is not None and status != entry.status:
+            entry.status = status
+            self.changed.add(user_id)
+    
+    def go_offline(self, user_id, entry):
+        entry.status = None
+        self.offline[user_id] = None
+        self.changed.add(user_id)
+    
+    def evict(self):
+        """Forget the users offline the longest above PRESENCE_MAX_ENTRIES"""
+        max_entries = get_max_entries()
+        while len(self.users) >= max_entries and self.offline:
+            user_id = next(iter(self.offline))
+            del self.offline[user_id]
+            del self.users[user_id]
+            self.changed.discard(user_id)
+    
+    def get(self, user_ids):
+        """
+        {user id: state} for the users this process knows about; others are
+        left out. Safe to call from other threads.
+        """
+        states = {}
+        for user_id in user_ids:
+            entry = self.users.get(user_id)
+            if entry is not None:
+                states[user_id] = entry.state(user_id)
+        return states
+    
+    # ==================== Typing ====================
+    
+    def set_typing(self, room_id, user_id, active=True):
+        key = (room_id, user_id)
+        entry = self.typing.get(key)
+        if not active:
+            if entry is not None:
+                del self.typing[key]
+                self.stop_typing(room_id, user_id)
+            return
+        
+        now = time.monotonic()
+        typing_ttl = get_typing_ttl()
+        if entry is None:
+            entry = self.typing[key] = Typing()
+        entry.expires = now + typing_ttl
+        if entry.due is None:
+            self.schedule(key, entry)
+        
+        # Clients show a typer for CHAT_TYPING_TTL; remind them halfway
+        if now - entry.announced >= typing_ttl / 2:
+            entry.announced = now
+            self.typing_started.setdefault(room_id, set()).add(user_id)
+            stopped = self.typing_stopped.get(room_id)
+            if stopped:
+                stopped.discard(user_id)
+    
+    def stop_typing(self, room_id, user_id):
+        started = self.typing_started.get(room_id)
+        if started:
+            started.discard(user_id)
+        self.typing_stopped.setdefault(room_id, set()).add(user_id)
+    
+    # ==================== Expiry ====================
+    
+    def schedule(self, key, entry):
+        entry.due = int(entry.expires) + 1
+        self.wheel.setdefault(entry.due, set()).add(key)
+    
+    def sweep(self, now):
+        """Expire due entries, at most PRESENCE_SWEEP_BATCH of them"""
+        if not self.wheel:
+            self.cursor = int(now)
+            return
+        
+        budget = get_sweep_batch()
+        while self.cursor <= now and budget > 0:
+            bucket = self.wheel.get(self.cursor)
+            while bucket and budget > 0:
+                self.expire(bucket.pop(), self.cursor, now)
+                budget -= 1
+            if not bucket:
+                self.wheel.pop(self.cursor, None)
+                self.cursor += 1
+    
+    def expire(self, key, second, now):
+        if isinstance(key, tuple):
+            entry = self.typing.get(key)
+        else:
+            entry = self.users.get(key)
+        # Stale: dropped or already moved to another bucket
+        if entry is None or entry.due != second:
+            return
+        entry.due = None
+        
+        if entry.expires > now:
+            # Refreshed since it was scheduled
+            self.schedule(key, entry)
+            if not isinstance(key, tuple):
+                self.republish.add(key)
+        elif isinstance(key, tuple):
+            del self.typing[key]
+            self.stop_typing(*key)
+        elif entry.status is not None:
+            self.go_offline(key, entry)
+    
+    # ==================== Fan-out ====================
+    
+    def tick(self):
+        """
+        Sweep, then collect the changes since the last tick: a list of
+        (room id, group event) and {user id: state} to publish
+        """
+        self.sweep(time.monotonic())
+        events = []
+        
+        # Like the sweep, at most PRESENCE_SWEEP_BATCH users per tick
+        changed = set()
+        budget = get_sweep_batch()
+        while self.changed and len(changed) < budget:
+            changed.add(self.changed.pop())
+        updates = {}
+        published = {}
+        for user_id in changed:
+            entry = self.users.get(user_id)
+            if entry is None:
+                continue
+            state = published[user_id] = entry.state(user_id)
+            for room_id in entry.rooms:
+                updates.setdefault(room_id, []).append(state)
+            if entry.sockets <= 0:
+                entry.rooms = set()
+        for room_id, states in updates.items():
+            events.append((room_id, frames.encoded('presence.update', {
+                'type': 'presence',
+                'room_id': room_id,
+                'users': states,
+            })))
+        
+        started, self.typing_started = self.typing_started, {}
+        stopped, self.typing_stopped = self.typing_stopped, {}
+        for room_id in started.keys() | stopped.keys():
+            typing = sorted(started.get(room_id, ()))
+            not_typing = sorted(stopped.get(room_id, ()))
+            if typing or not_typing:
+                events.append((room_id, frames.encoded('typing.update', {
+                    'type': 'typing',
+                    'room_id': room_id,
+                    'typing': typing,
+                    'stopped': not_typing,
+                })))
+        
+        republish, self.republish = self.republish, set()
+        for user_id in republish - changed:
+            entry = self.users.get(user_id)
+            if entry is not None and entry.status is not None:
+                published[user_id] = entry.state(user_id)
+        return events, published
+    
+    def idle(self):
+        return not (self.sockets or self.typing or self.changed or self.typing_started or self.typing_stopped)
+    
+    def ensure_ticker(self):
+        """Start the ticker on the running event loop if it is not running"""
+        if not self.checked:
+            # Servers like daphne don't run the system checks
+            self.checked = True
+            problem = unshared_presence()
+            if problem:
+                logger.warning('%s: presence only knows the users connected to this process', problem)
+        if self.ticker is None or self.ticker.done():
+            self.ticker = asyncio.get_running_loop().create_task(self.run_ticker())
+    
+    async def run_ticker(self):
+        """Send the changes every PRESENCE_TICK until nobody is connected"""
+        channel_layer = get_channel_layer()
+        while True:
+            await asyncio.sleep(get_tick())
+            try:
+                events, published = self.tick()
+                for room_id, event in events:
+                    await channel_layer.group_send(f'chat_{room_id}', event)
+                if published and get_shared_cache() is not None:
+                    await sync_to_async(publish)(published)
+            except Exception:
+                logger.exception('Presence tick failed')
+            if self.idle():
+                self.ticker = None
+                return
+
+
+registry = PresenceRegistry()
+
+
+def publish(states):
+    """Copy presence states to the shared cache"""
+    shared = get_shared_cache()
+    online = {_shared_key(user_id): state for user_id, state in states.items() if state['status'] != 'offline'}
+    offline = {_shared_key(user_id): state for user_id, state in states.items() if state['status'] == 'offline'}
+    if online:
+        # Republished about once per PRESENCE_TTL while connected
+        shared.set_many(online, get_ttl() * 2)
+    if offline:
+        shared.set_many(offline, LAST_SEEN_TIMEOUT)
+
+
+def bulk(user_ids):
+    """
+    {user id: state} for all of user_ids. Users online in this process are
+    answered from the registry, the rest from the shared cache if there is
+    one; unknown users are offline with no last seen time.
+
+    Without PRESENCE_CACHE this only knows the sockets of the process it
+    runs in: with more than one worker (or REST served apart from the
+    WebSockets) users connected elsewhere show as offline.
+    """
+    states = registry.get(user_ids)
+    shared = get_shared_cache()
+    if shared is not None:
+        missing = [user_id for user_id in user_ids if states.get(user_id, {}).get('status', 'offline') == 'offline']
+        if missing:
+            found = shared.get_many([_shared_key(user_id) for user_id in missing])
+            for user_id in missing:
+                state = found.get(_shared_key(user_id))
+                if state is not None:
+                    states[user_id] = state
+    for user_id in user_ids:
+        if user_id not in states:
+            states[user_id] = offline_state(user_id)
+    return states
@@ -0,0 +1,327 @@
+"""
+Relevance ranking for provider search results.
+
+The search endpoint filters candidates in SQL and hands their ids (and
+distances) to ProviderRanker, which scores all of them in one vectorized
+NumPy pass with a weighted formula:
+
+    score = sum(weight[f] * feature[f])
+
+Every feature is normalized to [0, 1]:
+
+- available: 1 if the provider is available within 48h
+- rating: Bayesian average of the rating, so a single 5-star review does
+  not outrank a long track record
+- reviews: confidence in the rating, total_reviews / (total_reviews + prior)
+- machines: available machine count, log-scaled and saturated
+- distance: exp(-distance_km / scale), 0 when the search has no origin
+- recency: exp(-age / half life) of the provider's signup date
+
+The static part of the features is precomputed per provider in an
+in-process FeatureStore and refreshed incrementally from the rows of
+ProviderSearchIndex whose indexed_at moved, so ranking never re-reads
+the candidates from the database. Weights and constants come from the
+PROVIDER_RANKING setting; tuning relevance needs no new SQL.
+
+NumPy is in requirements.txt. Without it (or with ENABLED set to False)
+is_enabled() is False and the search endpoint keeps its SQL ordering; the
+api.W001 system check warns when ranking is enabled but NumPy is missing.
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import checks
+from django.utils import timezone
+
+from .models import ProviderSearchIndex
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+DEFAULTS = {
+    'WEIGHTS': {
+        'available': 3.0,
+        'rating': 2.0,
+        'reviews': 1.0,
+        'machines': 1.0,
+        'distance': 2.0,
+        'recency': 0.5,
+    },
+    # Reviews needed to trust a rating half-way, and the rating assumed
+    # before that (on a 0-5 scale)
+    'REVIEW_PRIOR': 10,
+    'PRIOR_RATING': 3.5,
+    # Available machines counting as a full catalogue
+    'MACHINES_SATURATION': 20,
+    # Distance at which the distance feature drops to 1/e
+    'DISTANCE_SCALE_KM': 25,
+    'RECENCY_HALF_LIFE_DAYS': 180,
+    # Minimum seconds between incremental refreshes of the feature store
+    'SYNC_INTERVAL': 1.0,
+    'ENABLED': True,
+}
+
+FEATURES = ['available', 'rating', 'reviews', 'machines', 'distance', 'recency']
+
+# Columns of the precomputed feature matrix
+STATIC_FEATURES = ['available', 'rating', 'reviews', 'machines', 'created']
+
+INDEX_COLUMNS = [
+    'provider_id', 'available_within_48h', 'rating', 'total_reviews',
+    'available_machines_count', 'created_at', 'indexed_at',
+]
+
+# Rows written shortly before the last refresh are read again, so a
+# transaction committing with an older indexed_at is not missed
+SYNC_OVERLAP = timedelta(seconds=5)
+
+RankedProvider = namedtuple('RankedProvider', ['pk', 'score', 'distance_km'])
+
+
+def is_enabled():
+    return np is not None and get_config()['ENABLED']
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PROVIDER_RANKING', {}))
+    config['WEIGHTS'] = dict(DEFAULTS['WEIGHTS'], **config.get('WEIGHTS', {}))
+    return config
+
+
+@checks.register()
+def check_numpy(app_configs=None, **kwargs):
+    """Ranking silently turns off without NumPy"""
+    if np is not None or not get_config()['ENABLED']:
+        return []
+    return [checks.Warning(
+        'PROVIDER_RANKING is enabled but NumPy is not installed; provider search results are not ranked.',
+        hint="Install the requirements (numpy) or set PROVIDER_RANKING['ENABLED'] to False.",
+        id='api.W001',
+    )]
+
+
+def static_features(rows, config):
+    """
+    Precompute the time-independent features for index rows given as tuples
+    of INDEX_COLUMNS. Returns a (len(rows), len(STATIC_FEATURES)) array.
+    """
+    matrix = np.zeros((len(rows), len(STATIC_FEATURES)), dtype=np.float64)
+    if not rows:
+        return matrix
+    _ids, available, rating, reviews, machines, created, _indexed = zip(*rows)
+
+    reviews = np.asarray(reviews, dtype=np.float64)
+    rating = np.asarray([float(value) for value in rating], dtype=np.float64)
+    prior = float(config['REVIEW_PRIOR'])
+
+    matrix[:, 0] = np.asarray(available, dtype=np.float64)
+    matrix[:, 1] = (rating * reviews + config['PRIOR_RATING'] * prior) / (reviews + prior) / 5
+    matrix[:, 2] = reviews / (reviews + prior) if prior else 1.0
+    saturation = math.log1p(config['MACHINES_SATURATION'])
+    matrix[:, 3] = np.minimum(np.log1p(np.asarray(machines, dtype=np.float64)) / saturation, 1.0)
+    matrix[:, 4] = [value.timestamp() for value in created]
+    return matrix
+
+
+class FeatureStore:
+    """
+    In-process matrix of precomputed provider features.
+
+    The first refresh loads every index row; later refreshes only read the
+    rows whose indexed_at moved since the previous one (indexed by
+    provider_search_indexed_idx). Rows of deleted providers may linger but
+    are never looked up, since candidates come from the live index.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.config = get_config()
+        self.positions = {}
+        self.matrix = np.zeros((0, len(STATIC_FEATURES)), dtype=np.float64) if np else None
+        self.watermark = None
+        self.synced_at = 0.0
+        self.stale = True
+
+    def mark_stale(self):
+        """Refresh on the next lookup (an index row changed in this process)"""
+        self.stale = True
+
+    def refresh(self, force=False):
+        """Load index rows changed since the last refresh"""
+        now = time.monotonic()
+        if not (force or self.stale or now - self.synced_at >= self.config['SYNC_INTERVAL']):
+            return 0
+
+        rows = ProviderSearchIndex.objects.all()
+        if self.watermark is not None:
+            rows = rows.filter(indexed_at__gte=self.watermark - SYNC_OVERLAP)
+        self.synced_at = now
+        self.stale = False
+        return self.load(rows)
+
+    def load(self, rows):
+        """Compute and store the features of an index queryset"""
+        rows = list(rows.order_by().values_list(*INDEX_COLUMNS))
+        if not rows:
+            return 0
+        features = static_features(rows, self.config)
+
+        with self.lock:
+            new = []
+            for offset, row in enumerate(rows):
+                position = self.positions.get(row[0])
+                if position is None:
+                    new.append(offset)
+                else:
+                    self.matrix[position] = features[offset]
+            if new:
+                start = len(self.matrix)
+                self.matrix = np.vstack([self.matrix, features[new]])
+                for position, offset in enumerate(new, start):
+                    self.positions[rows[offset][0]] = position
+            latest = max(row[-1] for row in rows)
+            if self.watermark is None or latest > self.watermark:
+                self.watermark = latest
+        return len(rows)
+
+    def lookup(self, provider_ids):
+        """
+        Feature rows for provider_ids, loading the ones not seen yet.
+        Returns (ids, matrix) for the providers found.
+        """
+        self.refresh()
+        missing = [pk for pk in provider_ids if pk not in self.positions]
+        if missing:
+            self.load(ProviderSearchIndex.objects.filter(provider_id__in=missing))
+        with self.lock:
+            found = [pk for pk in provider_ids if pk in self.positions]
+            positions = np.fromiter(
+                (self.positions[pk] for pk in found), dtype=np.int64, count=len(found)
+            )
+            return found, self.matrix[positions]
+
+
+class Ranking:
+    """
+    Candidates sorted by descending score (ties by descending pk).
+
+    Supports len() and slicing, yielding RankedProvider tuples, so it can be
+    paginated like a list (see KeysetPagination.paginate_ranking).
+    """
+
+    def __init__(self, ids, scores, distances=None):
+        self.ids = ids
+        self.scores = scores
+        self.distances = distances
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(position) for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return self._item(index)
+
+    def _item(self, position):
+        distance = None
+        if self.distances is not None:
+            distance = float(self.distances[position])
+        return RankedProvider(int(self.ids[position]), float(self.scores[position]), distance)
+
+    def start_after(self, score, pk):
+        """Position of the first candidate ranked after (score, pk)"""
+        after = (self.scores < score) | ((self.scores == score) & (self.ids < pk))
+        positions = np.flatnonzero(after)
+        return int(positions[0]) if len(positions) else len(self)
+
+    def end_before(self, score, pk):
+        """Position just past the last candidate ranked before (score, pk)"""
+        before = (self.scores > score) | ((self.scores == score) & (self.ids > pk))
+        positions = np.flatnonzero(before)
+        return int(positions[-1]) + 1 if len(positions) else 0
+
+
+class ProviderRanker:
+    """Scores provider search candidates with the configured weights"""
+
+    def __init__(self, store=None):
+        self.store = store or FeatureStore()
+
+    def score(self, matrix, distances=None, now=None):
+        config = self.store.config
+        weights = config['WEIGHTS']
+        # Hour resolution keeps scores (and therefore cursors) stable
+        # between the page requests of one search
+        now = (now or timezone.now()).timestamp()
+        now -= now % 3600
+
+        # Column by column rather than a matrix product, so a provider's
+        # score does not depend on the size of the candidate set
+        scores = np.zeros(len(matrix), dtype=np.float64)
+        for column, feature in enumerate(STATIC_FEATURES[:4]):
+            scores += weights[feature] * matrix[:, column]
+        age_days = np.maximum(now - matrix[:, 4], 0) / 86400
+        half_life = config['RECENCY_HALF_LIFE_DAYS']
+        scores += weights['recency'] * np.exp2(-age_days / half_life)
+        if distances is not None:
+            scores += weights['distance'] * np.exp(-distances / config['DISTANCE_SCALE_KM'])
+        return scores
+
+    def rank(self, queryset, with_distance=False):
+        """
+        Rank the rows of a filtered ProviderSearchIndex queryset.
+
+        Only the candidate ids (and distance_km when annotated) are read
+        from the database.
+        """
+        if with_distance:
+            rows = list(queryset.order_by().values_list('provider_id', 'distance_km'))
+            distance_by_id = dict(rows)
+            provider_ids = list(distance_by_id)
+        else:
+            provider_ids = list(queryset.order_by().values_list('provider_id', flat=True))
+
+        found, matrix = self.store.lookup(provider_ids)
+        ids = np.asarray(found, dtype=np.int64)
+        distances = None
+        if with_distance:
+            distances = np.fromiter(
+                (distance_by_id[pk] for pk in found), dtype=np.float64, count=len(found)
+            )
+
+        scores = self.score(matrix, distances)
+        # Descending score, then descending id
+        order = np.lexsort((-ids, -scores))
+        return Ranking(
+            ids[order],
+            scores[order],
+            distances[order] if distances is not None else None
+        )
+
+
+_ranker = None
+_ranker_lock = threading.Lock()
+
+
+def get_ranker():
+    """Process-wide ranker sharing one feature store"""
+    global _ranker
+    if _ranker is None:
+        with _ranker_lock:
+            if _ranker is None:
+                _ranker = ProviderRanker()
+    return _ranker
@@ -0,0 +1,144 @@
+"""
+Read receipts as per-(room, user) watermarks.
+
+Instead of a flag on every message, each participant has one ReadState row
+per room: "read up to message id N". Marking a message read is a single
+conditional UPDATE that only ever moves the watermark forward, so receipts
+arriving out of order or twice are no-ops. A message counts as read by its
+recipients when another participant's watermark has reached it, and unread
+counts are the messages from others above the user's own watermark.
+
+Comparing bare ids is only sound because message ids follow the order
+messages are sent in, whichever path writes them (message_writer.py takes
+each id from the sequence at send time): a message sent after the
+watermark moved always has a higher id.
+
+WebSocket receipts are debounced per connection (CHAT_READ_RECEIPT_DELAY
+seconds): scrolling through a conversation sends many receipts but causes
+one write and one broadcast.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import frames
+from .models import Message, ReadState
+
+
+def get_receipt_delay():
+    return getattr(settings, 'CHAT_READ_RECEIPT_DELAY', 0.5)
+
+
+def advance(room_id, user_id, message_id, verify=True):
+    """
+    Move the user's watermark in the room forward to message_id.
+
+    Returns the new watermark, or None if it did not move. With verify,
+    message_id is first lowered to the latest message of the room at or
+    below it, so unknown ids cannot push the watermark past real messages;
+    callers that know the message exists (e.g. they loaded it) skip that.
+    """
+    if verify:
+        message_id = Message.objects.filter(
+            room_id=room_id,
+            pk__lte=message_id
+        ).aggregate(latest=Max('pk'))['latest']
+        if message_id is None:
+            return None
+
+    updated = ReadState.objects.filter(
+        room_id=room_id,
+        user_id=user_id,
+        last_read_message_id__lt=message_id
+    ).update(last_read_message_id=message_id, updated_at=timezone.now())
+    if updated:
+        return message_id
+
+    # Either the watermark is already there or there is no row yet
+    if ReadState.objects.filter(room_id=room_id, user_id=user_id).exists():
+        return None
+    try:
+        with transaction.atomic():
+            ReadState.objects.create(room_id=room_id, user_id=user_id, last_read_message_id=message_id)
+        return message_id
+    except IntegrityError:
+        # Created concurrently; move it forward if it is behind
+        return advance(room_id, user_id, message_id, verify=False)
+
+
+def receipt_event(room_id, reader_id, message_id):
+    """Group event telling a room that reader_id has read up to message_id"""
+    return frames.encoded('read_receipt', {
+        'type': 'read_receipt',
+        'room_id': room_id,
+        'message_id': message_id,
+        'reader_id': reader_id,
+    }, room_id=room_id)
+
+
+def broadcast(room_id, reader_id, message_id):
+    """Send a read receipt to the room's sockets from synchronous code"""
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(
+            f'chat_{room_id}',
+            receipt_event(room_id, reader_id, message_id)
+        )
+
+
+def mark_room_read(room_id, user_id):
+    """
+    Move the user's watermark to the room's latest message and tell the
+    room. Returns the number of messages from others that were unread.
+    """
+    unread = unread_counts(user_id, [room_id]).get(room_id, 0)
+    latest = Message.objects.filter(room_id=room_id).aggregate(latest=Max('pk'))['latest']
+    if latest is not None and advance(room_id, user_id, latest, verify=False) is not None:
+        broadcast(room_id, user_id, latest)
+    return unread
+
+
+def watermarks(room_ids):
+    """
+    {room id: {user id: last read message id}} in one query, with an entry
+    for every room asked for, so callers can tell "nobody read" from "not loaded"
+    """
+    states = {room_id: {} for room_id in room_ids}
+    for room_id, user_id, last_read in ReadState.objects.filter(room_id__in=room_ids).values_list(
+        'room_id', 'user_id', 'last_read_message_id'
+    ):
+        states[room_id][user_id] = last_read
+    return states
+
+
+def is_read(message, room_watermarks):
+    """Whether anyone but the author has read the message"""
+    return any(
+        last_read >= message.id
+        for user_id, last_read in room_watermarks.items()
+        if user_id != message.author_id
+    )
+
+
+def unread_counts(user_id, room_ids):
+    """{room id: messages from others above the user's watermark} in one query"""
+    watermark = ReadState.objects.filter(
+        room_id=OuterRef('room_id'),
+        user_id=user_id
+    ).values('last_read_message_id')[:1]
+    return dict(
+        Message.objects.filter(
+            room_id__in=room_ids
+        ).exclude(
+            author_id=user_id
+        ).alias(
+            watermark=Coalesce(Subquery(watermark), Value(0), output_field=IntegerField())
+        ).filter(
+            pk__gt=F('watermark')
+        ).order_by().values_list('room_id').annotate(Count('id'))
+    )
@@ -7,6 +7,7 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
+    re_path(r'ws/chat/$', consumers.UserChatConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<room_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
 ]
 
@@ -0,0 +1,159 @@
+"""
+Versioned result cache for provider search.
+
+Cached responses are keyed on the normalized ProviderSearchSerializer
+parameters, the pagination parameters and a namespace version. A change to
+a provider's search index row bumps the version of the global namespace and
+of each machine category the provider offers (before or after the change),
+so stale entries simply stop being addressed and are never scanned for.
+Queries filtered by category only depend on their category's version, so a
+change to a crane provider leaves cached excavator searches untouched.
+
+Hit/miss counters are kept in the same cache (see stats()) to help tune
+PROVIDER_SEARCH_CACHE_TTL.
+"""
+
+import decimal
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .search_index import CATEGORY_BITS
+
+KEY_PREFIX = 'provider-search'
+GLOBAL_NAMESPACE = 'all'
+
+
+def get_cache():
+    return caches[getattr(settings, 'PROVIDER_SEARCH_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'PROVIDER_SEARCH_CACHE_TTL', 300)
+
+
+def _version_key(namespace):
+    return f'{KEY_PREFIX}:version:{namespace}'
+
+
+def _new_version():
+    # Time based so a version evicted from the cache never comes back
+    # with a value that old entries were stored under
+    return time.time_ns()
+
+
+def namespace_for(params):
+    """Version namespace a search depends on"""
+    category = params.get('category')
+    if category in CATEGORY_BITS:
+        return f'category:{category}'
+    return GLOBAL_NAMESPACE
+
+
+def get_version(namespace):
+    cache = get_cache()
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump(namespaces):
+    """Invalidate every entry stored under the given namespaces"""
+    cache = get_cache()
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def invalidate(category_mask=None):
+    """
+    Invalidate searches affected by a change to providers offering the
+    categories in category_mask (all categories if None).
+    """
+    namespaces = [GLOBAL_NAMESPACE]
+    for category, bit in CATEGORY_BITS.items():
+        if category_mask is None or category_mask & bit:
+            namespaces.append(f'category:{category}')
+    bump(namespaces)
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, decimal.Decimal):
+        return str(value.normalize())
+    return value
+
+
+def make_key(request, params, origin=None, kind='results', namespace=None):
+    """
+    Cache key for a search request.
+
+    Includes the validated parameters, the resolved origin (which may come
+    from the user's profile), the pagination query parameters and the host
+    (pagination links are absolute URLs). kind separates the responses of
+    different endpoints sharing the same parameters; namespace overrides
+    the one derived from the parameters.
+    """
+    namespace = namespace or namespace_for(params)
+    payload = {
+        'kind': kind,
+        'params': sorted((name, _normalize(value)) for name, value in params.items()),
+        'origin': origin,
+        'page': sorted(
+            (name, request.query_params.get(name))
+            for name in ('cursor', 'page', 'page_size')
+            if name in request.query_params
+        ),
+        'host': request.get_host(),
+    }
+    digest = hashlib.sha1(
+        json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    return f'{KEY_PREFIX}:{namespace}:{get_version(namespace)}:{digest}'
+
+
+def get_response(key):
+    """Return the cached response data or None, recording a hit or miss"""
+    cache = get_cache()
+    data = cache.get(key)
+    _count('hits' if data is not None else 'misses')
+    return data
+
+
+def store_response(key, data):
+    get_cache().set(key, data, get_timeout())
+
+
+def _count(name):
+    cache = get_cache()
+    key = f'{KEY_PREFIX}:stats:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def stats():
+    """Hit/miss counters and hit ratio since the counters were created"""
+    cache = get_cache()
+    hits = cache.get(f'{KEY_PREFIX}:stats:hits', 0)
+    misses = cache.get(f'{KEY_PREFIX}:stats:misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+        'ttl': get_timeout(),
+    }
@@ -0,0 +1,195 @@
+"""
+Maintenance of the denormalized provider search index.
+
+ProviderSearchIndex keeps one row per provider so that the search endpoint
+can filter and order on a single table. The helpers in this module build and
+refresh those rows; they are called from the signal handlers in signals.py
+and from the ``rebuild_search_index`` management command.
+"""
+
+from django.db.models import Count, Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .geo import cell_for
+from .models import ProviderProfile, Machine, ProviderSearchIndex
+
+
+# Bit assigned to each machine category in ProviderSearchIndex.category_mask.
+# New categories must be appended to Machine.CATEGORY_CHOICES so existing
+# bits keep their meaning (otherwise rebuild the index).
+CATEGORY_BITS = {
+    value: 1 << position
+    for position, (value, _label) in enumerate(Machine.CATEGORY_CHOICES)
+}
+
+# Sent whenever an index row changes, with snapshots of TRACKED_FIELDS
+# before and after the change (None for created/deleted rows).
+# provider_id is None after a full rebuild.
+provider_index_changed = Signal()
+
+# Index columns reported in provider_index_changed snapshots
+TRACKED_FIELDS = [
+    'category_mask', 'subscription_status', 'is_verified',
+    'available_within_48h', 'region', 'city',
+]
+
+# ProviderProfile fields copied verbatim into the index row
+PROFILE_FIELDS = [
+    'company_name', 'description', 'logo', 'city', 'region', 'country',
+    'latitude', 'longitude', 'subscription_status', 'is_verified', 'available_within_48h',
+    'rating', 'total_reviews', 'created_at',
+]
+
+
+def category_bit(category):
+    """Return the mask bit for a machine category, or None if unknown"""
+    return CATEGORY_BITS.get(category)
+
+
+def machine_stats(provider_ids=None):
+    """
+    Compute machine aggregates per provider in one grouped query.
+
+    Returns {provider_id: {'category_mask', 'machines_count',
+    'available_machines_count'}} for providers that own machines.
+    """
+    queryset = Machine.objects.all()
+    if provider_ids is not None:
+        queryset = queryset.filter(provider_id__in=provider_ids)
+
+    rows = queryset.order_by().values('provider_id', 'category').annotate(
+        total=Count('id'),
+        available=Count('id', filter=Q(is_available=True))
+    )
+
+    stats = {}
+    for row in rows:
+        entry = stats.setdefault(row['provider_id'], {
+            'category_mask': 0,
+            'machines_count': 0,
+            'available_machines_count': 0,
+        })
+        entry['category_mask'] |= CATEGORY_BITS.get(row['category'], 0)
+        entry['machines_count'] += row['total']
+        entry['available_machines_count'] += row['available']
+    return stats
+
+
+def _empty_stats():
+    return {'category_mask': 0, 'machines_count': 0, 'available_machines_count': 0}
+
+
+def profile_values(provider, fields=None):
+    """
+    Index column values taken from a provider profile.
+
+    With fields, only those profile fields (and the columns derived from
+    them) are returned; used for partial saves.
+    """
+    if fields is None:
+        fields = PROFILE_FIELDS + ['user']
+    values = {field: getattr(provider, field) for field in fields if field in PROFILE_FIELDS}
+    if 'user' in fields:
+        values['user_email'] = provider.user.email
+    if 'latitude' in values or 'longitude' in values:
+        values['geo_cell'] = cell_for(provider.latitude, provider.longitude)
+    return values
+
+
+def index_provider(provider):
+    """
+    Create or update the index row for a provider profile.
+
+    Profile columns are always refreshed. Machine aggregates are only
+    computed when the row is first created; afterwards they are maintained
+    by refresh_machine_stats whenever a machine changes.
+    """
+    values = profile_values(provider)
+    if update_provider_fields(provider.pk, **values):
+        return
+    values.update(machine_stats([provider.pk]).get(provider.pk, _empty_stats()))
+    ProviderSearchIndex.objects.update_or_create(provider_id=provider.pk, defaults=values)
+    provider_index_changed.send(
+        sender=ProviderSearchIndex,
+        provider_id=provider.pk,
+        before=None,
+        after={field: values[field] for field in TRACKED_FIELDS}
+    )
+
+
+def update_provider_fields(provider_id, **values):
+    """
+    Write the columns whose value differs to an existing index row.
+
+    Returns False if the provider has no index row yet. Unchanged rows are
+    not written and do not send provider_index_changed.
+    """
+    columns = list(dict.fromkeys(TRACKED_FIELDS + list(values)))
+    current = ProviderSearchIndex.objects.filter(pk=provider_id).values(*columns).first()
+    if current is None:
+        return False
+
+    changed = {field: value for field, value in values.items() if current[field] != value}
+    if changed:
+        ProviderSearchIndex.objects.filter(pk=provider_id).update(
+            indexed_at=timezone.now(),
+            **changed
+        )
+        before = {field: current[field] for field in TRACKED_FIELDS}
+        after = dict(before, **{
+            field: value for field, value in changed.items() if field in TRACKED_FIELDS
+        })
+        provider_index_changed.send(
+            sender=ProviderSearchIndex,
+            provider_id=provider_id,
+            before=before,
+            after=after
+        )
+    return True
+
+
+def snapshot(provider_id):
+    """TRACKED_FIELDS of a provider's index row, or None if it has none"""
+    return ProviderSearchIndex.objects.filter(pk=provider_id).values(*TRACKED_FIELDS).first()
+
+
+def refresh_machine_stats(provider_id):
+    """Recompute category membership and machine counts for one provider"""
+    stats = machine_stats([provider_id]).get(provider_id, _empty_stats())
+    return update_provider_fields(provider_id, **stats)
+
+
+def rebuild_index(batch_size=500):
+    """
+    Rebuild the whole search index from ProviderProfile and Machine.
+
+    Runs one grouped query over machines per batch of providers and writes
+    the rows with bulk_create. Returns the number of indexed providers.
+    """
+    ProviderSearchIndex.objects.all().delete()
+
+    providers = ProviderProfile.objects.select_related('user').order_by('pk')
+    total = 0
+    last_pk = None
+    while True:
+        batch_qs = providers
+        if last_pk is not None:
+            batch_qs = batch_qs.filter(pk__gt=last_pk)
+        batch = list(batch_qs[:batch_size])
+        if not batch:
+            break
+
+        stats = machine_stats([provider.pk for provider in batch])
+        rows = []
+        for provider in batch:
+            values = profile_values(provider)
+            values.update(stats.get(provider.pk, _empty_stats()))
+            rows.append(ProviderSearchIndex(provider_id=provider.pk, **values))
+        ProviderSearchIndex.objects.bulk_create(rows)
+
+        total += len(batch)
+        last_pk = batch[-1].pk
+
+    provider_index_changed.send(sender=ProviderSearchIndex, provider_id=None, before=None, after=None)
+    return total
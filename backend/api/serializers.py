@@ -11,8 +11,10 @@ from .models import (
     Machine,
     MachineImage,
     ChatRoom,
-    Message
+    Message,
+    ProviderSearchIndex
 )
+from . import autocomplete, history, memberships, message_search, presence, read_receipts
 
 User = get_user_model()
 
@@ -103,7 +105,8 @@ class ConstructorProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = ConstructorProfile
         fields = ['user', 'user_id', 'company_name', 'phone', 'address',
-                  'city', 'region', 'country', 'created_at', 'updated_at']
+                  'city', 'region', 'country', 'latitude', 'longitude',
+                  'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
     
     def create(self, validated_data):
@@ -128,13 +131,34 @@ class ProviderProfileListSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProviderProfile
         fields = ['user', 'user_email', 'company_name', 'description', 'logo',
-                  'city', 'region', 'country', 'available_within_48h',
-                  'is_verified', 'rating', 'total_reviews', 'machines_count',
-                  'created_at']
+                  'city', 'region', 'country', 'latitude', 'longitude',
+                  'available_within_48h', 'is_verified', 'rating', 'total_reviews',
+                  'machines_count', 'created_at']
         read_only_fields = ['user', 'user_email', 'rating', 'total_reviews', 
                            'is_verified', 'created_at']
 
 
+class ProviderSearchResultSerializer(serializers.ModelSerializer):
+    """
+    Serializer for provider search results read from ProviderSearchIndex.
+    Produces the same shape as ProviderProfileListSerializer (plus distance_km
+    for location searches) without touching ProviderProfile, User or Machine.
+    """
+    user = serializers.IntegerField(source='provider_id', read_only=True)
+    # Only present when the search is anchored to a location
+    distance_km = serializers.FloatField(read_only=True)
+    # Only present when results are ordered by the ranking engine
+    score = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = ProviderSearchIndex
+        fields = ['user', 'user_email', 'company_name', 'description', 'logo',
+                  'city', 'region', 'country', 'latitude', 'longitude',
+                  'available_within_48h', 'is_verified', 'rating', 'total_reviews',
+                  'machines_count', 'distance_km', 'score', 'created_at']
+        read_only_fields = fields
+
+
 class ProviderProfileSerializer(serializers.ModelSerializer):
     """Full serializer for Provider profiles"""
     user = UserSerializer(read_only=True)
@@ -146,7 +170,7 @@ class ProviderProfileSerializer(serializers.ModelSerializer):
         model = ProviderProfile
         fields = ['user', 'user_id', 'company_name', 'description', 'logo',
                   'phone', 'website', 'address', 'city', 'region', 'country',
-                  'subscription_status', 'subscription_start_date', 'subscription_end_date',
+                  'latitude', 'longitude', 'subscription_status', 'subscription_start_date', 'subscription_end_date',
                   'available_within_48h', 'is_verified', 'rating', 'total_reviews',
                   'machines', 'is_subscription_active', 'created_at', 'updated_at']
         read_only_fields = ['user', 'rating', 'total_reviews', 'is_verified',
@@ -195,6 +219,16 @@ class MachineListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'provider', 'provider_name', 'created_at']
 
 
+class MachineSearchResultSerializer(MachineListSerializer):
+    """Machine search results: list fields plus year and provider distance"""
+    # Only present when the search is anchored to a location
+    distance_km = serializers.FloatField(read_only=True)
+    
+    class Meta(MachineListSerializer.Meta):
+        fields = MachineListSerializer.Meta.fields + ['year', 'distance_km']
+        read_only_fields = fields
+
+
 class MachineDetailSerializer(serializers.ModelSerializer):
     """Full serializer for machine details"""
     provider = ProviderProfileListSerializer(read_only=True)
@@ -230,16 +264,34 @@ class MachineDetailSerializer(serializers.ModelSerializer):
 
 # ==================== CHAT SERIALIZERS ====================
 
+def get_room_watermarks(context, room_id):
+    """
+    Read watermarks of a room, loaded once per room and request and kept in
+    the serializer context (ChatRoomViewSet.list preloads a whole page)
+    """
+    loaded = context.setdefault('read_watermarks', {})
+    if room_id not in loaded:
+        loaded[room_id] = read_receipts.watermarks([room_id]).get(room_id, {})
+    return loaded[room_id]
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    """Serializer for chat messages"""
+    """
+    Serializer for chat messages.
+    read is true once another participant's read watermark reaches the message.
+    """
     author = UserSerializer(read_only=True)
     author_id = serializers.IntegerField(write_only=True, required=False)
+    read = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ['id', 'room', 'author', 'author_id', 'content', 'timestamp', 'read']
         read_only_fields = ['id', 'timestamp']
     
+    def get_read(self, obj):
+        return read_receipts.is_read(obj, get_room_watermarks(self.context, obj.room_id))
+    
     def create(self, validated_data):
         # Get author from context if not provided
         if 'author_id' not in validated_data:
@@ -251,8 +303,47 @@ class MessageSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class RoomMessageSerializer(serializers.ModelSerializer):
+    """
+    Message in a room history window. The author is sent once per window in
+    its authors table instead of nested in every message.
+    """
+    read = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'room', 'author_id', 'content', 'timestamp', 'read']
+        read_only_fields = fields
+    
+    def get_read(self, obj):
+        return read_receipts.is_read(obj, get_room_watermarks(self.context, obj.room_id))
+
+
+def serialize_message_window(room_id, context, before_id=None, limit=None):
+    """
+    {"messages", "authors", "messages_cursor"} for a window of a room's
+    history; messages_cursor is the before id of the next older window, or
+    None when there is none
+    """
+    messages, has_more = history.load_window(room_id, before_id, limit)
+    authors = {}
+    for message in messages:
+        authors.setdefault(message.author_id, message.author)
+    return {
+        'messages': RoomMessageSerializer(messages, many=True, context=context).data,
+        'authors': {
+            str(author_id): UserSerializer(author, context=context).data
+            for author_id, author in authors.items()
+        },
+        'messages_cursor': messages[0].id if has_more else None,
+    }
+
+
 class ChatRoomListSerializer(serializers.ModelSerializer):
-    """Lightweight serializer for listing chat rooms"""
+    """
+    Lightweight serializer for listing chat rooms.
+    Uses the last_messages/unread_counts maps from the context if present.
+    """
     participants = UserSerializer(many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
@@ -264,38 +355,51 @@ class ChatRoomListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_last_message(self, obj):
-        last_msg = obj.last_message
+        # Bulk-loaded by ChatRoomViewSet.list when available
+        if 'last_messages' in self.context:
+            last_msg = self.context['last_messages'].get(getattr(obj, 'latest_message_id', None))
+        else:
+            last_msg = obj.last_message
         if last_msg:
             return {
                 'id': last_msg.id,
                 'content': last_msg.content,
-                'author_id': last_msg.author.id,
+                'author_id': last_msg.author_id,
                 'timestamp': last_msg.timestamp,
-                'read': last_msg.read
+                'read': read_receipts.is_read(last_msg, get_room_watermarks(self.context, obj.id))
             }
         return None
     
     def get_unread_count(self, obj):
+        if 'unread_counts' in self.context:
+            return self.context['unread_counts'].get(obj.id, 0)
         user = self.context['request'].user
-        return obj.messages.filter(read=False).exclude(author=user).count()
+        return read_receipts.unread_counts(user.id, [obj.id]).get(obj.id, 0)
 
 
 class ChatRoomDetailSerializer(serializers.ModelSerializer):
-    """Full serializer for chat room with messages"""
+    """
+    Full serializer for chat room with its latest messages
+    (CHAT_ROOM_MESSAGES_WINDOW of them, see serialize_message_window)
+    """
     participants = UserSerializer(many=True, read_only=True)
     participant_ids = serializers.ListField(
         child=serializers.IntegerField(),
         write_only=True,
         required=False
     )
-    messages = MessageSerializer(many=True, read_only=True)
     
     class Meta:
         model = ChatRoom
-        fields = ['id', 'participants', 'participant_ids', 'messages', 
+        fields = ['id', 'participants', 'participant_ids', 
                   'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
     
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data.update(serialize_message_window(instance.id, self.context))
+        return data
+    
     def create(self, validated_data):
         participant_ids = validated_data.pop('participant_ids', [])
         
@@ -304,6 +408,12 @@ class ChatRoomDetailSerializer(serializers.ModelSerializer):
         if current_user_id not in participant_ids:
             participant_ids.append(current_user_id)
         
+        # Two users: their direct room, existing or new
+        distinct_ids = set(participant_ids)
+        if len(distinct_ids) == 2 and User.objects.filter(id__in=distinct_ids).count() == 2:
+            chat_room, _ = memberships.get_or_create_direct_room(*distinct_ids)
+            return chat_room
+        
         # Create chat room
         chat_room = ChatRoom.objects.create()
         
@@ -335,4 +445,168 @@ class ProviderSearchSerializer(serializers.Serializer):
         default=False,
         help_text="Show only verified providers"
     )
+    lat = serializers.FloatField(
+        required=False,
+        min_value=-90,
+        max_value=90,
+        help_text="Search origin latitude (defaults to the constructor's profile)"
+    )
+    lng = serializers.FloatField(
+        required=False,
+        min_value=-180,
+        max_value=180,
+        help_text="Search origin longitude (defaults to the constructor's profile)"
+    )
+    radius_km = serializers.FloatField(
+        required=False,
+        min_value=0.1,
+        max_value=500,
+        help_text="Only providers within this distance of the origin"
+    )
+    order_by_distance = serializers.BooleanField(
+        default=False,
+        help_text="Order by distance to the origin (nearest first)"
+    )
+    
+    def validate(self, attrs):
+        if ('lat' in attrs) != ('lng' in attrs):
+            raise serializers.ValidationError("Se requieren lat y lng juntos.")
+        return attrs
+
+
+class MachineSearchSerializer(serializers.Serializer):
+    """Serializer for machine search parameters"""
+    ORDERING_CHOICES = [
+        '-created_at', 'price_per_hour', '-price_per_hour',
+        'price_per_day', '-price_per_day', 'year', '-year', 'distance',
+    ]
+    
+    category = serializers.ChoiceField(
+        choices=Machine.CATEGORY_CHOICES,
+        required=False,
+        help_text="Machine category"
+    )
+    brand = serializers.CharField(required=False, help_text="Brand (case-insensitive)")
+    model = serializers.CharField(required=False, help_text="Model (case-insensitive)")
+    min_price_per_hour = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    max_price_per_hour = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    min_price_per_day = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    max_price_per_day = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    min_year = serializers.IntegerField(required=False, min_value=1900)
+    max_year = serializers.IntegerField(required=False, min_value=1900)
+    available_only = serializers.BooleanField(
+        default=True,
+        help_text="Only machines currently available"
+    )
+    
+    # Provider location
+    city = serializers.CharField(required=False, help_text="Provider city")
+    region = serializers.CharField(required=False, help_text="Provider region")
+    lat = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    lng = serializers.FloatField(required=False, min_value=-180, max_value=180)
+    radius_km = serializers.FloatField(
+        required=False,
+        min_value=0.1,
+        max_value=500,
+        help_text="Only machines whose provider is within this distance"
+    )
+    
+    ordering = serializers.ChoiceField(
+        choices=ORDERING_CHOICES,
+        default='-created_at',
+        help_text="Result ordering ('distance' requires a location)"
+    )
+    
+    def validate(self, attrs):
+        if ('lat' in attrs) != ('lng' in attrs):
+            raise serializers.ValidationError("Se requieren lat y lng juntos.")
+        for field in ('price_per_hour', 'price_per_day', 'year'):
+            low, high = attrs.get(f'min_{field}'), attrs.get(f'max_{field}')
+            if low is not None and high is not None and low > high:
+                raise serializers.ValidationError(
+                    {f'min_{field}': "El mínimo no puede ser mayor que el máximo."}
+                )
+        return attrs
+
+
+class AutocompleteSerializer(serializers.Serializer):
+    """Serializer for autocomplete parameters"""
+    q = serializers.CharField(max_length=100, trim_whitespace=True, help_text="Text typed so far")
+    kinds = serializers.MultipleChoiceField(
+        choices=autocomplete.KINDS,
+        required=False,
+        help_text="Suggestion kinds to include (default: all)"
+    )
+    limit = serializers.IntegerField(
+        default=autocomplete.DEFAULT_LIMIT,
+        min_value=1,
+        max_value=autocomplete.MAX_LIMIT
+    )
 
+
+class MessageWindowSerializer(serializers.Serializer):
+    """Serializer for room history window parameters"""
+    before = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        help_text="messages_cursor of the previous window"
+    )
+    limit = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=history.MAX_WINDOW,
+        help_text="Messages per window (default CHAT_ROOM_MESSAGES_WINDOW)"
+    )
+
+
+class MessageSearchSerializer(serializers.Serializer):
+    """Serializer for chat message search parameters"""
+    q = serializers.CharField(max_length=200, trim_whitespace=True, help_text="Words to find")
+    room = serializers.IntegerField(required=False, min_value=1, help_text="Only this chat room")
+    before = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        help_text="next_before of the previous page"
+    )
+    limit = serializers.IntegerField(
+        default=message_search.DEFAULT_RESULTS,
+        min_value=1,
+        max_value=message_search.MAX_RESULTS
+    )
+    
+    def validate_q(self, value):
+        if not message_search.query_terms(value):
+            raise serializers.ValidationError("La búsqueda debe contener al menos una palabra.")
+        return value
+
+
+class MessageSearchResultSerializer(serializers.ModelSerializer):
+    """
+    Message found by the chat search, with a highlighted snippet instead of
+    its content. The terms searched for come from the context.
+    """
+    snippet = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'room', 'author_id', 'snippet', 'timestamp']
+        read_only_fields = fields
+    
+    def get_snippet(self, obj):
+        return message_search.snippet(obj.content, self.context['terms'])
+
+
+class PresenceSerializer(serializers.Serializer):
+    """Serializer for bulk presence parameters"""
+    users = serializers.CharField(help_text="Comma-separated user ids")
+    
+    def validate_users(self, value):
+        try:
+            user_ids = list(dict.fromkeys(int(user_id) for user_id in value.split(',') if user_id.strip()))
+        except ValueError:
+            raise serializers.ValidationError("Los ids de usuario deben ser números.")
+        if not user_ids:
+            raise serializers.ValidationError("Se requiere al menos un usuario.")
+        if len(user_ids) > presence.MAX_BULK:
+            raise serializers.ValidationError(f"Como máximo {presence.MAX_BULK} usuarios por consulta.")
+        return user_ids
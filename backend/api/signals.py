@@ -0,0 +1,249 @@
+"""
+Signal handlers that keep denormalized data in sync with the source models.
+"""
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import ProviderProfile, Machine, ProviderSearchIndex, ChatRoom, Message, MessageArchiveSegment
+from . import search_index, search_cache, facets, ranking, autocomplete, memberships, message_search, archive
+from .middleware import user_cache
+from .text_search import get_search_backend, PROVIDER_FIELD_WEIGHTS, MACHINE_FIELD_WEIGHTS
+
+User = get_user_model()
+
+
+# ==================== PROVIDER SEARCH INDEX ====================
+
+@receiver(post_save, sender=ProviderProfile)
+def index_provider_profile(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Refresh the search row when a provider profile is saved"""
+    if raw:
+        return
+    if update_fields:
+        # Partial saves (e.g. toggle_availability) only rewrite what changed
+        values = search_index.profile_values(instance, update_fields)
+        if not values or search_index.update_provider_fields(instance.pk, **values):
+            return
+    search_index.index_provider(instance)
+
+
+@receiver(pre_save, sender=Machine)
+def remember_machine_provider(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note the owner of a machine before it is saved, in case it moves"""
+    if raw or instance._state.adding or (update_fields and not {'provider', 'provider_id'} & set(update_fields)):
+        return
+    instance._previous_provider_id = Machine.objects.filter(pk=instance.pk).values_list(
+        'provider_id', flat=True
+    ).first()
+
+
+@receiver(post_save, sender=Machine)
+@receiver(post_delete, sender=Machine)
+def index_machine_change(sender, instance, raw=False, **kwargs):
+    """Refresh category membership and machine counts of the owner (and of the previous one)"""
+    if raw:
+        return
+    search_index.refresh_machine_stats(instance.provider_id)
+    previous = instance.__dict__.pop('_previous_provider_id', None)
+    if previous is not None and previous != instance.provider_id:
+        search_index.refresh_machine_stats(previous)
+
+
+@receiver(post_save, sender=User)
+def index_user_email(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the denormalized provider email in sync"""
+    if raw or (update_fields and 'email' not in update_fields):
+        return
+    search_index.update_provider_fields(instance.pk, user_email=instance.email)
+
+
+@receiver(pre_delete, sender=ProviderProfile)
+def snapshot_provider_index(sender, instance, **kwargs):
+    # Remember the index row; it goes away through the cascade
+    instance._search_index_snapshot = search_index.snapshot(instance.pk)
+
+
+@receiver(post_delete, sender=ProviderProfile)
+def unindex_provider_profile(sender, instance, **kwargs):
+    before = getattr(instance, '_search_index_snapshot', None)
+    if before is not None:
+        search_index.provider_index_changed.send(
+            sender=ProviderSearchIndex,
+            provider_id=instance.pk,
+            before=before,
+            after=None
+        )
+
+
+# ==================== PROVIDER SEARCH CACHE, FACETS AND RANKING ====================
+
+@receiver(search_index.provider_index_changed)
+def invalidate_search_cache(sender, provider_id, before, after, **kwargs):
+    """Bump the cache namespaces affected by an index row change"""
+    if provider_id is None:
+        search_cache.invalidate()
+        return
+    category_mask = (before or {}).get('category_mask', 0) | (after or {}).get('category_mask', 0)
+    search_cache.invalidate(category_mask)
+
+
+@receiver(search_index.provider_index_changed)
+def refresh_ranking_features(sender, provider_id, **kwargs):
+    """Have the ranking feature store pick up the change on its next lookup"""
+    if not ranking.is_enabled():
+        return
+    store = ranking.get_ranker().store
+    if provider_id is None:
+        store.reset()
+    else:
+        store.mark_stale()
+
+
+@receiver(search_index.provider_index_changed)
+def update_facet_counters(sender, provider_id, before, after, **kwargs):
+    """Apply an index row change to the per-facet counters"""
+    if provider_id is None:
+        facets.rebuild_counters()
+    else:
+        facets.apply_change(before, after)
+
+
+# ==================== TEXT SEARCH INDEX ====================
+
+def _touches(update_fields, indexed_fields):
+    """Whether a save may have changed any of the indexed fields"""
+    return not update_fields or any(field in indexed_fields for field in update_fields)
+
+
+@receiver(post_save, sender=ProviderProfile)
+def index_provider_text(sender, instance, raw=False, update_fields=None, **kwargs):
+    backend = get_search_backend()
+    if backend is not None and not raw and _touches(update_fields, PROVIDER_FIELD_WEIGHTS):
+        backend.index_instance('provider', instance)
+
+
+@receiver(post_save, sender=Machine)
+def index_machine_text(sender, instance, raw=False, update_fields=None, **kwargs):
+    backend = get_search_backend()
+    if backend is not None and not raw and _touches(update_fields, MACHINE_FIELD_WEIGHTS):
+        backend.index_instance('machine', instance)
+
+
+@receiver(post_delete, sender=ProviderProfile)
+def remove_provider_text(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove_instance('provider', instance.pk)
+
+
+@receiver(post_delete, sender=Machine)
+def remove_machine_text(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove_instance('machine', instance.pk)
+
+
+# ==================== MESSAGE SEARCH INDEX ====================
+
+# No post_delete receiver: it would make Django load every message of a
+# deleted room instead of deleting them in one query. MessageViewSet
+# unindexes the messages it deletes; rows of messages deleted otherwise are
+# skipped by the search and dropped by rebuild_message_index.
+
+@receiver(post_save, sender=Message)
+def index_message_text(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches(update_fields, ['content']):
+        return
+    if created:
+        message_search.index_messages([instance])
+    else:
+        message_search.reindex_message(instance)
+
+
+# ==================== AUTOCOMPLETE INDEX ====================
+
+@receiver(post_save, sender=ProviderProfile)
+def index_provider_suggestions(sender, instance, raw=False, update_fields=None, **kwargs):
+    index = autocomplete.get_index_if_built()
+    if index is not None and not raw and _touches(
+        update_fields, ['company_name', 'city', 'subscription_status', 'is_verified']
+    ):
+        index.index_provider(instance)
+
+
+@receiver(post_save, sender=Machine)
+def index_machine_suggestions(sender, instance, raw=False, update_fields=None, **kwargs):
+    index = autocomplete.get_index_if_built()
+    if index is not None and not raw and _touches(
+        update_fields, ['name', 'brand', 'model', 'provider']
+    ):
+        index.index_machine(instance)
+
+
+@receiver(post_delete, sender=ProviderProfile)
+def remove_provider_suggestions(sender, instance, **kwargs):
+    index = autocomplete.get_index_if_built()
+    if index is not None:
+        index.remove_provider(instance.pk)
+
+
+@receiver(post_delete, sender=Machine)
+def remove_machine_suggestions(sender, instance, **kwargs):
+    index = autocomplete.get_index_if_built()
+    if index is not None:
+        index.remove_machine(instance.pk)
+
+
+# ==================== WEBSOCKET AUTHENTICATION ====================
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_socket_user(sender, instance, update_fields=None, **kwargs):
+    """Drop the cached WebSocket user so the next connect reloads it"""
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    user_cache.forget(instance.pk)
+
+
+# ==================== CHAT ROOM MEMBERSHIP ====================
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def invalidate_room_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    """Forget the cached rooms of every user whose membership changed"""
+    if action == 'pre_clear' and not reverse:
+        # The cleared users are not reported afterwards
+        instance._cleared_participants = memberships.participant_ids(instance.pk)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        memberships.forget([instance.pk])
+    elif action == 'post_clear':
+        memberships.forget(getattr(instance, '_cleared_participants', []))
+    else:
+        memberships.forget(pk_set or [])
+
+
+@receiver(pre_delete, sender=ChatRoom)
+def snapshot_room_participants(sender, instance, **kwargs):
+    # Participant rows are deleted by the cascade without m2m_changed
+    instance._deleted_participants = memberships.participant_ids(instance.pk)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def forget_room_memberships(sender, instance, **kwargs):
+    memberships.forget(getattr(instance, '_deleted_participants', []))
+
+
+# ==================== MESSAGE ARCHIVE ====================
+
+@receiver(post_delete, sender=MessageArchiveSegment)
+def delete_archive_file(sender, instance, **kwargs):
+    """Remove the segment's file (file storage) once the delete is committed"""
+    archive.cache.forget(instance.pk)
+    if instance.file:
+        storage, name = instance.file.storage, instance.file.name
+        transaction.on_commit(lambda: storage.delete(name))
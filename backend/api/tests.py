@@ -1,3 +1,889 @@
-from django.test import TestCase
+"""
+Behavior tests for the API.
 
-# Create your tests here.
+Run with ``python manage.py test api``. Chat code normally runs its queries on
+the chat database pool; the tests set CHAT_DB_POOL['SIZE'] to 0 so they run on
+the test's own thread and connection (inside its transaction).
+"""
+
+import asyncio
+import base64
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from config.asgi import application
+
+from .models import ChatRoom, Machine, Message, ProviderProfile, ReadState
+from . import (
+    archive, autocomplete, db_pool, frames, history, layers, limits, memberships, message_writer, presence,
+    ranking, read_receipts, search_cache
+)
+
+User = get_user_model()
+
+
+def make_user(name, **fields):
+    return User.objects.create_user(
+        email=f'{name}@test.com',
+        username=name,
+        password='TestPass123!',
+        first_name=name.title(),
+        **fields
+    )
+
+
+def make_provider(name, **fields):
+    profile = dict(
+        company_name=f'Empresa {name}',
+        subscription_status='active',
+        is_verified=True,
+        available_within_48h=True,
+        city='Santiago',
+        region='Metropolitana'
+    )
+    profile.update(fields)
+    return ProviderProfile.objects.create(user=make_user(name, is_provider=True), **profile)
+
+
+def make_machine(provider, **fields):
+    machine = dict(name='Excavadora CAT 320', category='excavator', main_image='machines/x.jpg', brand='CAT', model='320')
+    machine.update(fields)
+    return Machine.objects.create(provider=provider, **machine)
+
+
+def make_room(*users):
+    room = ChatRoom.objects.create()
+    room.participants.add(*users)
+    return room
+
+
+# ==================== CHAT MESSAGE PERSISTENCE ====================
+
+@override_settings(CHAT_DB_POOL={'SIZE': 0})
+class MessageWriterTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+
+    def test_ids_follow_send_order(self):
+        """A message created elsewhere between two socket messages gets an id between theirs"""
+        writer = message_writer.MessageWriter(dict(message_writer.get_config(), FLUSH_INTERVAL=60))
+
+        async def send():
+            first, _ = await writer.save(self.room.id, self.alice.id, 'uno')
+            rest = await database_sync_to_async(Message.objects.create)(
+                room_id=self.room.id, author_id=self.bob.id, content='dos'
+            )
+            second, _ = await writer.save(self.room.id, self.alice.id, 'tres')
+            await writer.flush()
+            return first, rest, second
+
+        first, rest, second = async_to_sync(send)()
+
+        self.assertLess(first.id, rest.id)
+        self.assertLess(rest.id, second.id)
+        self.assertEqual(
+            list(Message.objects.filter(room=self.room).values_list('content', flat=True)),
+            ['uno', 'dos', 'tres']
+        )
+
+    def test_concurrent_sends_share_one_reservation(self):
+        writer = message_writer.MessageWriter(dict(message_writer.get_config(), FLUSH_INTERVAL=60))
+
+        async def send():
+            sent = await asyncio.gather(*(writer.save(self.room.id, self.alice.id, str(n)) for n in range(5)))
+            await writer.flush()
+            return [message.id for message, _committed in sent]
+
+        with mock.patch.object(message_writer, 'reserve_ids', wraps=message_writer.reserve_ids) as reserve:
+            ids = async_to_sync(send)()
+
+        self.assertEqual(reserve.call_count, 1)
+        self.assertEqual(ids, list(range(ids[0], ids[0] + 5)))
+        self.assertEqual(
+            list(Message.objects.filter(room=self.room).order_by('pk').values_list('content', flat=True)),
+            ['0', '1', '2', '3', '4']
+        )
+
+
+# ==================== READ RECEIPTS ====================
+
+@override_settings(CHAT_DB_POOL={'SIZE': 0})
+class ReadWatermarkTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+
+    def test_message_sent_after_watermark_is_unread(self):
+        """A socket message sent after the reader's watermark moved is still unread"""
+        writer = message_writer.MessageWriter(dict(message_writer.get_config(), FLUSH_INTERVAL=60))
+        async_to_sync(writer.save)(self.room.id, self.alice.id, 'primero')
+        rest = Message.objects.create(room=self.room, author=self.alice, content='por la API')
+        read_receipts.advance(self.room.id, self.bob.id, rest.id)
+
+        async def send():
+            message, _ = await writer.save(self.room.id, self.alice.id, 'después')
+            await writer.flush()
+            return message
+
+        later = async_to_sync(send)()
+        watermarks = read_receipts.watermarks([self.room.id])[self.room.id]
+
+        self.assertEqual(read_receipts.unread_counts(self.bob.id, [self.room.id]), {self.room.id: 1})
+        self.assertTrue(read_receipts.is_read(rest, watermarks))
+        self.assertFalse(read_receipts.is_read(later, watermarks))
+
+    def test_watermark_only_moves_forward(self):
+        first = Message.objects.create(room=self.room, author=self.alice, content='uno')
+        second = Message.objects.create(room=self.room, author=self.alice, content='dos')
+
+        self.assertEqual(read_receipts.advance(self.room.id, self.bob.id, second.id), second.id)
+        self.assertIsNone(read_receipts.advance(self.room.id, self.bob.id, first.id))
+        # Unknown ids are lowered to the latest real message
+        self.assertIsNone(read_receipts.advance(self.room.id, self.bob.id, second.id + 1000))
+        self.assertEqual(read_receipts.unread_counts(self.bob.id, [self.room.id]), {})
+
+
+# ==================== CHAT INBOX ====================
+
+class ChatInboxTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+        self.messages = [
+            Message.objects.create(room=self.room, author=self.bob, content=f'mensaje {number}')
+            for number in range(5)
+        ]
+        self.api = APIClient()
+        self.api.force_authenticate(self.alice)
+
+    def get(self, url, **params):
+        response = self.api.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_inbox_shows_last_message_and_unread_count(self):
+        read_receipts.advance(self.room.id, self.alice.id, self.messages[1].id)
+
+        room = self.get('/api/chat-rooms/')['results'][0]
+
+        self.assertEqual(room['last_message']['id'], self.messages[-1].id)
+        self.assertEqual(room['unread_count'], 3)
+
+    def test_inbox_queries_do_not_grow_with_rooms(self):
+        with CaptureQueriesContext(connection) as one_room:
+            self.get('/api/chat-rooms/')
+        for number in range(3):
+            other = make_user(f'contacto{number}')
+            Message.objects.create(room=make_room(self.alice, other), author=other, content='hola')
+        with CaptureQueriesContext(connection) as four_rooms:
+            rooms = self.get('/api/chat-rooms/')['results']
+
+        self.assertEqual(len(rooms), 4)
+        self.assertEqual(len(four_rooms), len(one_room))
+
+    @override_settings(CHAT_ROOM_MESSAGES_WINDOW=2)
+    def test_message_windows_walk_back_through_history(self):
+        room = self.get(f'/api/chat-rooms/{self.room.id}/')
+        seen = [message['id'] for message in room['messages']]
+        cursor = room['messages_cursor']
+        while cursor is not None:
+            window = self.get(f'/api/chat-rooms/{self.room.id}/messages/', before=cursor)
+            seen = [message['id'] for message in window['messages']] + seen
+            cursor = window['messages_cursor']
+
+        self.assertEqual(seen, [message.id for message in self.messages])
+        self.assertEqual(list(room['authors']), [str(self.bob.id)])
+
+
+# ==================== MESSAGE SEARCH ====================
+
+@override_settings(CHAT_DB_POOL={'SIZE': 0})
+class MessageSearchTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.carol = make_user('carol')
+        self.room = make_room(self.alice, self.bob)
+        self.other_room = make_room(self.bob, self.carol)
+        self.api = APIClient()
+        self.api.force_authenticate(self.alice)
+
+    def search(self, **params):
+        response = self.api.get('/api/messages/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_finds_every_word_in_own_rooms_only(self):
+        match = Message.objects.create(room=self.room, author=self.bob, content='¿Tienes la grúa disponible el lunes?')
+        Message.objects.create(room=self.room, author=self.bob, content='La grúa está en mantención')
+        Message.objects.create(room=self.other_room, author=self.carol, content='Grúas disponibles <b>hoy</b>')
+
+        results = self.search(q='gruas disponible')['results']
+
+        self.assertEqual([result['id'] for result in results], [match.id])
+        self.assertEqual(
+            results[0]['snippet'],
+            '¿Tienes la <mark>grúa</mark> <mark>disponible</mark> el lunes?'
+        )
+
+    def test_snippet_escapes_html_and_pages_go_back(self):
+        messages = [
+            Message.objects.create(room=self.room, author=self.bob, content=f'<b>Cotización</b> número {number}')
+            for number in range(3)
+        ]
+
+        page = self.search(q='cotizacion', limit=2)
+        rest = self.search(q='cotizacion', limit=2, before=page['next_before'])
+
+        self.assertEqual(
+            [result['id'] for result in page['results'] + rest['results']],
+            [message.id for message in reversed(messages)]
+        )
+        self.assertTrue(page['results'][0]['snippet'].startswith('&lt;b&gt;<mark>Cotización</mark>'))
+        self.assertIsNone(rest['next_before'])
+
+
+# ==================== CHAT RESUME ====================
+
+@override_settings(CHAT_HISTORY_RESUME_OVERLAP=5)
+class ResumeTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+        self.now = timezone.now()
+
+    def message(self, message_id, seconds_ago):
+        return Message.objects.create(
+            id=message_id,
+            room=self.room,
+            author=self.alice,
+            content=f'mensaje {message_id}',
+            timestamp=self.now - timedelta(seconds=seconds_ago)
+        )
+
+    def event(self, message_id, sent_at):
+        timestamp = self.now + timedelta(seconds=sent_at)
+        return frames.chat_message_event(self.room.id, message_id, self.alice.id, 'alice@test.com', 'Alice', 'hola', timestamp)
+
+    def test_load_since_includes_lower_ids_written_late(self):
+        """A message with a lower id written after the last seen one is still sent"""
+        self.message(10, 60)
+        self.message(20, 2)
+        self.message(30, 1)
+        self.message(25, 1.5)
+        self.message(40, 0)
+
+        events, truncated = history.load_since(self.room.id, 30, limit=10)
+
+        self.assertEqual([event['message_id'] for event in events], [20, 25, 40])
+        self.assertFalse(truncated)
+
+    def test_buffer_keeps_late_events(self):
+        buffer = history.RoomBuffer(size=10)
+        buffer.covered_from = (self.now - timedelta(seconds=60)).timestamp()
+        for message_id, sent_at in ((10, 0), (30, 2), (20, 1), (40, 3)):
+            buffer.add(self.event(message_id, sent_at))
+
+        self.assertEqual([event['message_id'] for event in buffer.since(30, overlap=5)], [10, 20, 40])
+        # Unknown last seen message: the database has to answer
+        self.assertIsNone(buffer.since(35, overlap=5))
+
+    def test_buffer_does_not_vouch_for_evicted_messages(self):
+        buffer = history.RoomBuffer(size=2)
+        buffer.covered_from = (self.now - timedelta(seconds=60)).timestamp()
+        for message_id, sent_at in ((10, 0), (20, 1), (30, 2)):
+            buffer.add(self.event(message_id, sent_at))
+
+        self.assertIsNone(buffer.since(30, overlap=5))
+        self.assertEqual([event['message_id'] for event in buffer.since(30, overlap=1.5)], [20])
+
+
+# ==================== CHANNEL LAYER ====================
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sock')
+
+    def test_group_send_through_private_hub(self):
+        async def scenario():
+            layer = layers.UnixSocketChannelLayer(path=self.path)
+            channel = await layer.new_channel()
+            await layer.group_add('sala', channel)
+            await layer.group_send('sala', {'type': 'chat.message', 'text': 'hola'})
+            message = await asyncio.wait_for(layer.receive(channel), 5)
+            mode = os.stat(self.path).st_mode & 0o777
+            await layer.close()
+            return message, mode
+
+        message, mode = asyncio.run(scenario())
+
+        self.assertEqual(message['text'], 'hola')
+        self.assertEqual(mode, 0o600)
+
+    def test_short_lived_loop_does_not_host_the_hub(self):
+        """async_to_sync without a running loop only connects, and drops sends with no hub"""
+        layer = layers.UnixSocketChannelLayer(path=self.path)
+        started = time.monotonic()
+        async_to_sync(layer.group_send)('sala', {'type': 'chat.message'})
+
+        self.assertLess(time.monotonic() - started, layers.CONNECT_TIMEOUT)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_refuses_directory_others_can_write_to(self):
+        os.chmod(os.path.dirname(self.path), 0o777)
+        with self.assertRaises(ImproperlyConfigured):
+            layers.UnixSocketChannelLayer(path=self.path)
+
+
+# ==================== PROVIDER SEARCH ====================
+
+class ProviderSearchTests(TestCase):
+
+    def setUp(self):
+        search_cache.get_cache().clear()
+        self.santiago = make_provider('santiago', company_name='Excavaciones Andinas', latitude=-33.45, longitude=-70.66)
+        self.valparaiso = make_provider(
+            'valparaiso', company_name='Grúas del Puerto', city='Valparaíso', region='Valparaíso',
+            latitude=-33.05, longitude=-71.62
+        )
+        make_machine(self.santiago, category='excavator')
+        make_machine(self.valparaiso, name='Grúa Liebherr', category='crane', brand='Liebherr', model='LTM')
+
+    def search(self, **params):
+        response = self.client.get('/api/providers/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [provider['user'] for provider in response.json()['results']]
+
+    def test_category_filter_reads_the_index(self):
+        self.assertEqual(self.search(category='crane'), [self.valparaiso.pk])
+        # The index follows machine changes (signals.py)
+        make_machine(self.santiago, name='Grúa Grove', category='crane')
+        self.assertCountEqual(self.search(category='crane'), [self.santiago.pk, self.valparaiso.pk])
+
+    def test_moving_a_machine_reindexes_both_providers(self):
+        machine = Machine.objects.get(provider=self.valparaiso)
+        machine.provider = self.santiago
+        machine.save()
+
+        self.assertEqual(self.search(category='crane'), [self.santiago.pk])
+
+    def test_cached_results_follow_availability_changes(self):
+        self.assertCountEqual(self.search(), [self.santiago.pk, self.valparaiso.pk])
+
+        self.valparaiso.available_within_48h = False
+        self.valparaiso.save(update_fields=['available_within_48h', 'updated_at'])
+
+        self.assertEqual(self.search(), [self.santiago.pk])
+
+    def test_radius_search(self):
+        # Valparaíso is about 115 km from Santiago
+        self.assertEqual(self.search(lat=-33.44, lng=-70.65, radius_km=50), [self.santiago.pk])
+        self.assertCountEqual(self.search(lat=-33.44, lng=-70.65, radius_km=150), [self.santiago.pk, self.valparaiso.pk])
+
+    def test_nearest_first(self):
+        self.assertEqual(self.search(lat=-33.0, lng=-71.5, order_by_distance='true'), [self.valparaiso.pk, self.santiago.pk])
+
+    def test_relevance_ranking(self):
+        with mock.patch.object(ranking, '_ranker', ranking.ProviderRanker()):
+            self.valparaiso.rating = 4.8
+            self.valparaiso.total_reviews = 40
+            self.valparaiso.save()
+
+            response = self.client.get('/api/providers/search/')
+
+        results = response.json()['results']
+        self.assertEqual([provider['user'] for provider in results], [self.valparaiso.pk, self.santiago.pk])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+
+    def test_warns_when_ranking_lacks_numpy(self):
+        self.assertEqual(ranking.check_numpy(), [])
+        with mock.patch.object(ranking, 'np', None):
+            self.assertEqual([warning.id for warning in ranking.check_numpy()], ['api.W001'])
+            with override_settings(PROVIDER_RANKING={'ENABLED': False}):
+                self.assertEqual(ranking.check_numpy(), [])
+
+    def test_text_search_ignores_accents_and_plurals(self):
+        response = self.client.get('/api/providers/', {'search': 'grua puerto'})
+
+        self.assertEqual([provider['user'] for provider in response.json()['results']], [self.valparaiso.pk])
+
+    def test_facets_count_every_alternative(self):
+        facets = self.client.get('/api/providers/search/facets/', {'category': 'crane'}).json()
+
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(
+            {item['value']: item['count'] for item in facets['category']},
+            {'crane': 1, 'excavator': 1}
+        )
+        self.assertEqual(facets['city'], [{'value': 'Valparaíso', 'count': 1}])
+
+
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(autocomplete, '_index', autocomplete.PrefixIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        provider = make_provider('proveedor', company_name='Grúas del Sur')
+        make_machine(provider, name='Grúa Horquilla Toyota', category='forklift', brand='Toyota', model='8FG25')
+
+    def suggest(self, query, **params):
+        response = self.client.get('/api/autocomplete/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(item['kind'], item['text']) for item in response.json()['results']]
+
+    def test_matches_any_word_start_without_accents(self):
+        self.assertIn(('machine', 'Grúa Horquilla Toyota'), self.suggest('horq'))
+        self.assertIn(('company', 'Grúas del Sur'), self.suggest('grua', kinds='company'))
+
+    def test_index_follows_new_machines(self):
+        self.suggest('toy')
+        provider = ProviderProfile.objects.get()
+        make_machine(provider, name='Excavadora Volvo', brand='Volvo', model='EC220')
+
+        self.assertIn(('brand', 'Volvo'), self.suggest('volv'))
+
+    def test_changes_during_a_rebuild_are_kept(self):
+        self.suggest('toy')
+        provider = ProviderProfile.objects.get()
+        load_machine = autocomplete.machine_terms
+
+        def rename_meanwhile(*args):
+            # Providers are already read by the time machines are
+            if provider.company_name != 'Maquinarias Andes':
+                provider.company_name = 'Maquinarias Andes'
+                provider.save()
+            return load_machine(*args)
+
+        with mock.patch.object(autocomplete, 'machine_terms', rename_meanwhile):
+            autocomplete.get_index().build()
+
+        self.assertIn(('company', 'Maquinarias Andes'), self.suggest('andes'))
+        self.assertEqual(self.suggest('grua', kinds='company'), [])
+
+
+# ==================== KEYSET PAGINATION ====================
+
+def cursor(values, reverse=False):
+    payload = json.dumps({'v': values, 'r': int(reverse)}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+class KeysetPaginationTests(TestCase):
+
+    def test_cursor_pages_cover_every_row_once(self):
+        provider = make_provider('proveedor')
+        machines = [make_machine(provider, name=f'Máquina {number}') for number in range(5)]
+
+        seen = []
+        url = '/api/machines/?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            seen += [machine['id'] for machine in page['results']]
+            url = page['next']
+
+        self.assertEqual(seen, [machine.id for machine in reversed(machines)])
+
+    def test_cursor_with_bad_values_is_not_found(self):
+        response = self.client.get('/api/machines/', {'cursor': cursor(['abc', 1])})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['detail'], 'Cursor inválido.')
+
+    def test_cursor_with_wrong_type_is_not_found(self):
+        response = self.client.get('/api/machines/', {'cursor': cursor([['2024-01-01'], {'id': 1}])})
+
+        self.assertEqual(response.status_code, 404)
+
+
+# ==================== CHAT LIMITS ====================
+
+class UserBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        self.config = dict(limits.get_config(), MESSAGE_RATE=1, MESSAGE_BURST=2, BUCKET_TTL=60)
+        self.addCleanup(limits._user_buckets.clear)
+
+    def test_reconnecting_does_not_refill_the_bucket(self):
+        bucket = limits.acquire_user_bucket(7, self.config)
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        limits.release_user_bucket(7)
+
+        bucket = limits.acquire_user_bucket(7, self.config)
+
+        self.assertFalse(bucket.take())
+
+    def test_idle_full_buckets_are_evicted(self):
+        bucket = limits.acquire_user_bucket(7, self.config)
+        limits.release_user_bucket(7)
+        busy = limits.acquire_user_bucket(8, self.config)
+        bucket.updated -= 120
+        busy.updated -= 120
+        limits._last_eviction -= 120
+
+        limits.evict_idle_buckets(60)
+
+        self.assertNotIn(7, limits._user_buckets)
+        self.assertIn(8, limits._user_buckets)
+
+
+# ==================== CHAT CONSUMER ====================
+
+@override_settings(
+    CHAT_DB_POOL={'SIZE': 0},
+    CHAT_PERSISTENCE={'ACK': 'persisted', 'FLUSH_INTERVAL': 0.01},
+    CHAT_READ_RECEIPT_DELAY=60,
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+)
+class ChatConsumerTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+
+    def connect(self, user):
+        return WebsocketCommunicator(
+            application,
+            f'/ws/chat/{self.room.id}/?token={AccessToken.for_user(user)}',
+            headers=[(b'origin', b'http://localhost')]
+        )
+
+    async def receive(self, socket, frame_type):
+        while True:
+            frame = await socket.receive_json_from(timeout=5)
+            if frame['type'] == frame_type:
+                return frame
+
+    def test_message_acknowledged_once_persisted(self):
+        async def scenario():
+            socket = self.connect(self.alice)
+            await socket.connect()
+            await socket.send_json_to({'type': 'chat_message', 'message': 'hola', 'client_id': 'c1'})
+            ack = await self.receive(socket, 'message_ack')
+            await socket.disconnect()
+            return ack
+
+        ack = async_to_sync(scenario)()
+
+        self.assertEqual(ack['client_id'], 'c1')
+        self.assertTrue(ack['persisted'])
+        self.assertTrue(Message.objects.filter(pk=ack['message_id'], content='hola').exists())
+
+    def test_disconnect_writes_debounced_read_receipts(self):
+        message = Message.objects.create(room=self.room, author=self.alice, content='hola')
+
+        async def scenario():
+            socket = self.connect(self.bob)
+            await socket.connect()
+            await socket.send_json_to({'type': 'read_receipt', 'message_id': message.id})
+            await socket.receive_nothing(0.1)
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
+
+        self.assertEqual(ReadState.objects.get(room=self.room, user=self.bob).last_read_message_id, message.id)
+
+    def connects(self, query):
+        async def attempt():
+            socket = WebsocketCommunicator(
+                application,
+                f'/ws/chat/{self.room.id}/{query}',
+                headers=[(b'origin', b'http://localhost')]
+            )
+            connected, _ = await socket.connect()
+            await socket.disconnect()
+            return connected
+
+        return async_to_sync(attempt)()
+
+    def test_rejects_missing_and_invalid_tokens(self):
+        self.assertFalse(self.connects(''))
+        self.assertFalse(self.connects('?token=invalido'))
+        self.assertTrue(self.connects(f'?token={AccessToken.for_user(self.bob)}'))
+
+    def test_membership_changes_reach_the_cache(self):
+        outsider = make_user('outsider')
+        query = f'?token={AccessToken.for_user(outsider)}'
+        self.addCleanup(memberships.local.clear)
+
+        self.assertFalse(self.connects(query))
+        self.room.participants.add(outsider)
+        self.assertTrue(self.connects(query))
+        self.room.participants.remove(outsider)
+        self.assertFalse(self.connects(query))
+
+
+# ==================== FRAMES ====================
+
+class FrameTests(SimpleTestCase):
+
+    def setUp(self):
+        sent = timezone.now()
+        self.events = [
+            frames.chat_message_event(7, number, 1, 'alice@test.com', 'Alice', f'hola {number}', sent)
+            for number in (1, 2)
+        ]
+
+    def test_history_frame_splices_encoded_messages(self):
+        expected = [json.loads(event['text']) for event in self.events]
+
+        text = json.loads(frames.history_frame(7, self.events, True, False))
+        binary = frames.unpack(frames.history_frame(7, self.events, True, False, binary=True))
+
+        self.assertEqual(text, {'type': 'history', 'room_id': 7, 'messages': expected, 'complete': True, 'truncated': False})
+        self.assertEqual(binary, text)
+
+    def test_decode_accepts_json_and_msgpack_objects_only(self):
+        frame = {'type': 'typing', 'is_typing': True}
+
+        self.assertEqual(frames.decode(text_data=frames.dumps(frame)), frame)
+        self.assertEqual(frames.decode(bytes_data=frames.pack(frame)), frame)
+        self.assertIsNone(frames.decode(text_data='[1, 2]'))
+        self.assertIsNone(frames.decode(bytes_data=b'\xc1'))
+
+    def test_decode_rejects_deeply_nested_frames(self):
+        with mock.patch.object(frames, 'orjson', None):
+            self.assertIsNone(frames.decode(text_data='[' * 5000))
+        self.assertIsNone(frames.decode(text_data='[' * 5000))
+        self.assertIsNone(frames.decode(bytes_data=b'\x91' * 5000 + b'\xc0'))
+
+
+# ==================== DB POOL ====================
+
+class DatabasePoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = db_pool.DatabasePool({'SIZE': 2, 'MAX_QUEUE': 1, 'CONN_MAX_AGE': 600})
+        self.addCleanup(self.pool.shutdown)
+
+    def test_runs_jobs_off_the_event_loop_and_counts_them(self):
+        def fail():
+            raise ValueError('falla')
+
+        async def scenario():
+            loop_thread = threading.get_ident()
+            threads = await asyncio.gather(*(self.pool.run(threading.get_ident) for _ in range(5)))
+            with self.assertRaises(ValueError):
+                await self.pool.run(fail)
+            return loop_thread, threads
+
+        loop_thread, threads = async_to_sync(scenario)()
+
+        self.assertNotIn(loop_thread, threads)
+        self.assertLessEqual(len(set(threads)), 2)
+        stats = self.pool.stats()
+        self.assertEqual((stats['jobs'], stats['failed'], stats['queued'], stats['running']), (6, 1, 0, 0))
+
+    @override_settings(CHAT_DB_POOL={'SIZE': 0})
+    def test_size_zero_has_no_pool(self):
+        self.assertIsNone(db_pool.get_pool())
+        self.assertEqual(db_pool.stats(), {'size': 0})
+
+
+# ==================== PRESENCE ====================
+
+PRESENCE_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'presence': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'presence-tests'},
+}
+
+
+@override_settings(CACHES=PRESENCE_CACHES)
+class PresenceBulkTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(presence, 'registry', presence.PresenceRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        presence.registry.connect(1, [10])
+
+    @override_settings(PRESENCE_CACHE=None, CHANNEL_LAYERS={'default': {'BACKEND': 'api.layers.UnixSocketChannelLayer'}})
+    def test_warns_without_shared_cache_across_processes(self):
+        self.assertEqual([warning.id for warning in presence.check_shared_cache()], ['api.W002'])
+        with override_settings(PRESENCE_CACHE='default'):
+            self.assertEqual([warning.id for warning in presence.check_shared_cache()], ['api.W002'])
+        shared = dict(PRESENCE_CACHES, presence={'BACKEND': 'django.core.cache.backends.redis.RedisCache'})
+        with override_settings(PRESENCE_CACHE='presence', CACHES=shared):
+            self.assertEqual(presence.check_shared_cache(), [])
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            self.assertEqual(presence.check_shared_cache(), [])
+
+    @override_settings(PRESENCE_CACHE=None)
+    def test_without_shared_cache_only_this_process_is_known(self):
+        states = presence.bulk([1, 2])
+
+        self.assertEqual(states[1]['status'], 'online')
+        self.assertEqual(states[2], presence.offline_state(2))
+
+    @override_settings(PRESENCE_CACHE='presence')
+    def test_shared_cache_knows_users_of_other_processes(self):
+        # What the ticker of another worker publishes for its users
+        presence.publish({2: {'user_id': 2, 'status': 'away', 'last_seen': None}})
+        self.addCleanup(presence.get_shared_cache().clear)
+
+        states = presence.bulk([1, 2, 3])
+
+        self.assertEqual(states[1]['status'], 'online')
+        self.assertEqual(states[2]['status'], 'away')
+        self.assertEqual(states[3]['status'], 'offline')
+
+
+# ==================== CHAT ARCHIVE ====================
+
+@override_settings(CHAT_ARCHIVE={'STORAGE': 'database'})
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.room = make_room(self.alice, self.bob)
+        past = timezone.now() - timedelta(days=30)
+        self.messages = [
+            Message.objects.create(room=self.room, author=self.alice, content=f'mensaje {number}', timestamp=past)
+            for number in range(6)
+        ]
+        self.config = dict(archive.get_config(), AFTER_DAYS=7, KEEP_RECENT=2, SEGMENT_SIZE=10, MIN_SEGMENT=1)
+        self.addCleanup(archive.cache.clear)
+
+    def test_only_messages_read_by_everyone_are_archived(self):
+        read_receipts.advance(self.room.id, self.bob.id, self.messages[2].id)
+
+        self.assertEqual(archive.archive_room(self.room.id, self.config), (1, 3))
+        self.assertEqual(
+            list(Message.objects.filter(room=self.room).values_list('pk', flat=True)),
+            [message.pk for message in self.messages[3:]]
+        )
+
+    def test_history_and_restore_see_the_same_messages(self):
+        read_receipts.advance(self.room.id, self.bob.id, self.messages[-1].id)
+        original = [(message.pk, message.author_id, message.content, message.timestamp) for message in self.messages]
+        archive.archive_room(self.room.id, self.config)
+
+        window, has_more = history.load_window(self.room.id, limit=10)
+        self.assertEqual([(m.pk, m.author_id, m.content, m.timestamp) for m in window], original)
+        self.assertFalse(has_more)
+
+        self.assertEqual(archive.restore_room(self.room.id), (1, 4))
+        restored = Message.objects.filter(room=self.room).values_list('pk', 'author_id', 'content', 'timestamp')
+        self.assertEqual(list(restored), original)
+
+    def test_room_listing_pages_through_both_tiers(self):
+        read_receipts.advance(self.room.id, self.bob.id, self.messages[-1].id)
+        archive.archive_room(self.room.id, self.config)
+        api = APIClient()
+        api.force_authenticate(self.bob)
+
+        def walk(ordering, direction='next'):
+            pages = []
+            url = f'/api/messages/?room={self.room.id}&page_size=4&ordering={ordering}'
+            while url:
+                page = api.get(url).json()
+                pages.append([message['id'] for message in page['results']])
+                url = page[direction]
+            return pages
+
+        ids = [message.pk for message in self.messages]
+        self.assertEqual(walk('id'), [ids[:4], ids[4:]])
+        self.assertEqual(walk('-id'), [ids[:1:-1], ids[1::-1]])
+
+        last_page = api.get(f'/api/messages/?room={self.room.id}&page_size=4').json()['next']
+        previous = api.get(api.get(last_page).json()['previous']).json()
+        self.assertEqual([message['id'] for message in previous['results']], ids[:4])
+        self.assertIsNone(previous['previous'])
+
+    def test_segments_store_every_message_field(self):
+        self.assertEqual(archive.check_archived_fields(), [])
+        with mock.patch.object(archive, 'ARCHIVED_FIELDS', {'id', 'room', 'author', 'content'}):
+            self.assertEqual([error.id for error in archive.check_archived_fields()], ['api.E001'])
+
+
+# ==================== DIRECT ROOMS ====================
+
+class MergeDirectRoomsTests(TestCase):
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.migration = importlib.import_module('api.migrations.0012_chatroom_direct_pair')
+
+    def test_merge_never_marks_unread_messages_read(self):
+        older = make_room(self.alice, self.bob)
+        newer = make_room(self.alice, self.bob)
+        unread = Message.objects.create(room=newer, author=self.alice, content='sin leer')
+        read = [Message.objects.create(room=older, author=self.alice, content=f'leído {n}') for n in range(2)]
+        read_receipts.advance(older.id, self.bob.id, read[-1].id)
+
+        self.migration.merge_direct_rooms(django_apps, None)
+
+        self.assertFalse(ChatRoom.objects.filter(pk=newer.pk).exists())
+        self.assertEqual(Message.objects.get(pk=unread.pk).room_id, older.id)
+        watermark = ReadState.objects.get(room=older, user=self.bob).last_read_message_id
+        self.assertLess(watermark, unread.id)
+        self.assertEqual(read_receipts.unread_counts(self.bob.id, [older.id]), {older.id: 3})
+
+    def test_merge_keeps_watermark_when_everything_was_read(self):
+        older = make_room(self.alice, self.bob)
+        newer = make_room(self.alice, self.bob)
+        first = Message.objects.create(room=newer, author=self.alice, content='uno')
+        last = Message.objects.create(room=older, author=self.alice, content='dos')
+        read_receipts.advance(newer.id, self.bob.id, first.id)
+        read_receipts.advance(older.id, self.bob.id, last.id)
+
+        self.migration.merge_direct_rooms(django_apps, None)
+
+        self.assertEqual(ReadState.objects.get(room=older, user=self.bob).last_read_message_id, last.id)
+        self.assertEqual(read_receipts.unread_counts(self.bob.id, [older.id]), {})
+
+
+# ==================== MACHINE SEARCH ====================
+
+class MachineSearchTests(TestCase):
+
+    def setUp(self):
+        provider = make_provider('proveedor')
+        self.cat = make_machine(provider, brand='CAT', model='320')
+        self.komatsu = make_machine(provider, brand='Komatsu', model='PC200')
+        make_machine(provider, brand='CAT', model='336')
+
+    def search(self, **params):
+        response = self.client.get('/api/machines/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return {machine['id'] for machine in response.json()['results']}
+
+    def test_brand_and_model_ignore_case(self):
+        self.assertEqual(self.search(brand='cat', model='320'), {self.cat.id})
+        self.assertEqual(self.search(model='pc200'), {self.komatsu.id})
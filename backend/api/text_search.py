@@ -0,0 +1,265 @@
+"""
+Accent-insensitive text search for providers and machines.
+
+Text is normalized for Spanish (lowercase, accent folding, light stemming)
+and stored in an inverted index (SearchToken) together with edge n-grams of
+every stem, so "grua", "Grúa" and "grúas" all match and partial words typed
+in the search box match as prefixes. Queries are answered with indexed
+lookups on (kind, token) and ranked by the summed token weights.
+
+The backend is pluggable through the TEXT_SEARCH_BACKEND setting; see
+BaseSearchBackend for the interface.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum, OuterRef, Subquery
+from django.utils.module_loading import import_string
+
+from .models import ProviderProfile, Machine, SearchToken
+
+
+# ==================== NORMALIZATION ====================
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+VOWELS = 'aeiou'
+
+MIN_GRAM = 3
+MAX_GRAM = 15
+MAX_TOKEN_LENGTH = 40
+
+STOPWORDS = frozenset([
+    'a', 'al', 'con', 'de', 'del', 'el', 'en', 'la', 'las', 'lo', 'los',
+    'o', 'para', 'por', 'se', 'un', 'una', 'y',
+])
+
+# Weight of a full-word match per field; prefix matches count half
+PROVIDER_FIELD_WEIGHTS = {
+    'company_name': 6,
+    'city': 4,
+    'region': 4,
+    'description': 2,
+}
+MACHINE_FIELD_WEIGHTS = {
+    'name': 6,
+    'brand': 4,
+    'model': 4,
+    'category': 4,
+    'description': 2,
+}
+
+CATEGORY_LABELS = dict(Machine.CATEGORY_CHOICES)
+
+
+def fold(text):
+    """Lowercase and strip accents ("Grúa Horquilla" -> "grua horquilla")"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(word):
+    """
+    Light Spanish stemmer: removes plural endings and the final gender vowel.
+
+    excavadoras -> excavador, camiones -> camion, gruas -> grua
+    """
+    if len(word) < 4 or word.isdigit():
+        return word
+    if word.endswith('ces'):
+        word = word[:-3] + 'z'
+    elif word.endswith('es') and word[-3] not in VOWELS:
+        word = word[:-2]
+    elif word.endswith('s') and word[-2] in VOWELS:
+        word = word[:-1]
+    if len(word) > 4 and word[-1] in 'aoe':
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Return the stems of the words in text, skipping stopwords"""
+    stems = []
+    for word in WORD_RE.findall(fold(text or '')):
+        if word in STOPWORDS:
+            continue
+        stems.append(stem(word[:MAX_TOKEN_LENGTH]))
+    return stems
+
+
+def document_tokens(fields):
+    """
+    Build {token: weight} for a document given [(text, field_weight), ...].
+
+    Full stems get the field weight and their edge n-grams half of it; a
+    token appearing in several fields keeps the sum of its weights.
+    """
+    tokens = {}
+    for text, field_weight in fields:
+        seen = {}
+        for word in tokenize(text):
+            seen[word] = max(seen.get(word, 0), field_weight)
+            for length in range(MIN_GRAM, min(len(word), MAX_GRAM + 1)):
+                prefix = word[:length]
+                seen[prefix] = max(seen.get(prefix, 0), field_weight // 2)
+        for token, weight in seen.items():
+            tokens[token] = tokens.get(token, 0) + weight
+    return tokens
+
+
+def query_terms(query):
+    """Normalize a search query into the distinct tokens to look up"""
+    return list(dict.fromkeys(tokenize(query)))
+
+
+# ==================== DOCUMENTS ====================
+
+def provider_document(provider):
+    return [
+        (getattr(provider, field), weight)
+        for field, weight in PROVIDER_FIELD_WEIGHTS.items()
+    ]
+
+
+def machine_document(machine):
+    fields = []
+    for field, weight in MACHINE_FIELD_WEIGHTS.items():
+        text = getattr(machine, field)
+        if field == 'category':
+            # Index both the code and the Spanish label ("crane Grúa")
+            text = f"{text} {CATEGORY_LABELS.get(text, '')}"
+        fields.append((text, weight))
+    return fields
+
+
+# kind -> (model, document builder)
+INDEXED_MODELS = {
+    'provider': (ProviderProfile, provider_document),
+    'machine': (Machine, machine_document),
+}
+
+
+# ==================== BACKENDS ====================
+
+class BaseSearchBackend:
+    """
+    Interface for text search backends.
+
+    Backends keep their own index up to date through index_instance and
+    remove_instance (called from signals.py) and answer queries by
+    narrowing and annotating a queryset with a ``search_rank`` column.
+    """
+
+    def index_instance(self, kind, instance):
+        pass
+
+    def remove_instance(self, kind, pk):
+        pass
+
+    def rebuild(self, kinds=None, batch_size=500):
+        return 0
+
+    def search(self, queryset, kind, query):
+        raise NotImplementedError('Search backends must implement search()')
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    Text search over the SearchToken table.
+
+    Works on any database Django supports (SQLite and PostgreSQL included)
+    since it only relies on b-tree lookups and GROUP BY.
+    """
+
+    def index_instance(self, kind, instance):
+        """Diff the document tokens against the stored rows and apply the changes"""
+        _model, build_document = INDEXED_MODELS[kind]
+        tokens = document_tokens(build_document(instance))
+
+        existing = {
+            row.token: row
+            for row in SearchToken.objects.filter(kind=kind, object_id=instance.pk)
+        }
+        stale = [row.pk for token, row in existing.items() if token not in tokens]
+        changed = []
+        for token, weight in tokens.items():
+            row = existing.get(token)
+            if row is not None and row.weight != weight:
+                row.weight = weight
+                changed.append(row)
+        new = [
+            SearchToken(kind=kind, object_id=instance.pk, token=token, weight=weight)
+            for token, weight in tokens.items()
+            if token not in existing
+        ]
+
+        with transaction.atomic():
+            if stale:
+                SearchToken.objects.filter(pk__in=stale).delete()
+            if changed:
+                SearchToken.objects.bulk_update(changed, ['weight'])
+            if new:
+                SearchToken.objects.bulk_create(new)
+
+    def remove_instance(self, kind, pk):
+        SearchToken.objects.filter(kind=kind, object_id=pk).delete()
+
+    def rebuild(self, kinds=None, batch_size=500):
+        """Rebuild the index for the given kinds (all by default)"""
+        total = 0
+        for kind in kinds or INDEXED_MODELS:
+            model, build_document = INDEXED_MODELS[kind]
+            SearchToken.objects.filter(kind=kind).delete()
+            rows = []
+            for instance in model.objects.order_by('pk').iterator(chunk_size=batch_size):
+                tokens = document_tokens(build_document(instance))
+                rows.extend(
+                    SearchToken(kind=kind, object_id=instance.pk, token=token, weight=weight)
+                    for token, weight in tokens.items()
+                )
+                if len(rows) >= batch_size:
+                    SearchToken.objects.bulk_create(rows)
+                    rows = []
+                total += 1
+            SearchToken.objects.bulk_create(rows)
+        return total
+
+    def matches(self, kind, terms):
+        """Token rows of documents containing every term, grouped per object"""
+        return SearchToken.objects.filter(
+            kind=kind,
+            token__in=terms
+        ).values('object_id').annotate(
+            matched=Count('token'),
+            score=Sum('weight')
+        ).filter(matched=len(terms))
+
+    def search(self, queryset, kind, query):
+        terms = query_terms(query)
+        if not terms:
+            return queryset
+
+        matches = self.matches(kind, terms)
+        rank = matches.filter(object_id=OuterRef('pk')).values('score')
+        return queryset.filter(
+            pk__in=matches.values('object_id')
+        ).annotate(
+            search_rank=Subquery(rank)
+        )
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """
+    Return the configured text search backend instance.
+
+    TEXT_SEARCH_BACKEND is a dotted path to a BaseSearchBackend subclass,
+    or None to fall back to DRF's icontains SearchFilter.
+    """
+    path = getattr(settings, 'TEXT_SEARCH_BACKEND', 'api.text_search.InvertedIndexBackend')
+    if not path:
+        return None
+    return import_string(path)()
@@ -10,7 +10,9 @@ from .views import (
     ProviderProfileViewSet,
     MachineViewSet,
     ChatRoomViewSet,
-    MessageViewSet
+    MessageViewSet,
+    AutocompleteViewSet,
+    PresenceViewSet
 )
 
 # Router for ViewSets
@@ -23,6 +25,8 @@ router.register(r'providers', ProviderProfileViewSet, basename='provider')
 router.register(r'machines', MachineViewSet, basename='machine')
 router.register(r'chat-rooms', ChatRoomViewSet, basename='chat-room')
 router.register(r'messages', MessageViewSet, basename='message')
+router.register(r'autocomplete', AutocompleteViewSet, basename='autocomplete')
+router.register(r'presence', PresenceViewSet, basename='presence')
 
 # URL patterns
 urlpatterns = [
@@ -5,9 +5,11 @@ Django REST Framework ViewSets for ConnecMaq API.
 from rest_framework import viewsets, status, filters, serializers as drf_serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly
+from rest_framework.settings import api_settings
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly, IsAdminUser
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Count
+from django.db.models import Q, F, OuterRef, Subquery
+from django.db.models.functions import Lower
 from django.shortcuts import get_object_or_404
 
 from .models import (
@@ -16,8 +18,14 @@ from .models import (
     Machine,
     MachineImage,
     ChatRoom,
-    Message
+    Message,
+    ProviderSearchIndex
 )
+from .search_index import category_bit
+from .geo import annotate_distance, DEFAULT_NEAREST_RADIUS_KM
+from . import search_cache, facets, ranking, autocomplete, read_receipts, memberships, presence, limits, db_pool, message_search
+from . import archive, history
+from .filters import TextSearchFilter
 from .serializers import (
     UserSerializer,
     UserRegistrationSerializer,
@@ -25,18 +33,37 @@ from .serializers import (
     ConstructorProfileSerializer,
     ProviderProfileSerializer,
     ProviderProfileListSerializer,
+    ProviderSearchResultSerializer,
     MachineListSerializer,
+    MachineSearchResultSerializer,
     MachineDetailSerializer,
     MachineImageSerializer,
     ChatRoomListSerializer,
     ChatRoomDetailSerializer,
     MessageSerializer,
-    ProviderSearchSerializer
+    ProviderSearchSerializer,
+    MachineSearchSerializer,
+    AutocompleteSerializer,
+    MessageWindowSerializer,
+    MessageSearchSerializer,
+    MessageSearchResultSerializer,
+    PresenceSerializer,
+    serialize_message_window
 )
 
 User = get_user_model()
 
 
+def get_search_origin(request, params):
+    """(lat, lng) from the search params or the constructor's profile, or None"""
+    if 'lat' in params:
+        return params['lat'], params['lng']
+    profile = getattr(request.user, 'constructor_profile', None)
+    if profile is not None and profile.latitude is not None and profile.longitude is not None:
+        return profile.latitude, profile.longitude
+    return None
+
+
 # ==================== USER VIEWSETS ====================
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -128,18 +155,23 @@ class ProviderProfileViewSet(viewsets.ModelViewSet):
     - PUT/PATCH /api/providers/{id}/ - Update provider profile
     - DELETE /api/providers/{id}/ - Delete provider profile
     - GET /api/providers/search/ - Search providers with filters
+    - GET /api/providers/search/facets/ - Facet counts for the search filters
+    - GET /api/providers/search/cache-stats/ - Search cache hit/miss metrics (staff)
     - PATCH /api/providers/{id}/toggle_availability/ - Toggle 48h availability
     """
     queryset = ProviderProfile.objects.all()
     serializer_class = ProviderProfileSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, TextSearchFilter]
     search_fields = ['company_name', 'description', 'city', 'region']
+    search_index_kind = 'provider'
     ordering_fields = ['rating', 'created_at', 'company_name']
     ordering = ['-available_within_48h', '-rating', '-created_at']
     
     def get_serializer_class(self):
-        if self.action == 'list' or self.action == 'search':
+        if self.action == 'search':
+            return ProviderSearchResultSerializer
+        if self.action == 'list':
             return ProviderProfileListSerializer
         return ProviderProfileSerializer
     
@@ -176,14 +208,143 @@ class ProviderProfileViewSet(viewsets.ModelViewSet):
         - available_within_48h: Filter by 48h availability (default: true)
         - min_rating: Minimum rating filter
         - verified_only: Show only verified providers
+        - lat, lng: Search origin (defaults to the constructor's profile location)
+        - radius_km: Only providers within this distance of the origin
+        - order_by_distance: Nearest first (within 100 km unless radius_km is given)
+        
+        Other searches are ordered by the weighted relevance score of
+        api/ranking.py (PROVIDER_RANKING setting).
         """
         # Validate search parameters
         search_serializer = ProviderSearchSerializer(data=request.query_params)
         search_serializer.is_valid(raise_exception=True)
         params = search_serializer.validated_data
         
-        # Start with active and verified providers
-        queryset = ProviderProfile.objects.filter(
+        origin = None
+        order_by_distance = params.get('order_by_distance', False)
+        if 'radius_km' in params or order_by_distance:
+            origin = get_search_origin(request, params)
+            if origin is None:
+                return Response(
+                    {'detail': 'Se requiere una ubicación (lat y lng) para buscar por distancia.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # Popular searches are served from the versioned result cache
+        cache_key = search_cache.make_key(request, params, origin)
+        cached = search_cache.get_response(cache_key)
+        if cached is not None:
+            return Response(cached)
+        
+        queryset = self.filter_search_index(params, origin)
+        
+        # Relevance ranking (see api/ranking.py) unless nearest-first is requested
+        if not order_by_distance and ranking.is_enabled() and hasattr(self.paginator, 'paginate_ranking'):
+            response = self.get_ranked_response(queryset, with_distance=origin is not None)
+            search_cache.store_response(cache_key, response.data)
+            return response
+        
+        # Order by availability, rating, and available machines count
+        ordering = ['-available_within_48h', '-rating', '-available_machines_count']
+        if order_by_distance:
+            ordering.insert(0, 'distance_km')
+        queryset = queryset.order_by(*ordering)
+        
+        # Paginate results
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = ProviderSearchResultSerializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = ProviderSearchResultSerializer(queryset, many=True)
+            response = Response(serializer.data)
+        
+        search_cache.store_response(cache_key, response.data)
+        return response
+    
+    @action(detail=False, methods=['get'], url_path='search/facets',
+            permission_classes=[AllowAny])
+    def search_facets(self, request):
+        """
+        Facet counts for the search page: matching providers per machine
+        category, region and city, plus 48h availability.
+        
+        Accepts the same query parameters as search. Each facet ignores its
+        own filter so every alternative value gets a count.
+        """
+        search_serializer = ProviderSearchSerializer(data=request.query_params)
+        search_serializer.is_valid(raise_exception=True)
+        params = search_serializer.validated_data
+        
+        origin = None
+        if 'radius_km' in params:
+            origin = get_search_origin(request, params)
+            if origin is None:
+                return Response(
+                    {'detail': 'Se requiere una ubicación (lat y lng) para buscar por distancia.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # The category facet depends on every category
+        cache_key = search_cache.make_key(
+            request, params, origin, kind='facets', namespace=search_cache.GLOBAL_NAMESPACE
+        )
+        cached = search_cache.get_response(cache_key)
+        if cached is not None:
+            return Response(cached)
+        
+        if 'min_rating' in params or origin is not None:
+            # Not expressible with the counters: one grouped pass over the
+            # index with every filter except the faceted ones
+            base_params = {
+                name: value for name, value in params.items()
+                if name not in ('category', 'region', 'city')
+            }
+            base_params['available_within_48h'] = False
+            cells = facets.index_cells(self.filter_search_index(base_params, origin))
+        else:
+            cells = facets.counter_cells()
+        
+        data = facets.aggregate(cells, params)
+        search_cache.store_response(cache_key, data)
+        return Response(data)
+    
+    @action(detail=False, methods=['get'], url_path='search/cache-stats',
+            permission_classes=[IsAdminUser])
+    def search_cache_stats(self, request):
+        """Hit/miss counters of the provider search cache (staff only)"""
+        return Response(search_cache.stats())
+    
+    def get_ranked_response(self, queryset, with_distance=False):
+        """
+        Score every candidate in memory, then load only the rows of the
+        requested page.
+        """
+        ranked = ranking.get_ranker().rank(queryset, with_distance)
+        page = self.paginator.paginate_ranking(ranked, self.request, view=self)
+        
+        rows = ProviderSearchIndex.objects.in_bulk([item.pk for item in page])
+        results = []
+        for item in page:
+            row = rows.get(item.pk)
+            if row is None:
+                continue
+            row.score = round(item.score, 4)
+            if with_distance:
+                row.distance_km = item.distance_km
+            results.append(row)
+        
+        serializer = ProviderSearchResultSerializer(results, many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+    
+    def filter_search_index(self, params, origin=None):
+        """
+        Apply validated ProviderSearchSerializer filters to the search index.
+        
+        Reads from the denormalized ProviderSearchIndex (one row per provider,
+        maintained by api/signals.py) instead of joining Machine.
+        """
+        queryset = ProviderSearchIndex.objects.filter(
             subscription_status='active',
             is_verified=True
         )
@@ -204,32 +365,22 @@ class ProviderProfileViewSet(viewsets.ModelViewSet):
         if params.get('verified_only', False):
             queryset = queryset.filter(is_verified=True)
         
-        # Filter by machine category if specified
+        # Filter by machine category using the category bit set
         if 'category' in params:
-            queryset = queryset.filter(
-                machines__category=params['category']
-            ).distinct()
-        
-        # Annotate with machine count
-        queryset = queryset.annotate(
-            machines_count=Count('machines', filter=Q(machines__is_available=True))
-        )
-        
-        # Order by availability, rating, and machines count
-        queryset = queryset.order_by(
-            '-available_within_48h',
-            '-rating',
-            '-machines_count'
-        )
+            bit = category_bit(params['category'])
+            if bit is None:
+                queryset = queryset.none()
+            else:
+                queryset = queryset.annotate(
+                    category_match=F('category_mask').bitand(bit)
+                ).filter(category_match__gt=0)
+        
+        # Location: prune by grid cell, then exact distance
+        if origin is not None:
+            radius_km = params.get('radius_km', DEFAULT_NEAREST_RADIUS_KM)
+            queryset = annotate_distance(queryset, *origin, radius_km=radius_km)
         
-        # Paginate results
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = ProviderProfileListSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = ProviderProfileListSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return queryset
     
     @action(detail=True, methods=['patch'], permission_classes=[IsAuthenticated])
     def toggle_availability(self, request, pk=None):
@@ -246,9 +397,10 @@ class ProviderProfileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Toggle availability
+        # Toggle availability (partial save so the search index
+        # only rewrites the changed column)
         provider.available_within_48h = not provider.available_within_48h
-        provider.save()
+        provider.save(update_fields=['available_within_48h', 'updated_at'])
         
         serializer = self.get_serializer(provider)
         return Response(serializer.data)
@@ -266,17 +418,21 @@ class MachineViewSet(viewsets.ModelViewSet):
     - GET /api/machines/{id}/ - Get machine detail
     - PUT/PATCH /api/machines/{id}/ - Update machine
     - DELETE /api/machines/{id}/ - Delete machine
+    - GET /api/machines/search/ - Search machines with price/year/location filters
     - PATCH /api/machines/{id}/toggle_availability/ - Toggle availability
     """
     queryset = Machine.objects.all()
     serializer_class = MachineDetailSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, TextSearchFilter]
     search_fields = ['name', 'description', 'brand', 'model', 'category']
+    search_index_kind = 'machine'
     ordering_fields = ['created_at', 'price_per_day', 'name']
     ordering = ['-created_at']
     
     def get_serializer_class(self):
+        if self.action == 'search':
+            return MachineSearchResultSerializer
         if self.action == 'list':
             return MachineListSerializer
         return MachineDetailSerializer
@@ -315,6 +471,109 @@ class MachineViewSet(viewsets.ModelViewSet):
                 'Debes tener un perfil de proveedor para crear maquinaria.'
             )
     
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    def search(self, request):
+        """
+        Search individual machines from active, verified providers.
+        
+        Query Parameters:
+        - category: Machine category filter
+        - brand, model: Exact match, case-insensitive
+        - min_price_per_hour, max_price_per_hour: Hourly rate range
+        - min_price_per_day, max_price_per_day: Daily rate range
+        - min_year, max_year: Manufacturing year range
+        - available_only: Only available machines (default: true)
+        - city, region: Provider location filters
+        - lat, lng: Search origin (defaults to the constructor's profile location)
+        - radius_km: Only machines whose provider is within this distance
+        - ordering: -created_at (default), [-]price_per_day, [-]price_per_hour,
+          [-]year or distance
+        """
+        search_serializer = MachineSearchSerializer(data=request.query_params)
+        search_serializer.is_valid(raise_exception=True)
+        params = search_serializer.validated_data
+        
+        ordering = params['ordering']
+        origin = None
+        if 'radius_km' in params or ordering == 'distance':
+            origin = get_search_origin(request, params)
+            if origin is None:
+                return Response(
+                    {'detail': 'Se requiere una ubicación (lat y lng) para buscar por distancia.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        queryset = self.filter_search(params, origin)
+        if ordering == 'distance':
+            queryset = queryset.order_by('distance_km', '-created_at')
+        else:
+            queryset = queryset.order_by(ordering)
+        
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+    
+    def filter_search(self, params, origin=None):
+        """
+        Apply validated MachineSearchSerializer filters.
+        
+        Machine filters lead with category/is_available so the composite
+        indexes on Machine drive the query; provider conditions are resolved
+        against ProviderSearchIndex in a subquery instead of joining
+        ProviderProfile.
+        """
+        queryset = Machine.objects.select_related('provider')
+        
+        if 'category' in params:
+            queryset = queryset.filter(category=params['category'])
+        
+        if params.get('available_only', True):
+            queryset = queryset.filter(is_available=True)
+        
+        if 'brand' in params:
+            queryset = queryset.alias(
+                brand_lower=Lower('brand')
+            ).filter(brand_lower=params['brand'].strip().lower())
+        
+        if 'model' in params:
+            queryset = queryset.alias(
+                model_lower=Lower('model')
+            ).filter(model_lower=params['model'].strip().lower())
+        
+        # Price and year ranges
+        for field in ('price_per_hour', 'price_per_day', 'year'):
+            if f'min_{field}' in params:
+                queryset = queryset.filter(**{f'{field}__gte': params[f'min_{field}']})
+            if f'max_{field}' in params:
+                queryset = queryset.filter(**{f'{field}__lte': params[f'max_{field}']})
+        
+        # Only machines from searchable providers
+        providers = ProviderSearchIndex.objects.filter(
+            subscription_status='active',
+            is_verified=True
+        )
+        if 'city' in params:
+            providers = providers.filter(city__icontains=params['city'])
+        if 'region' in params:
+            providers = providers.filter(region__icontains=params['region'])
+        queryset = queryset.filter(provider_id__in=providers.values('provider_id'))
+        
+        # Distance to the machine's provider, pruned by grid cell
+        if origin is not None:
+            queryset = annotate_distance(
+                queryset, *origin,
+                radius_km=params.get('radius_km'),
+                field='provider__search_index__geo_cell',
+                lat_field='provider__search_index__latitude',
+                lng_field='provider__search_index__longitude'
+            )
+        
+        return queryset
+    
     @action(detail=True, methods=['patch'], permission_classes=[IsAuthenticated])
     def toggle_availability(self, request, pk=None):
         """Toggle machine availability status"""
@@ -329,7 +588,7 @@ class MachineViewSet(viewsets.ModelViewSet):
         
         # Toggle availability
         machine.is_available = not machine.is_available
-        machine.save()
+        machine.save(update_fields=['is_available', 'updated_at'])
         
         serializer = self.get_serializer(machine)
         return Response(serializer.data)
@@ -364,6 +623,36 @@ class MachineViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+# ==================== AUTOCOMPLETE VIEWSETS ====================
+
+class AutocompleteViewSet(viewsets.ViewSet):
+    """
+    Typeahead suggestions for the search box, served from the in-memory
+    prefix index (api/autocomplete.py) without database queries.
+    
+    Endpoints:
+    - GET /api/autocomplete/?q=exc - Suggestions for the text typed so far
+    
+    Query Parameters:
+    - q: Text typed so far (matches the start of any word)
+    - kinds: company, machine, brand, model and/or city (repeatable)
+    - limit: Maximum suggestions (default 8, max 20)
+    """
+    permission_classes = [AllowAny]
+    
+    def list(self, request):
+        params_serializer = AutocompleteSerializer(data=request.query_params)
+        params_serializer.is_valid(raise_exception=True)
+        params = params_serializer.validated_data
+        
+        suggestions = autocomplete.get_index().suggest(
+            params['q'],
+            limit=params['limit'],
+            kinds=params.get('kinds') or None
+        )
+        return Response({'query': params['q'], 'results': suggestions})
+
+
 # ==================== CHAT VIEWSETS ====================
 
 class ChatRoomViewSet(viewsets.ModelViewSet):
@@ -373,7 +662,8 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     Endpoints:
     - GET /api/chat-rooms/ - List user's chat rooms
     - POST /api/chat-rooms/ - Create or get existing chat room
-    - GET /api/chat-rooms/{id}/ - Get chat room with messages
+    - GET /api/chat-rooms/{id}/ - Get chat room with its latest messages
+    - GET /api/chat-rooms/{id}/messages/?before={cursor} - Older messages
     - DELETE /api/chat-rooms/{id}/ - Delete chat room
     - GET /api/chat-rooms/find_or_create/ - Find or create chat between two users
     """
@@ -388,9 +678,71 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         # Users can only see their own chat rooms
-        return ChatRoom.objects.filter(
+        queryset = ChatRoom.objects.filter(
             participants=self.request.user
         ).distinct()
+        
+        if self.action == 'list':
+            # Inbox: participants in one query, id of the latest message
+            # through the (room, id) index (ids follow the send order)
+            latest = Message.objects.filter(
+                room=OuterRef('pk')
+            ).order_by('-id').values('id')[:1]
+            queryset = queryset.prefetch_related('participants').annotate(
+                latest_message_id=Subquery(latest)
+            )
+        
+        return queryset
+    
+    def list(self, request, *args, **kwargs):
+        """
+        Inbox with a fixed number of queries regardless of room count:
+        rooms, participants, last messages, unread counts and read watermarks.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rooms = page if page is not None else list(queryset)
+        
+        context = self.get_serializer_context()
+        context.update(self.get_inbox_context(rooms))
+        serializer = ChatRoomListSerializer(rooms, many=True, context=context)
+        
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+    
+    def get_inbox_context(self, rooms):
+        """Load last messages and unread counts for a page of rooms in bulk"""
+        last_messages = Message.objects.in_bulk([
+            room.latest_message_id for room in rooms
+            if room.latest_message_id is not None
+        ])
+        room_ids = [room.id for room in rooms]
+        return {
+            'last_messages': last_messages,
+            'unread_counts': read_receipts.unread_counts(self.request.user.id, room_ids),
+            'read_watermarks': read_receipts.watermarks(room_ids),
+        }
+    
+    @action(detail=True, methods=['get'])
+    def messages(self, request, pk=None):
+        """
+        A window of older messages, walking back by id.
+        
+        Query params: before (messages_cursor of the previous response), limit
+        Response: {"messages": [...], "authors": {id: user}, "messages_cursor": id or null}
+        """
+        room = self.get_object()
+        params_serializer = MessageWindowSerializer(data=request.query_params)
+        params_serializer.is_valid(raise_exception=True)
+        params = params_serializer.validated_data
+        
+        return Response(serialize_message_window(
+            room.id,
+            self.get_serializer_context(),
+            before_id=params.get('before'),
+            limit=params.get('limit')
+        ))
     
     @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
     def find_or_create(self, request):
@@ -410,17 +762,14 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         # Get the other user
         other_user = get_object_or_404(User, id=other_user_id)
         
-        # Check if a chat room already exists between these two users
-        chat_room = ChatRoom.objects.filter(
-            participants=request.user
-        ).filter(
-            participants=other_user
-        ).first()
+        if other_user.id == request.user.id:
+            return Response(
+                {'detail': 'No puedes iniciar un chat contigo mismo.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # If not, create a new one
-        if not chat_room:
-            chat_room = ChatRoom.objects.create()
-            chat_room.participants.add(request.user, other_user)
+        # One lookup on the room's (lower id, higher id) pair key
+        chat_room, _ = memberships.get_or_create_direct_room(request.user.id, other_user.id)
         
         serializer = ChatRoomDetailSerializer(chat_room, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -431,19 +780,23 @@ class MessageViewSet(viewsets.ModelViewSet):
     ViewSet for Messages.
     
     Endpoints:
-    - GET /api/messages/ - List messages (filtered by room)
+    - GET /api/messages/ - List messages (filtered by room, archived ones included)
     - POST /api/messages/ - Send a message
     - GET /api/messages/{id}/ - Get message detail
-    - PATCH /api/messages/{id}/ - Update message (mark as read)
+    - PATCH /api/messages/{id}/ - Update message
     - DELETE /api/messages/{id}/ - Delete message
-    - POST /api/messages/{id}/mark_read/ - Mark message as read
+    - POST /api/messages/{id}/mark_read/ - Mark message (and earlier ones) as read
+    - POST /api/messages/mark_room_read/ - Mark all messages in a room as read
+    - GET /api/messages/search/?q=... - Search the messages of your chat rooms
+    - GET /api/messages/limits-stats/ - WebSocket rate limit counters (staff)
+    - GET /api/messages/db-pool-stats/ - Chat database pool queue and timings (staff)
     """
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.OrderingFilter]
-    ordering_fields = ['timestamp']
-    ordering = ['timestamp']
+    ordering_fields = ['id', 'timestamp']
+    ordering = ['id']
     
     def get_queryset(self):
         queryset = Message.objects.filter(
@@ -457,19 +810,54 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        """
+        The messages of a room (?room=) that has archived messages are read
+        across the live table and the archive (api/archive.py) and paged by
+        id with the usual cursors: ordering -id or -timestamp lists them
+        newest first, anything else oldest first. ?page= is not available
+        there. Other listings only see live messages.
+        """
+        room_id = request.query_params.get('room')
+        try:
+            room_id = int(room_id) if room_id else None
+        except ValueError:
+            room_id = None
+        if (
+            room_id is None
+            or not archive.has_segments(room_id)
+            or not memberships.is_participant(request.user.id, room_id)
+        ):
+            return super().list(request, *args, **kwargs)
+        
+        ordering = request.query_params.get(api_settings.ORDERING_PARAM, '')
+        page = self.paginator.paginate_by_id(
+            lambda before_id, limit: history.load_window(room_id, before_id, limit),
+            lambda after_id, limit: history.load_after(room_id, after_id, limit),
+            request,
+            descending=ordering.startswith('-')
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
     def perform_create(self, serializer):
         # Automatically set the author to the current user
         serializer.save(author=self.request.user)
     
+    def perform_destroy(self, instance):
+        message_id = instance.pk
+        instance.delete()
+        message_search.remove_message(message_id)
+    
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def mark_read(self, request, pk=None):
-        """Mark a message as read"""
+        """Mark a message, and every earlier one in its room, as read"""
         message = self.get_object()
         
         # Only the recipient can mark as read (not the author)
-        if message.author != request.user:
-            message.read = True
-            message.save()
+        if message.author_id != request.user.id:
+            if read_receipts.advance(message.room_id, request.user.id, message.id, verify=False) is not None:
+                read_receipts.broadcast(message.room_id, request.user.id, message.id)
         
         serializer = self.get_serializer(message)
         return Response(serializer.data)
@@ -489,14 +877,85 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Mark all unread messages in the room as read (except own messages)
-        updated_count = Message.objects.filter(
-            room_id=room_id,
-            read=False
-        ).exclude(
-            author=request.user
-        ).update(read=True)
+        room = get_object_or_404(ChatRoom.objects.filter(participants=request.user), pk=room_id)
+        updated_count = read_receipts.mark_room_read(room.id, request.user.id)
         
         return Response({
             'detail': f'{updated_count} mensajes marcados como leídos.'
         })
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Messages of your chat rooms containing every word of q, newest first,
+        each with a snippet highlighting the matches (api/message_search.py).
+        
+        Query Parameters:
+        - q: Words to find (accents and plurals don't matter)
+        - room: Only search this chat room
+        - before: next_before of the previous page
+        - limit: Results per page (default 20, at most 100)
+        """
+        params_serializer = MessageSearchSerializer(data=request.query_params)
+        params_serializer.is_valid(raise_exception=True)
+        params = params_serializer.validated_data
+        
+        messages, terms, next_before = message_search.search(
+            request.user.id,
+            params['q'],
+            room_id=params.get('room'),
+            before_id=params.get('before'),
+            limit=params['limit']
+        )
+        authors = {}
+        for message in messages:
+            authors.setdefault(message.author_id, message.author)
+        
+        context = self.get_serializer_context()
+        context['terms'] = terms
+        return Response({
+            'results': MessageSearchResultSerializer(messages, many=True, context=context).data,
+            'authors': {
+                str(author_id): UserSerializer(author, context=context).data
+                for author_id, author in authors.items()
+            },
+            'next_before': next_before,
+        })
+    
+    @action(detail=False, methods=['get'], url_path='limits-stats',
+            permission_classes=[IsAdminUser])
+    def limits_stats(self, request):
+        """Frames throttled, dropped and sockets closed by the chat limits in this process (staff only)"""
+        return Response(limits.stats())
+    
+    @action(detail=False, methods=['get'], url_path='db-pool-stats',
+            permission_classes=[IsAdminUser])
+    def db_pool_stats(self, request):
+        """Queue depth, wait and run times of the chat database pool in this process (staff only)"""
+        return Response(db_pool.stats())
+
+
+class PresenceViewSet(viewsets.ViewSet):
+    """
+    Presence of many users at once, from memory (api/presence.py), without
+    touching the database beyond one query for who shares a room with you.
+    
+    Endpoints:
+    - GET /api/presence/?users=2,5,9 - Status and last seen time of each user
+    
+    Query Parameters:
+    - users: Comma-separated user ids (at most 500)
+    
+    Only users who share a chat room with you (and yourself) are returned.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def list(self, request):
+        params_serializer = PresenceSerializer(data=request.query_params)
+        params_serializer.is_valid(raise_exception=True)
+        user_ids = params_serializer.validated_data['users']
+        
+        visible = memberships.contacts(request.user.id, user_ids)
+        visible.add(request.user.id)
+        states = presence.bulk([user_id for user_id in user_ids if user_id in visible])
+        return Response({'results': [states[user_id] for user_id in user_ids if user_id in states]})
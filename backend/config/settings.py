@@ -153,7 +153,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Keyset (cursor) pagination; ?page=N keeps the old page-number mode
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': (
         'rest_framework.filters.SearchFilter',
@@ -162,6 +163,48 @@ REST_FRAMEWORK = {
 }
 
 
+# Cache (used by the provider search result cache)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',  # For development
+        # For production, share the cache between workers with Redis:
+        # 'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        # 'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
+
+# Provider search result cache (entries are invalidated by version bumps,
+# the TTL only bounds memory use)
+PROVIDER_SEARCH_CACHE = 'default'
+PROVIDER_SEARCH_CACHE_TTL = config('PROVIDER_SEARCH_CACHE_TTL', default=300, cast=int)
+
+
+# Relevance ranking of provider search results (see api/ranking.py for the
+# features and every available option). Requires NumPy; without it the
+# search falls back to ordering by availability, rating and machines.
+PROVIDER_RANKING = {
+    'WEIGHTS': {
+        'available': 3.0,
+        'rating': 2.0,
+        'reviews': 1.0,
+        'machines': 1.0,
+        'distance': 2.0,
+        'recency': 0.5,
+    },
+}
+
+
+# Text search backend used by the ?search= parameter of the provider and
+# machine endpoints (dotted path to an api.text_search.BaseSearchBackend).
+# Set to None to fall back to DRF's icontains SearchFilter.
+TEXT_SEARCH_BACKEND = 'api.text_search.InvertedIndexBackend'
+
+
+# Seconds after which each process rebuilds its in-memory autocomplete
+# index in the background, to pick up changes made by other processes
+AUTOCOMPLETE_REBUILD_INTERVAL = config('AUTOCOMPLETE_REBUILD_INTERVAL', default=600, cast=int)
+
+
 # JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
@@ -201,10 +244,21 @@ CORS_ALLOW_CREDENTIALS = True
 
 
 # Django Channels configuration (for WebSockets)
+# Groups are shared by every ASGI worker process of this host through a Unix
+# socket (api/layers.py), so several workers can serve the chat. Use
+# 'channels.layers.InMemoryChannelLayer' for a single process.
+# The socket goes in $XDG_RUNTIME_DIR/connecmaq, or run/ here when that is
+# not set; CHANNEL_LAYER_SOCKET must be in a directory only this user can
+# write to (e.g. /run/connecmaq/channels.sock).
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',  # For development
-        # For production, use Redis:
+        'BACKEND': 'api.layers.UnixSocketChannelLayer',
+        'CONFIG': {
+            'path': config('CHANNEL_LAYER_SOCKET', default=None),
+            'capacity': 100,
+            'expiry': 60,
+        },
+        # For several hosts, use Redis:
         # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
         # 'CONFIG': {
         #     "hosts": [('127.0.0.1', 6379)],
@@ -212,6 +266,111 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Seconds a WebSocket user loaded for a JWT is reused by the auth middleware
+# (api/middleware.py) before being read from the database again
+WEBSOCKET_USER_CACHE_TTL = config('WEBSOCKET_USER_CACHE_TTL', default=60, cast=int)
+
+# Chat room membership cache used to authorize WebSocket connects
+# (api/memberships.py). Set CHAT_MEMBERSHIP_CACHE to a cache alias shared by
+# all workers (e.g. Redis) to add a shared tier to the in-process one.
+CHAT_MEMBERSHIP_CACHE = None
+CHAT_MEMBERSHIP_LOCAL_TTL = 30
+CHAT_MEMBERSHIP_SHARED_TTL = 300
+
+# Threads for the database work of chat WebSockets (api/db_pool.py), so one
+# slow query doesn't stall every socket of a worker. Each thread keeps its
+# connection for CONN_MAX_AGE seconds; past MAX_QUEUE waiting jobs, sockets
+# wait for a slot. SIZE 0 uses the single database_sync_to_async thread.
+CHAT_DB_POOL = {
+    'SIZE': 4,
+    'MAX_QUEUE': 1000,
+    'CONN_MAX_AGE': 600,
+}
+
+# Persistence of messages sent over WebSockets (see api/message_writer.py).
+# MODE 'write_behind' broadcasts first and writes in batches every
+# FLUSH_INTERVAL seconds; 'sync' writes before broadcasting. ACK tells the
+# sender 'accepted' (right away), 'persisted' (once committed) or 'none'.
+CHAT_PERSISTENCE = {
+    'MODE': 'write_behind',
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_BATCH': 500,
+    'ACK': 'persisted',
+}
+
+# Seconds WebSocket read receipts are held so a burst of them becomes one
+# watermark update and one broadcast (api/read_receipts.py)
+CHAT_READ_RECEIPT_DELAY = 0.5
+
+# Resuming chat sockets (api/history.py): recent messages kept in memory per
+# room, most messages sent on a resume, messages per history frame and the
+# seconds a resume goes back before the last seen message (messages from
+# different workers can arrive out of id order)
+CHAT_HISTORY_BUFFER_SIZE = 200
+CHAT_HISTORY_SYNC_LIMIT = 500
+CHAT_HISTORY_CHUNK_SIZE = 50
+CHAT_HISTORY_RESUME_OVERLAP = 5
+
+# Messages in a chat room detail response and per older window
+CHAT_ROOM_MESSAGES_WINDOW = 50
+
+# Limits on chat WebSockets (api/limits.py): frame and message sizes in
+# characters, frames per second per connection and messages per second per
+# user (with bursts; the user's bucket is kept BUCKET_TTL seconds after their
+# last socket closes), throttled frames in a row before disconnecting, and
+# frames queued for a slow client before SLOW_CONSUMER ('drop' or
+# 'disconnect') applies.
+CHAT_LIMITS = {
+    'MAX_FRAME_SIZE': 16384,
+    'MAX_MESSAGE_LENGTH': 4000,
+    'FRAME_RATE': 20,
+    'FRAME_BURST': 40,
+    'MESSAGE_RATE': 5,
+    'MESSAGE_BURST': 15,
+    'BUCKET_TTL': 300,
+    'MAX_STRIKES': 100,
+    'SEND_QUEUE': 500,
+    'SLOW_CONSUMER': 'drop',
+}
+
+# Encoding of chat WebSocket frames (api/frames.py): broadcast frames are
+# encoded once per room, not per socket. CHAT_FRAME_ENCODER is 'auto' (orjson
+# when installed), 'orjson' or 'json'; CHAT_BINARY_FRAMES also encodes them as
+# msgpack for sockets opened with ?format=msgpack.
+CHAT_FRAME_ENCODER = 'auto'
+CHAT_BINARY_FRAMES = True
+
+# Archive of old chat messages (api/archive.py, archive_messages command).
+# Messages older than AFTER_DAYS, outside a room's KEEP_RECENT latest and read
+# by every other participant move to compressed segments of up to
+# SEGMENT_SIZE messages (at least MIN_SEGMENT), stored in the database or,
+# with STORAGE 'file', under MEDIA_ROOT/chat-archive. History reads them
+# transparently; CACHE_SEGMENTS decoded segments are kept per process.
+CHAT_ARCHIVE = {
+    'AFTER_DAYS': 90,
+    'KEEP_RECENT': 200,
+    'SEGMENT_SIZE': 1000,
+    'MIN_SEGMENT': 100,
+    'STORAGE': 'database',
+    'CACHE_SEGMENTS': 64,
+}
+
+# Presence and typing indicators, kept in memory (api/presence.py). A user not
+# heard from in PRESENCE_TTL seconds is offline; changes are sent to the rooms
+# at most once per PRESENCE_TICK seconds. PRESENCE_CACHE is required with more
+# than one worker process (or REST served by other processes): set it to a cache
+# alias shared by all of them (e.g. Redis), or GET /api/presence/ only sees the
+# users connected to the process that answers it. None is for a single process;
+# with a channel layer that spans processes (the default one does) the api.W002
+# system check warns about it, silence it with SILENCED_SYSTEM_CHECKS if you
+# only run one.
+PRESENCE_TTL = 60
+PRESENCE_TICK = 0.25
+PRESENCE_SWEEP_BATCH = 2000
+PRESENCE_MAX_ENTRIES = 100000
+PRESENCE_CACHE = None
+CHAT_TYPING_TTL = 6
+
 
 # Email configuration (for password reset, notifications, etc.)
 # For development, use console backend
@@ -17,6 +17,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
 from django.contrib.auth import get_user_model
+from api import read_receipts
 from api.models import (
     ConstructorProfile,
     ProviderProfile,
@@ -186,9 +187,8 @@ def test_api():
     )
     print(f"   ✅ Mensaje de {message2.author.first_name}: {message2.content[:50]}...")
     
-    # Marcar mensaje como leído
-    message1.read = True
-    message1.save()
+    # Marcar mensaje como leído (mueve la marca de lectura del proveedor)
+    read_receipts.advance(chat_room.id, provider_user.id, message1.id)
     print(f"   ✅ Mensaje marcado como leído")
     
     # 7. Toggle de disponibilidad
@@ -213,8 +213,12 @@ def test_api():
     print(f"      - Disponible: {Machine.objects.filter(is_available=True).count()}")
     print(f"   💬 Salas de chat: {ChatRoom.objects.count()}")
     print(f"   📨 Mensajes: {Message.objects.count()}")
-    print(f"      - Leídos: {Message.objects.filter(read=True).count()}")
-    print(f"      - No leídos: {Message.objects.filter(read=False).count()}")
+    # Un mensaje está leído cuando la marca de lectura de otro participante lo alcanza
+    messages = list(Message.objects.only('id', 'room_id', 'author_id'))
+    room_watermarks = read_receipts.watermarks({message.room_id for message in messages})
+    read_count = sum(read_receipts.is_read(message, room_watermarks[message.room_id]) for message in messages)
+    print(f"      - Leídos: {read_count}")
+    print(f"      - No leídos: {len(messages) - read_count}")
     
     print("\n✅ ¡Todas las pruebas completadas exitosamente!")
     print("\n📝 Credenciales de prueba:")